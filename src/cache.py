@@ -0,0 +1,303 @@
+import ast
+import functools
+import hashlib
+import io
+import json
+import os
+import site
+import sys
+import sysconfig
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+# On-disk cache of run.py results, keyed by everything that can change
+# the result of a run: the preprocessed program, the values file, the
+# working directory, and the files the run itself read.
+
+CACHE_DIR: str = os.environ.get("RUNPY_CACHE_DIR", os.path.join(tempfile.gettempdir(), "runpy-cache"))
+CACHE_MAX_BYTES: int = int(os.environ.get("RUNPY_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# If set, every lookup appends "hit" or "miss" to this file
+CACHE_LOG: Optional[str] = os.environ.get("RUNPY_CACHE_LOG")
+
+# Programs using any of these may give a different result on every run
+NONDETERMINISTIC_MODULES = {
+	"random", "time", "datetime", "secrets", "uuid", "socket", "ssl",
+	"http", "urllib", "requests", "subprocess", "threading", "multiprocessing",
+	"asyncio", "select", "signal", "getpass", "fileinput",
+}
+NONDETERMINISTIC_ATTRS = {"random", "now", "today", "urandom", "getpid"}
+NONDETERMINISTIC_CALLS = {"input", "id", "hash"}
+
+
+def enabled() -> bool:
+	# Opt-in: a run can depend on more than RunRecorder sees
+	return os.environ.get("RUNPY_CACHE", "0") != "0"
+
+
+@functools.lru_cache(maxsize=None)
+def library_dirs() -> Tuple[str, ...]:
+	# Where the Python install, site-packages (the user's too) and
+	# PYTHONPATH keep their modules
+	dirs = {sys.prefix, sys.exec_prefix, sys.base_prefix, sys.base_exec_prefix}
+	dirs.update(sysconfig.get_paths().values())
+	if hasattr(site, "getsitepackages"):
+		dirs.update(site.getsitepackages())
+	dirs.add(site.getusersitepackages())
+	dirs.update(os.environ.get("PYTHONPATH", "").split(os.pathsep))
+	return tuple(os.path.join(os.path.realpath(d), "") for d in dirs if d)
+
+
+def is_library_file(file_name) -> bool:
+	# Files of the current directory are the program's own, even if
+	# one of library_dirs holds them
+	path = os.path.realpath(file_name)
+	if path.startswith(os.path.join(os.path.realpath(os.getcwd()), "")):
+		return False
+	return path.startswith(library_dirs())
+
+
+def file_digest(file_name) -> str:
+	with open(file_name, "rb") as f:
+		return hashlib.sha256(f.read()).hexdigest()
+
+
+def cache_key(lines: List[str], values_file: Optional[str], cwd: str, options: str = "") -> str:
+	h = hashlib.sha256()
+	h.update("".join(lines).encode("utf-8", "surrogatepass"))
+	h.update(b"\0")
+	if values_file:
+		h.update(file_digest(values_file).encode())
+	h.update(b"\0")
+	h.update(cwd.encode("utf-8", "surrogatepass"))
+	h.update(b"\0")
+	h.update(sys.executable.encode("utf-8", "surrogatepass"))
+	h.update(b"\0")
+	h.update(options.encode("utf-8", "surrogatepass"))
+	# A new version of run.py may produce something different
+	for module in ("run", "core", "cache"):
+		m = sys.modules.get(module)
+		if m != None and getattr(m, "__file__", None):
+			h.update(str(os.path.getmtime(m.__file__)).encode())
+	return h.hexdigest()
+
+
+def entry_path(key: str) -> str:
+	return os.path.join(CACHE_DIR, key + ".json")
+
+
+def file_stamp(file_name) -> Optional[List[float]]:
+	# None for a file that doesn't exist, which a run that tried to
+	# open it depends on as much as on one that does. Directories'
+	# stamps change when files are added or removed.
+	try:
+		st = os.stat(file_name)
+	except OSError:
+		return None
+	return [st.st_mtime_ns, st.st_size]
+
+
+def log_lookup(hit: bool):
+	if CACHE_LOG:
+		with open(CACHE_LOG, "a") as f:
+			f.write("hit\n" if hit else "miss\n")
+
+
+def lookup(key: str) -> Optional[dict]:
+	path = entry_path(key)
+	try:
+		with open(path) as f:
+			entry = json.load(f)
+	except (OSError, ValueError):
+		log_lookup(False)
+		return None
+
+	for (dep, stamp) in entry["deps"].items():
+		if file_stamp(dep) != stamp:
+			log_lookup(False)
+			return None
+
+	# Entries are evicted least recently used first
+	try:
+		os.utime(path)
+	except OSError:
+		pass
+	log_lookup(True)
+	return entry
+
+
+def store(key: str, entry: dict, deps: List[str]):
+	entry["deps"] = {}
+	for dep in deps:
+		entry["deps"][dep] = file_stamp(dep)
+
+	try:
+		os.makedirs(CACHE_DIR, exist_ok=True)
+		path = entry_path(key)
+		with tempfile.NamedTemporaryFile("w", dir=CACHE_DIR, delete=False, suffix=".tmp") as f:
+			json.dump(entry, f)
+		os.replace(f.name, path)
+		evict(CACHE_MAX_BYTES)
+	except OSError:
+		# The cache is only an optimization
+		pass
+
+
+def evict(max_bytes: int):
+	entries = []
+	total = 0
+	with os.scandir(CACHE_DIR) as it:
+		for e in it:
+			if e.name.endswith(".json"):
+				st = e.stat()
+				entries.append((st.st_mtime, st.st_size, e.path))
+				total += st.st_size
+	entries.sort()
+	for (_, size, path) in entries:
+		if total <= max_bytes:
+			break
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+		total -= size
+
+
+class NondeterminismDetector(ast.NodeVisitor):
+	def __init__(self):
+		self.found = False
+
+	def visit_Import(self, node):
+		for alias in node.names:
+			if alias.name.split(".")[0] in NONDETERMINISTIC_MODULES:
+				self.found = True
+
+	def visit_ImportFrom(self, node):
+		if node.module != None and node.module.split(".")[0] in NONDETERMINISTIC_MODULES:
+			self.found = True
+		for alias in node.names:
+			if alias.name in NONDETERMINISTIC_ATTRS:
+				self.found = True
+
+	def visit_Attribute(self, node):
+		if node.attr in NONDETERMINISTIC_ATTRS:
+			self.found = True
+		self.generic_visit(node)
+
+	def visit_Call(self, node):
+		if isinstance(node.func, ast.Name) and node.func.id in NONDETERMINISTIC_CALLS:
+			self.found = True
+		self.generic_visit(node)
+
+
+def is_cacheable(code: str) -> bool:
+	try:
+		root = ast.parse(code)
+	except Exception:
+		return True
+	detector = NondeterminismDetector()
+	detector.visit(root)
+	return not detector.found
+
+
+class TeeOutput:
+	def __init__(self, stream):
+		self.stream = stream
+		self.copy = io.StringIO()
+
+	def write(self, s):
+		self.copy.write(s)
+		return self.stream.write(s)
+
+	def flush(self):
+		self.stream.flush()
+
+	def __getattr__(self, name):
+		return getattr(self.stream, name)
+
+
+# The RunRecorder recording right now, if any. Audit hooks can't be
+# removed, so the one hook, installed by the first recorder, passes
+# the events on to it.
+recording: Optional["RunRecorder"] = None
+audit_hook_installed = False
+
+# Flags of os.open (and of the "open" audit event) that write
+WRITE_FLAGS = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_TRUNC
+
+
+def audit(event, args):
+	recorder = recording
+	if recorder == None:
+		return
+	if event == "open":
+		recorder.record_open(*args[:3])
+	elif event == "os.listdir" or event == "os.scandir":
+		# The import system lists directories to find modules, deps
+		# already has the ones the run imported
+		if not sys._getframe(1).f_code.co_filename.startswith("<frozen"):
+			recorder.record_listing(args[0])
+
+
+class RunRecorder:
+	"""
+	Records everything a cache entry needs while a run executes: what
+	it printed, which files it opened or tried to open, which
+	directories it listed and which local modules it imported. Opens
+	and listings are seen through an audit hook, so every way of
+	opening a file counts, not only builtins.open. Runs that write
+	files are not cacheable, since replaying them would skip the
+	writes.
+	"""
+
+	def __init__(self, ignored_dirs: List[str] = []):
+		self.opened: Dict[str, bool] = {}
+		self.writes_files = False
+		# Our own files, e.g. the blob store
+		self.ignored_dirs = tuple(os.path.join(os.path.abspath(d), "") for d in ignored_dirs)
+
+	def __enter__(self):
+		global recording, audit_hook_installed
+		self.modules = set(sys.modules.keys())
+		self.stdout = TeeOutput(sys.stdout)
+		self.stderr = TeeOutput(sys.stderr)
+		(sys.stdout, sys.stderr) = (self.stdout, self.stderr)
+		if not audit_hook_installed:
+			sys.addaudithook(audit)
+			audit_hook_installed = True
+		recording = self
+		return self
+
+	def __exit__(self, *exc):
+		global recording
+		recording = None
+		(sys.stdout, sys.stderr) = (self.stdout.stream, self.stderr.stream)
+		return False
+
+	def record_open(self, file, mode, flags):
+		if not isinstance(file, (str, bytes, os.PathLike)):
+			# A file descriptor, opened before
+			return
+		path = os.path.abspath(os.fsdecode(file))
+		if path.startswith(self.ignored_dirs) or is_library_file(path):
+			return
+		self.opened[path] = True
+		if mode != None:
+			if any(c in mode for c in "wax+"):
+				self.writes_files = True
+		elif flags != None and flags & WRITE_FLAGS:
+			self.writes_files = True
+
+	def record_listing(self, directory):
+		if isinstance(directory, int):
+			return
+		path = os.path.abspath(os.fsdecode(directory if directory != None else "."))
+		if not path.startswith(self.ignored_dirs):
+			self.opened[path] = True
+
+	def deps(self) -> List[str]:
+		deps = list(self.opened.keys())
+		for name in set(sys.modules.keys()) - self.modules:
+			file_name = getattr(sys.modules[name], "__file__", None)
+			if file_name and not is_library_file(file_name):
+				deps.append(os.path.abspath(file_name))
+		return deps
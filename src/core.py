@@ -1,11 +1,21 @@
 import re
 import io
+import os
+import sys
+import time
+import types
 import base64
-from typing import List, Optional, Tuple
+import codecs
+import marshal
+import hashlib
+import functools
+import importlib.machinery
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
 import numpy as np
 import tokenize
 from PIL import Image
-import matplotlib.pyplot as plt
 
 # Code manipulation
 
@@ -18,7 +28,7 @@ def remove_comments_and_docstrings(source):
     https://stackoverflow.com/questions/1769332/script-to-remove-python-comments-docstrings
     '''
     io_obj = io.StringIO(source)
-    out = ''
+    out = []
     prev_toktype = tokenize.INDENT
     last_lineno = -1
     last_col = 0
@@ -31,87 +41,111 @@ def remove_comments_and_docstrings(source):
         if start_line > last_lineno:
             last_col = 0
         if start_col > last_col:
-            out += " " * (start_col - last_col)
+            # Keep the user's own whitespace (e.g. tabs) when we can
+            ws = ltext[last_col:start_col]
+            if len(ws) != start_col - last_col or ws.strip() != "":
+                ws = " " * (start_col - last_col)
+            out.append(ws)
         if token_type == tokenize.COMMENT:
-            if prev_toktype == tokenize.INDENT or prev_toktype == tokenize.NEWLINE:
-                out += ''
+            pass
         elif token_type == tokenize.STRING:
             if prev_toktype != tokenize.INDENT:
                 # NL == an empty line
                 if prev_toktype != tokenize.NEWLINE and prev_toktype != tokenize.NL:
                     # not a docstring
                     if start_col > 0:
-                        out += token_string
+                        out.append(token_string)
                 else:
                     # a top-level docstring
-                    out += '\n' * (end_line - start_line)
+                    out.append('\n' * (end_line - start_line))
             else:
                 # a docstring within function
-                out += '\n' * (end_line - start_line)
+                out.append('\n' * (end_line - start_line))
         else:
-            out += token_string
+            out.append(token_string)
         prev_toktype = token_type
         last_col = end_col
         last_lineno = end_line
 
     # add the \n character back to each line
-    res = list(map(lambda s: s + '\n', out.split('\n')))
-    return res
+    return [s + '\n' for s in "".join(out).split('\n')]
 
 
-def replace_empty_lines_with_noop(lines):
+def fill_empty_lines(lines, start, end, header_ws, next_ws):
+    # lines[start:end] are all empty. If the line before them opened a
+    # block, header_ws is the indentation of that block's body.
+    for i in range(max(start, 1), end):
+        ws = lines[i].rstrip('\n') if header_ws is None else header_ws
+        if len(ws) <= len(next_ws):
+            ws = next_ws
+        # note: we cannot use pass here because the Python Debugger
+        # Framework (bdb) does not stop at pass statements
+        lines[i] = ws + magic_var_name + " = 0\n"
+
 
-    curr_indent = -1
-    curr_indent_str = ""
+def replace_empty_lines_with_noop(lines):
+    header_ws = None
+    empty_start = None
     for i in range(len(lines)):
         line = lines[i]
         stripped = line.strip()
         if stripped == "":
-            if curr_indent != -1:
-                lines[i] = curr_indent_str + "    "
-        elif stripped[-1] == ":":
-            curr_indent = len(line) - len(line.lstrip())
-            curr_indent_str = line[0:curr_indent]
+            if empty_start is None:
+                empty_start = i
+            continue
+        ws = line[0:len(line) - len(line.lstrip())]
+        if empty_start is not None:
+            fill_empty_lines(lines, empty_start, i, header_ws, ws)
+            empty_start = None
+        if stripped[-1] == ":":
+            header_ws = ws + "    "
         else:
-            curr_indent = -1
+            header_ws = None
+    if empty_start is not None:
+        fill_empty_lines(lines, empty_start, len(lines), header_ws, "")
 
-    ws_computed = ""
-    for i in range(len(lines)-1, 0, -1):
-        line = lines[i]
-        if (line.strip() == ""):
-            ws_len_user = len(line.rstrip('\n'))
-            ws_len_computed = len(ws_computed)
-            if ws_len_user > ws_len_computed:
-                ws = line.rstrip('\n')
-            else:
-                ws = ws_computed
-            # note: we cannot use pass here because the Python Debugger
-            # Framework (bdb) does not stop at pass statements
-            lines[i] = ws + magic_var_name + " = 0\n"
-        else:
-            ws_len = len(line) - len(line.lstrip())
-            ws_computed = line[0:ws_len]
 
+# Preprocessed sources by hash, so a long-lived process that sees the
+# same program again (e.g. on undo) skips tokenizing it.
+PREPROCESS_CACHE_SIZE = 32
+preprocess_cache = OrderedDict()
+
+
+def preprocess_code(source: str) -> Tuple[List[str], Optional[Exception]]:
+    key = hashlib.sha256(source.encode("utf-8", "surrogatepass")).digest()
+    if key in preprocess_cache:
+        preprocess_cache.move_to_end(key)
+        (lines, exception) = preprocess_cache[key]
+        return (list(lines), exception)
 
-def load_code_lines(file_name: str) -> Tuple[List[str], Optional[Exception]]:
-    with open(file_name) as f:
-        source = f.read()
     try:
         lines = remove_comments_and_docstrings(source)
         replace_empty_lines_with_noop(lines)
-        return (lines, None)
+        exception = None
     except Exception as e1:
         # There was a parse error.
         # We can't show e1 to the user, since it's from the parsing module,
         # not the actual user-facing error message.
-        # So we `exec` the code to get the user-facing one :|
+        # So we `compile` the code to get the user-facing one, without
+        # running any of it.
+        lines = []
         try:
-            exec(source)
+            compile(source, "<string>", "exec")
+            # This code _should_ never execute, but better safe than sorry
+            exception = e1
         except Exception as e2:
-            return ([], e2)
+            exception = e2
+
+    preprocess_cache[key] = (tuple(lines), exception)
+    if len(preprocess_cache) > PREPROCESS_CACHE_SIZE:
+        preprocess_cache.popitem(last=False)
+    return (lines, exception)
 
-        # This code _should_ never execute, but better safe than sorry
-        return ([], e1)
+
+def load_code_lines(file_name: str) -> Tuple[List[str], Optional[Exception]]:
+    with open(file_name) as f:
+        source = f.read()
+    return preprocess_code(source)
 
 # Image Processing
 
@@ -142,21 +176,52 @@ def is_list_img(v):
     return True
 
 
-def if_img_convert_to_html(v):
+def image_to_ndarray(v):
     if is_list_img(v):
-        return list_to_html(v, format='png')
+        return list_to_ndarray(v)
     elif is_ndarray_img(v):
-        return ndarray_to_html(v, format='png')
+        return v
     else:
         return None
 
+
+def image_name(arr):
+    # Images are named after their pixels, so we only encode each one once
+    h = hashlib.sha256(str(arr.shape).encode())
+    h.update(np.ascontiguousarray(arr).data)
+    return h.hexdigest()[:32] + ".png"
+
+
+def encode_png(name, encode, blobs=None, attrs=""):
+    # The <img> html for the PNG that encode() returns. With a BlobStore,
+    # the PNG goes there instead, and encode() is skipped if it's already there.
+    if blobs != None:
+        if not blobs.has(name):
+            blobs.put(name, encode())
+        return f"<img src='{blobs.ref(name)}'{attrs}>"
+    encoded_str = base64.b64encode(encode()).decode("ascii")
+    return f"<img src='data:image/png;base64,{encoded_str}'{attrs}>"
+
+
+def if_img_convert_to_html(v, blobs=None):
+    arr = image_to_ndarray(v)
+    if arr is None:
+        return None
+    if blobs == None:
+        return ndarray_to_html(arr, format='png')
+    return encode_png(image_name(arr), lambda: ndarray_to_png(arr), blobs)
+
 # Convert PIL.Image to html
 
 
-def pil_to_html(img, **kwargs):
+def pil_to_bytes(img, **kwargs):
     file_buffer = io.BytesIO()
     img.save(file_buffer, **kwargs)
-    encoded = base64.b64encode(file_buffer.getvalue())
+    return file_buffer.getvalue()
+
+
+def pil_to_html(img, **kwargs):
+    encoded = base64.b64encode(pil_to_bytes(img, **kwargs))
     encoded_str = str(encoded)[2:-1]
     img_format = kwargs["format"]
     return f"<img src='data:image/{img_format};base64,{encoded_str}'>"
@@ -189,15 +254,533 @@ def ndarray_to_html(arr, **kwargs):
     return pil_to_html(ndarray_to_pil(arr, 150, 170), **kwargs)
 
 
+def ndarray_to_png(arr):
+    return pil_to_bytes(ndarray_to_pil(arr, 150, 170), format='png')
+
+
+def rgba_to_png(rgba):
+    return pil_to_bytes(Image.fromarray(rgba, 'RGBA'), format='png')
+
+
 def list_to_html(arr, **kwargs):
     return ndarray_to_html(list_to_ndarray(arr), **kwargs)
 
 # Matplotlib
 
 
-def matplotlib_fig_as_html():
+def matplotlib_fig_as_html(blobs=None):
+    # Only called once the user's program has imported pyplot itself,
+    # so this import is free and programs without plots never pay for it.
+    import matplotlib.pyplot as plt
     file_buffer = io.BytesIO()
     plt.savefig(file_buffer, format='png')
-    encoded = base64.b64encode(file_buffer.getvalue())
-    encoded_str = str(encoded)[2:-1]
-    return f"<img src='data:image/png;base64,{encoded_str}' width=400>"
+    data = file_buffer.getvalue()
+    name = hashlib.sha256(data).hexdigest()[:32] + ".png"
+    return encode_png(name, lambda: data, blobs, " width=400")
+
+# Parallel Encoding
+
+
+class ImageEncoder:
+    '''
+    Encodes images and plots on a thread pool, so PNG compression
+    (which releases the GIL) doesn't hold up the traced program.
+    The submit methods snapshot the pixels right away and return a
+    Future of the <img> html. Identical images share one Future.
+    '''
+
+    def __init__(self, blobs=None):
+        self.blobs = blobs
+        self.pool = None
+        self.futures = {}
+
+    def submit(self, name, encode, attrs=""):
+        if name in self.futures:
+            return self.futures[name]
+        if self.pool == None:
+            self.pool = ThreadPoolExecutor(max_workers=os.cpu_count())
+        future = self.pool.submit(encode_png, name, encode, self.blobs, attrs)
+        self.futures[name] = future
+        return future
+
+    def submit_image(self, v):
+        arr = image_to_ndarray(v)
+        if arr is None:
+            return None
+        name = image_name(arr)
+        if name in self.futures:
+            return self.futures[name]
+        # The program may change the array after this line
+        snapshot = arr.copy()
+        return self.submit(name, lambda: ndarray_to_png(snapshot))
+
+    def submit_plot(self):
+        import matplotlib.pyplot as plt
+        canvas = plt.gcf().canvas
+        if not hasattr(canvas, "buffer_rgba"):
+            # Not an Agg canvas, so we can't grab its pixels
+            future = Future()
+            future.set_result(matplotlib_fig_as_html(self.blobs))
+            return future
+        # Drawing has to happen here, only the compression can move
+        canvas.draw()
+        rgba = np.asarray(canvas.buffer_rgba()).copy()
+        return self.submit(image_name(rgba), lambda: rgba_to_png(rgba), " width=400")
+
+    def shutdown(self):
+        if self.pool != None:
+            self.pool.shutdown()
+            self.pool = None
+
+# Output Capture
+
+
+class CapturedBuffer(io.BufferedIOBase):
+    '''
+    What sys.stdout.buffer writes to while the output is captured. Bytes
+    go to the capture as soon as they're written, so they're tagged with
+    the event that wrote them. Multibyte characters split across writes
+    are held back until they're complete.
+    '''
+
+    def __init__(self, capture, stream):
+        self.capture = capture
+        self.stream = stream
+        self.name = "<" + stream + ">"
+        self.decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        data = bytes(b)
+        s = self.decoder.decode(data)
+        if len(s) > 0:
+            self.capture.write(self.stream, s)
+        return len(data)
+
+
+def captured_stream(capture, stream):
+    # Same encoding and error handling as the real streams
+    errors = "backslashreplace" if stream == "stderr" else "strict"
+    return io.TextIOWrapper(CapturedBuffer(capture, stream), encoding="utf-8", errors=errors, write_through=True)
+
+
+class OutputCapture:
+    '''
+    Stands in for sys.stdout and sys.stderr while the program runs. Keeps
+    the last max_bytes of what was written, in chunks tagged with the
+    event (time and line) that was running. Older chunks are dropped and
+    counted in an "elided" entry.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # Set by run.py, its prev_env is the running event
+        self.logger = None
+        # [stream, time, lineno, parts, size]
+        self.chunks = deque()
+        self.size = 0
+        self.elided_bytes = 0
+        self.elided_chunks = 0
+
+    def streams(self):
+        return (captured_stream(self, "stdout"), captured_stream(self, "stderr"))
+
+    def write(self, stream, s):
+        env = self.logger.prev_env if self.logger != None else None
+        (event_time, lineno) = (env.time, env.lineno) if env != None else (None, None)
+        size = len(s.encode("utf-8", "surrogatepass"))
+        last = self.chunks[-1] if len(self.chunks) > 0 else None
+        if last != None and last[0] == stream and last[1] == event_time and last[2] == lineno:
+            last[3].append(s)
+            last[4] += size
+        else:
+            self.chunks.append([stream, event_time, lineno, [s], size])
+        self.size += size
+        while self.size > self.max_bytes and len(self.chunks) > 1:
+            dropped = self.chunks.popleft()
+            self.size -= dropped[4]
+            self.elided_bytes += dropped[4]
+            self.elided_chunks += 1
+        if self.size > self.max_bytes:
+            # Only the end of a single huge chunk fits
+            chunk = self.chunks[0]
+            data = "".join(chunk[3]).encode("utf-8", "surrogatepass")[-self.max_bytes:]
+            chunk[3] = [data.decode("utf-8", "ignore")]
+            self.elided_bytes += self.size - len(data)
+            chunk[4] = self.size = len(data)
+
+    def to_json(self):
+        output = []
+        if self.elided_bytes > 0:
+            output.append({"elided": self.elided_bytes, "chunks": self.elided_chunks})
+        for (stream, event_time, lineno, parts, _) in self.chunks:
+            output.append({"stream": stream, "time": event_time, "lineno": lineno, "text": "".join(parts)})
+        return {"output": output}
+
+
+# Local Modules
+
+
+class LocalModuleLoader(importlib.machinery.SourceFileLoader):
+    def __init__(self, modules, fullname, path):
+        super().__init__(fullname, path)
+        self.modules = modules
+
+    def get_code(self, fullname):
+        # Preprocessed like the program, so it has boxes on the same lines
+        (lines, exception) = load_code_lines(self.path)
+        if exception != None:
+            # Let the import report the error in the actual source
+            return super().get_code(fullname)
+        code = compile("".join(lines), self.path, "exec")
+        self.modules.add(self.path, lines, code)
+        return code
+
+
+class LocalModules:
+    '''
+    Import hook for the local modules traced along with the program.
+    They are imported as usual, but every code object compiled for them
+    goes into `code`, so the tracer can tell their frames from library
+    frames without looking at file names.
+    '''
+
+    def __init__(self, paths):
+        # The paths as given name the modules in the output
+        self.names = {os.path.realpath(p): p for p in paths}
+        self.code = set()
+        # co_filename: (name, preprocessed lines)
+        self.files = {}
+        # name: {"writes": ..., "data": ...}, filled in by run.py
+        self.traces = {}
+
+    def find_spec(self, fullname, path, target=None):
+        spec = importlib.machinery.PathFinder.find_spec(fullname, path, target)
+        if spec == None or spec.origin == None or not os.path.realpath(spec.origin) in self.names:
+            return None
+        spec.loader = LocalModuleLoader(self, fullname, spec.origin)
+        return spec
+
+    def add(self, file_name, lines, code):
+        self.files[file_name] = (self.names[os.path.realpath(file_name)], lines)
+        todo = [code]
+        while len(todo) > 0:
+            c = todo.pop()
+            self.code.add(c)
+            todo.extend(k for k in c.co_consts if isinstance(k, types.CodeType))
+
+    def install(self):
+        # Modules imported by an earlier run in this process have to be
+        # imported again to be traced
+        for (name, m) in list(sys.modules.items()):
+            file_name = getattr(m, "__file__", None)
+            if file_name and os.path.realpath(file_name) in self.names:
+                del sys.modules[name]
+        sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        sys.meta_path.remove(self)
+
+    def to_json(self):
+        return {"modules": self.traces}
+
+
+# Load Cache
+
+# The loaders LoadCache wraps, by module
+LOADERS = {
+    "pandas": ["read_csv", "read_table", "read_json", "read_excel", "read_parquet", "read_feather", "read_pickle"],
+    "numpy": ["load", "loadtxt", "genfromtxt"],
+    "json": ["load"],
+}
+# Names of the argument the loaders take the file in
+PATH_ARGS = ("filepath_or_buffer", "path", "path_or_buf", "io", "file", "fname", "fp")
+
+
+class LoadCache:
+    '''
+    What data loaders (pandas.read_csv, numpy.load, json.load, ...)
+    returned, kept across the runs of one process (see run.py --serve),
+    so editing code below a load doesn't pay for parsing the file again.
+    Results are keyed by loader, file, arguments and the file's size and
+    mtime. The cache keeps a copy of its own and the program always
+    gets a fresh one. Least recently used results are dropped once they
+    take more than max_bytes.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        # key: (stored value, size)
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # Set by run.py, the cache.RunRecorder of the run, which has to
+        # know about files we read for it
+        self.recorder = None
+        # (module, name, original function) for each wrapped loader
+        self.wrapped = []
+
+    def install(self):
+        self.hits = 0
+        self.misses = 0
+        # Only modules that are already imported, see run.py
+        for (module_name, names) in LOADERS.items():
+            m = sys.modules.get(module_name)
+            if m == None:
+                continue
+            for name in names:
+                f = getattr(m, name, None)
+                if f != None:
+                    self.wrapped.append((m, name, f))
+                    setattr(m, name, self.wrap(module_name + "." + name, f))
+
+    def uninstall(self):
+        for (m, name, f) in self.wrapped:
+            setattr(m, name, f)
+        self.wrapped = []
+
+    def wrap(self, loader, f):
+        @functools.wraps(f)
+        def load(*args, **kwargs):
+            return self.load(loader, f, args, kwargs)
+        return load
+
+    def file_name(self, path):
+        if isinstance(path, (str, bytes, os.PathLike)):
+            file_name = os.fsdecode(path)
+        else:
+            # An open file, as json.load takes, read from the start
+            file_name = getattr(path, "name", None)
+            if not isinstance(file_name, str) or not hasattr(path, "tell") or path.tell() != 0:
+                return None
+        if "://" in file_name:
+            return None
+        file_name = os.path.abspath(file_name)
+        return file_name if os.path.isfile(file_name) else None
+
+    def load(self, loader, f, args, kwargs):
+        path = args[0] if len(args) > 0 else next((v for (k, v) in kwargs.items() if k in PATH_ARGS), None)
+        file_name = self.file_name(path)
+        if file_name == None:
+            return f(*args, **kwargs)
+        st = os.stat(file_name)
+        options = repr(args[1:]) + repr(sorted((k, repr(v)) for (k, v) in kwargs.items() if v is not path))
+        key = (loader, file_name, options, st.st_size, st.st_mtime_ns)
+        if self.recorder != None:
+            self.recorder.opened[file_name] = True
+
+        entry = self.entries.get(key)
+        if entry != None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if not isinstance(path, (str, bytes, os.PathLike)):
+                # As if we had read it
+                path.seek(0, os.SEEK_END)
+            return self.copy_out(entry[0])
+
+        self.misses += 1
+        v = f(*args, **kwargs)
+        self.store(key, v)
+        return v
+
+    def store(self, key, v):
+        (stored, size) = self.copy_in(v)
+        if stored is None or size > self.max_bytes:
+            return
+        # Results for older versions of the file won't be asked for again
+        for old in [k for k in self.entries if k[:3] == key[:3]]:
+            self.size -= self.entries.pop(old)[1]
+        self.entries[key] = (stored, size)
+        self.size += size
+        while self.size > self.max_bytes:
+            (_, (_, size)) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def copy_in(self, v):
+        pd = sys.modules.get("pandas")
+        if pd != None and isinstance(v, pd.DataFrame):
+            return (v.copy(deep=True), int(v.memory_usage(deep=True).sum()))
+        if pd != None and isinstance(v, pd.Series):
+            return (v.copy(deep=True), int(v.memory_usage(deep=True)))
+        if type(v) is np.ndarray:
+            return (v.copy(), v.nbytes)
+        # Anything json.load returns. Unmarshaling makes a fresh copy
+        # faster than copy.deepcopy would.
+        try:
+            data = marshal.dumps(v)
+        except ValueError:
+            return (None, 0)
+        return (data, len(data))
+
+    def copy_out(self, stored):
+        if isinstance(stored, bytes):
+            return marshal.loads(stored)
+        if isinstance(stored, np.ndarray):
+            return stored.copy()
+        return stored.copy(deep=True)
+
+    def to_json(self):
+        return {"load_cache": {"hits": self.hits, "misses": self.misses, "bytes": self.size}}
+
+
+# Blob Store
+
+
+class BlobStore:
+    '''
+    A directory of content-addressed files (images, plots), so outputs
+    can refer to them by name instead of inlining them. The editor
+    replaces each "runpy-blob:<name>" reference with the file's content.
+    '''
+
+    # Blobs unused for this long are deleted by collect_garbage
+    MAX_AGE = 10 * 60
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.used = set()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def ref(self, name):
+        return "runpy-blob:" + name
+
+    def has(self, name):
+        if name in self.used:
+            return True
+        try:
+            # Touch it, so it survives garbage collection
+            os.utime(self.path(name))
+        except OSError:
+            return False
+        self.used.add(name)
+        return True
+
+    def put(self, name, data):
+        tmp = self.path(name + ".tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path(name))
+        self.used.add(name)
+
+    def paths(self):
+        return [self.path(name) for name in self.used]
+
+    def collect_garbage(self):
+        cutoff = time.time() - self.MAX_AGE
+        with os.scandir(self.directory) as it:
+            for e in it:
+                if not e.name in self.used and e.stat().st_mtime < cutoff:
+                    try:
+                        os.remove(e.path)
+                    except OSError:
+                        pass
+
+# Value Rendering
+
+# Values bigger than this are shown as a summary instead of their repr
+SUMMARY_THRESHOLD = 100
+# How many leading elements / rows a summary shows
+SAMPLE_ITEMS = 10
+HEAD_ROWS = 5
+MAX_COLUMNS = 20
+
+# From a type to the function that renders its values as a string.
+# Lookups follow the value's MRO, so subclasses are covered too, up to
+# a subclass with a __repr__ of its own.
+renderers: Dict[type, Callable[[object], str]] = {}
+renderer_cache: Dict[type, Optional[Callable[[object], str]]] = {}
+
+# Renderers for types from modules we never import ourselves. They are
+# registered the first time we see their module in sys.modules, since
+# until then the program can't have any of their values.
+lazy_renderers: Dict[str, Callable[[], None]] = {}
+
+
+def register_renderer(typ: type, renderer: Callable[[object], str]):
+    renderers[typ] = renderer
+    renderer_cache.clear()
+
+
+def register_lazy_renderers(module_name: str, register: Callable[[], None]):
+    lazy_renderers[module_name] = register
+
+
+def find_renderer(v) -> Optional[Callable[[object], str]]:
+    if lazy_renderers:
+        for module_name in [m for m in lazy_renderers if m in sys.modules]:
+            lazy_renderers.pop(module_name)()
+
+    typ = type(v)
+    if typ in renderer_cache:
+        return renderer_cache[typ]
+    renderer = None
+    for t in typ.__mro__:
+        if t in renderers:
+            renderer = renderers[t]
+            break
+        if "__repr__" in t.__dict__:
+            break
+    renderer_cache[typ] = renderer
+    return renderer
+
+
+def render_sequence(v):
+    if len(v) <= SUMMARY_THRESHOLD:
+        return repr(v)
+    prefix = ", ".join(repr(x) for x in v[:SAMPLE_ITEMS])
+    (start, end) = ("(", ")") if isinstance(v, tuple) else ("[", "]")
+    return f"{start}{prefix}, ...{end} (len {len(v)})"
+
+
+def render_ndarray(arr):
+    if arr.size <= SUMMARY_THRESHOLD:
+        return repr(arr)
+    text = f"ndarray shape={arr.shape} dtype={arr.dtype}"
+    if arr.dtype.kind in "biuf":
+        text += f" min={arr.min()} max={arr.max()}"
+    sample = ", ".join(repr(x) for x in arr.flat[:SAMPLE_ITEMS].tolist())
+    return f"{text} [{sample}, ...]"
+
+
+def render_dataframe(df):
+    if df.size <= SUMMARY_THRESHOLD:
+        return repr(df)
+    (rows, columns) = df.shape
+    dtypes = ", ".join(f"{c}: {t}" for (c, t) in df.dtypes.iloc[:MAX_COLUMNS].items())
+    text = f"DataFrame {rows} rows x {columns} columns\n{dtypes}\n"
+    text += df.iloc[:HEAD_ROWS, :MAX_COLUMNS].to_string()
+    if rows > HEAD_ROWS:
+        text += f"\n... {rows - HEAD_ROWS} more rows"
+    return text
+
+
+def render_series(series):
+    if len(series) <= SUMMARY_THRESHOLD:
+        return repr(series)
+    text = f"Series {series.name} length {len(series)} dtype {series.dtype}\n"
+    text += series.iloc[:HEAD_ROWS].to_string()
+    if len(series) > HEAD_ROWS:
+        text += f"\n... {len(series) - HEAD_ROWS} more rows"
+    return text
+
+
+def register_numpy_renderers():
+    register_renderer(np.ndarray, render_ndarray)
+
+
+def register_pandas_renderers():
+    import pandas as pd
+    register_renderer(pd.DataFrame, render_dataframe)
+    register_renderer(pd.Series, render_series)
+
+
+register_renderer(list, render_sequence)
+register_renderer(tuple, render_sequence)
+register_lazy_renderers("numpy", register_numpy_renderers)
+register_lazy_renderers("pandas", register_pandas_renderers)
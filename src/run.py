@@ -1,20 +1,104 @@
+import time
+# Taken before anything else, for RUNPY_PROFILE
+startup_cpu_time = time.process_time()
+imports_start = time.perf_counter()
+
 import ast
 import bdb
+import builtins
 import ctypes
+import dis
+import importlib.util
+import inspect
+import io
 import json
 import os
+import select
+import signal
 import sys
+import tempfile
+import traceback
 import types
 import uuid
 
+import cache
+import tracestore
 from core import *
 
+# Phases only the first run of a process pays for, see Profile
+startup_phases = {"startup_cpu": startup_cpu_time, "imports": time.perf_counter() - imports_start}
+
 RUNPY_LIMIT: int = 2048
 
+# Set RUNPY_PROFILE=1 to add per-phase timings and counters to the output
+PROFILE: bool = os.environ.get("RUNPY_PROFILE", "0") != "0"
+
+# Set RUNPY_BLOBS=1 to write images to <file>.blobs/ instead of inlining them.
+# The editor does, unless its rtv.run.blobs setting is off.
+BLOBS: bool = os.environ.get("RUNPY_BLOBS", "0") != "0"
+
+# Set RUNPY_SUMMARIZE=0 to repr big values in full instead of summarizing
+# them (see render_sequence in core.py). The synth boxes do, their values
+# have to be literals that evaluate back to the values.
+SUMMARIZE: bool = os.environ.get("RUNPY_SUMMARIZE", "1") != "0"
+
+# Set RUNPY_TRACE_STORE=1 to write the envs to <file>.trace (see
+# tracestore.py) and leave them out of <file>.out
+TRACE_STORE: bool = os.environ.get("RUNPY_TRACE_STORE", "0") != "0"
+
+# Set RUNPY_FOCUS to only trace part of the program, see focus_ranges
+FOCUS: str = os.environ.get("RUNPY_FOCUS", "")
+
+# Set RUNPY_SELECTIVE=1 to only repr the variables a line can have
+# changed (see VariableSelection), and leave values that didn't change
+# out of <file>.out (see Event.to_env)
+SELECTIVE: bool = os.environ.get("RUNPY_SELECTIVE", "0") != "0"
+
+# Set RUNPY_LINE_PROFILE=1 to add hit counts and time per line and per
+# function of the program to the output, see LineProfile
+LINE_PROFILE: bool = os.environ.get("RUNPY_LINE_PROFILE", "0") != "0"
+
+# Set RUNPY_CAPTURE_OUTPUT=1 to put what the program prints in the output
+# instead of passing it through, see OutputCapture. The editor does, unless
+# its rtv.run.captureOutput setting is off.
+CAPTURE_OUTPUT: bool = os.environ.get("RUNPY_CAPTURE_OUTPUT", "0") != "0"
+OUTPUT_MAX_BYTES: int = int(os.environ.get("RUNPY_OUTPUT_MAX_BYTES", 64 * 1024))
+
+# Set RUNPY_MODULES to paths of local modules, separated by os.pathsep,
+# to trace them too, see LocalModules
+MODULES: str = os.environ.get("RUNPY_MODULES", "")
+
+# Set RUNPY_MEMORY=1 to add the memory each line allocates to its envs
+# and a per-line summary to the output, see MemoryProfile
+MEMORY: bool = os.environ.get("RUNPY_MEMORY", "0") != "0"
+
+# Set RUNPY_LOAD_CACHE=1 to keep what pandas.read_csv and the like load
+# across runs, see LoadCache. Only useful with --serve.
+LOAD_CACHE: bool = os.environ.get("RUNPY_LOAD_CACHE", "0") != "0"
+LOAD_CACHE_MAX_BYTES: int = int(os.environ.get("RUNPY_LOAD_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+# Checkpoints serve keeps per document for speculative runs, see Speculation
+SPECULATION_CHECKPOINTS: int = int(os.environ.get("RUNPY_SPECULATION_CHECKPOINTS", 8))
+
+# Seconds each program gets in `run.py --check`, see check_programs
+CHECK_TIMEOUT: float = float(os.environ.get("RUNPY_CHECK_TIMEOUT", 1))
+# What the asserts of a checked program call and raise instead, see AssertRecorder
+CHECK_ASSERT = '_projection_boxes_assert'
+CHECK_FAILED = '_projection_boxes_assert_failed'
+
 # See RTVDisplay for corresponding list of keywords
 # These MUST match for Projection Boxes to work correctly.
 TIME = '_projection_boxes_time'
 LINE_NO = '_projection_boxes_lineno'
+MEMORY_USAGE = '_projection_boxes_memory'
+
+# Frames that come back after returning, see Logger.forget_frame
+GENERATOR_FLAGS = inspect.CO_GENERATOR | inspect.CO_COROUTINE | inspect.CO_ASYNC_GENERATOR
+# Nodes that can run other code on their line, see VariableSelection
+MUTATING_NODES = (ast.Call, ast.AugAssign, ast.Yield, ast.YieldFrom, ast.Await, ast.For, ast.AsyncFor, ast.With, ast.AsyncWith)
+
+# What Logger keeps for each traced file, see Logger.switch_file
+FILE_STATE = ("lines", "writes", "data", "active_loops", "loop_info", "prev_env", "prev_frame_name", "preexisting_locals", "selection")
 
 # from PIL import Image
 
@@ -54,37 +138,681 @@ def remove_R(lineno):
 
 
 class LoopInfo:
-	def __init__(self, frame, lineno, indent):
-		self.frame = frame
+	def __init__(self, frame_id, lineno, indent):
+		self.frame_id = frame_id
 		self.lineno = lineno
 		self.indent = indent
 		self.iter = 0
 
 	def __str__(self):
-		return f'iter {self.iter}, frame {self.frame} at line {self.lineno} with indent {self.indent}'
+		return f'iter {self.iter}, frame {self.frame_id} at line {self.lineno} with indent {self.indent}'
+
+
+class Event:
+	"""
+	One recorded line or return. Events only become the dicts in the
+	.out file in to_env, once the run is over, and refer to frames by
+	integer id so they don't keep the frames (and their locals) alive.
+	"""
+	__slots__ = ("frame_id", "time", "iters", "loop_ids", "values", "lineno", "plot", "prev_lineno", "next_lineno", "extras")
+
+	def __init__(self, frame_id, time, iters, loop_ids):
+		self.frame_id = frame_id
+		self.time = time
+		self.iters = iters
+		self.loop_ids = loop_ids
+		self.values = {}
+		self.lineno = None
+		self.plot = None
+		self.prev_lineno = None
+		self.next_lineno = None
+		# rv and "Exception Thrown", rarely set
+		self.extras = None
+
+	def add(self, name, r):
+		if self.extras == None:
+			self.extras = {}
+		self.extras[name] = r
+
+	def has(self, name):
+		return self.extras != None and name in self.extras
+
+	def to_env(self, base=None):
+		# Values that are the same as in the event `base` are written
+		# as null, and "^" says which event to take them from
+		env = {TIME: self.time, "#": self.iters, "$": self.loop_ids}
+		if base == None:
+			env.update(self.values)
+		else:
+			carried = False
+			for (k, r) in self.values.items():
+				# Short values are cheaper to repeat than to refer to
+				if len(r) > 4 and base.values.get(k) == r:
+					env[k] = None
+					carried = True
+				else:
+					env[k] = r
+			if carried:
+				env["^"] = base.time
+		env[LINE_NO] = self.lineno
+		if self.plot != None:
+			env["Plot"] = self.plot
+		if self.prev_lineno != None:
+			env["prev_lineno"] = self.prev_lineno
+		if self.extras != None:
+			env.update(self.extras)
+		if self.next_lineno != None:
+			env["next_lineno"] = self.next_lineno
+		return env
+
+
+class LoopMarker:
+	# The start or end of a loop, shown on every line in its body
+	__slots__ = ("kind", "iters", "loop_ids")
+
+	def __init__(self, kind, iters, loop_ids):
+		self.kind = kind
+		self.iters = iters
+		self.loop_ids = loop_ids
+
+	def to_env(self):
+		return {self.kind: self.iters, "#": self.iters, "$": self.loop_ids}
+
+
+class Profile:
+	"""
+	Wall-clock seconds spent in each phase of a run, plus counters.
+	Phases nested in "tracing" (compute_repr, image_encoding) are
+	included in its time as well. Starting the process (startup_cpu,
+	imports) is only counted in its first run, later runs of --serve
+	don't pay for it.
+	"""
+
+	def __init__(self):
+		self.phases = dict(startup_phases)
+		startup_phases.clear()
+		self.counters = {"events": 0, "reprs": 0, "repr_bytes": 0, "images": 0, "bytes_written": 0}
+
+	def add(self, phase, seconds):
+		self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+	def count(self, counter, n=1):
+		self.counters[counter] += n
+
+	def timed(self, phase, f, *args):
+		start = time.perf_counter()
+		rs = f(*args)
+		self.add(phase, time.perf_counter() - start)
+		return rs
+
+	def to_json(self):
+		return {"phases": self.phases, "counters": self.counters}
+
+
+def is_program_code(code):
+	# See bdb.Bdb.run
+	return code.co_filename == "<string>"
+
+
+def tracing_overhead(n=2000):
+	# Seconds bdb adds to each event before any of our callbacks run
+	code = compile("for i in range(%d):\n\tpass\n" % n, "<string>", "exec")
+	start = time.perf_counter()
+	exec(code, {})
+	native = time.perf_counter() - start
+
+	class NullLogger(bdb.Bdb):
+		def user_line(self, frame):
+			pass
+
+	start = time.perf_counter()
+	NullLogger().run(code, {})
+	traced = time.perf_counter() - start
+	# Two line events per iteration
+	return max(0.0, (traced - native) / (2 * n))
+
+
+class LineProfile:
+	"""
+	Hit counts and wall-clock seconds for each line and function of the
+	program. Time is measured between our trace callbacks, so reprs and
+	images don't count, and the cost bdb adds to every event is measured
+	once and subtracted. Time in library code goes to the line that
+	called it.
+	"""
+
+	overhead = None
+
+	def __init__(self):
+		if LineProfile.overhead == None:
+			LineProfile.overhead = tracing_overhead()
+		# lineno: [hits, seconds, events], code: [calls, seconds, events]
+		self.lines = {}
+		self.functions = {}
+		self.line = None
+		self.code = None
+		self.last = time.perf_counter()
+
+	def charge(self, now):
+		# The time since our last callback goes to the current line
+		if self.line != None:
+			dt = now - self.last
+			stats = self.lines[self.line]
+			stats[1] += dt
+			stats[2] += 1
+			stats = self.functions[self.code]
+			stats[1] += dt
+			stats[2] += 1
+
+	def function(self, code):
+		stats = self.functions.get(code)
+		if stats == None:
+			# Nothing calls the module, it's just there
+			stats = self.functions[code] = [1 if code.co_name == "<module>" else 0, 0.0, 0]
+		return stats
+
+	def call(self, code):
+		self.function(code)[0] += 1
+
+	def hit(self, code, lineno):
+		self.function(code)
+		stats = self.lines.get(lineno)
+		if stats == None:
+			stats = self.lines[lineno] = [0, 0.0, 0]
+		stats[0] += 1
+		self.line = lineno
+		self.code = code
+
+	def seconds(self, stats):
+		return round(max(0.0, stats[1] - stats[2] * self.overhead), 6)
+
+	def to_json(self):
+		functions = []
+		for (code, stats) in self.functions.items():
+			functions.append({
+				# co_qualname is new in Python 3.11
+				"name": getattr(code, "co_qualname", code.co_name),
+				"lineno": code.co_firstlineno - 1,
+				"calls": stats[0],
+				"time": self.seconds(stats),
+			})
+		lines = {}
+		for (lineno, stats) in sorted(self.lines.items()):
+			lines[lineno] = [stats[0], self.seconds(stats)]
+		return {"lines": lines, "functions": functions}
+
+
+class MemoryProfile:
+	"""
+	Memory allocated by the program, from tracemalloc. At every event
+	we read how much is allocated, and the peak since the last event,
+	leaving out what the tracer itself keeps. Each event then gets the
+	net bytes and the peak above the start of the line before it in
+	its frame, calls included, which is the line it is shown on.
+	Before Python 3.9 tracemalloc can't reset its peak, so the peaks are
+	then only what the program had at the events themselves.
+	"""
+
+	def __init__(self):
+		# Imported here, so runs without it don't pay for the import
+		import tracemalloc
+		self.tracemalloc = tracemalloc
+		self.get_traced_memory = tracemalloc.get_traced_memory
+		self.reset_peak = getattr(tracemalloc, "reset_peak", None)
+		# Bytes the tracer allocated and kept
+		self.own = 0
+		# Bytes allocated at the start of the current event
+		self.current = 0
+		# [net bytes, peak] for the current event, if its frame had one before
+		self.usage = None
+		# frame_id: (bytes the program had, lineno) at the frame's last event
+		self.last = {}
+		# frame_id: most bytes the program had since then
+		self.peaks = {}
+		# lineno: [runs, net bytes, largest peak]
+		self.lines = {}
+		self.peak = 0
+
+	def start(self):
+		self.tracemalloc.start()
+
+	def stop(self):
+		self.tracemalloc.stop()
+
+	def event(self, frame_id, lineno):
+		(current, peak) = self.get_traced_memory()
+		if self.reset_peak == None:
+			peak = current
+		self.current = current
+		used = current - self.own
+		peak = peak - self.own
+		if peak > self.peak:
+			self.peak = peak
+		for (f, p) in self.peaks.items():
+			if peak > p:
+				self.peaks[f] = peak
+		self.usage = None
+		last = self.last.get(frame_id)
+		if last != None:
+			(last_used, last_lineno) = last
+			self.usage = [used - last_used, self.peaks[frame_id] - last_used]
+			stats = self.lines.get(last_lineno)
+			if stats == None:
+				stats = self.lines[last_lineno] = [0, 0, 0]
+			stats[0] += 1
+			stats[1] += self.usage[0]
+			stats[2] = max(stats[2], self.usage[1])
+		self.last[frame_id] = (used, lineno)
+		self.peaks[frame_id] = used
+
+	def end_event(self):
+		(current, _) = self.get_traced_memory()
+		self.own += current - self.current
+		if self.reset_peak != None:
+			self.reset_peak()
+
+	def forget(self, frame_id):
+		self.last.pop(frame_id, None)
+		self.peaks.pop(frame_id, None)
+
+	def to_json(self):
+		return {"memory": {"lines": self.lines, "peak": self.peak}}
+
+
+def fork_children(n, timeout=None):
+	# Forks a child for each of range(n), up to one per CPU at a time,
+	# with a pipe to send its result back through. Returns (i, the write
+	# end of its pipe) in child i, which has to end itself, and in the
+	# parent, once they have all ended, (None, [(what child i sent, its
+	# seconds, whether it was killed)]). Children still running after
+	# timeout seconds are killed.
+	results = [None] * n
+	waiting = list(range(n))
+	# read end of the pipe: (index, pid, start, what was read)
+	running = {}
+	sys.__stdout__.flush()
+	sys.__stderr__.flush()
+	while len(waiting) > 0 or len(running) > 0:
+		while len(waiting) > 0 and len(running) < (os.cpu_count() or 1):
+			i = waiting.pop(0)
+			(r, w) = os.pipe()
+			pid = os.fork()
+			if pid == 0:
+				os.close(r)
+				for fd in running:
+					os.close(fd)
+				return (i, w)
+			os.close(w)
+			running[r] = (i, pid, time.perf_counter(), [])
+
+		wait = None
+		if timeout != None:
+			deadline = min(start for (_, _, start, _) in running.values()) + timeout
+			wait = max(0, deadline - time.perf_counter())
+		(ready, _, _) = select.select(list(running), [], [], wait)
+		for fd in ready:
+			(i, pid, start, chunks) = running[fd]
+			data = os.read(fd, 65536)
+			if data:
+				chunks.append(data)
+				continue
+			del running[fd]
+			os.close(fd)
+			os.waitpid(pid, 0)
+			results[i] = (b"".join(chunks), time.perf_counter() - start, False)
+		if timeout == None:
+			continue
+		now = time.perf_counter()
+		for fd in [fd for (fd, (_, _, start, _)) in running.items() if now - start >= timeout]:
+			(i, pid, start, _) = running.pop(fd)
+			os.kill(pid, signal.SIGKILL)
+			os.waitpid(pid, 0)
+			os.close(fd)
+			results[i] = (b"", now - start, True)
+	return (None, results)
+
+
+class Batch:
+	"""
+	Runs a program with several sets of overrides (see compile_values)
+	at the cost of one run up to the earliest override. The Logger
+	calls fork when it gets there: each set then runs to the end in a
+	child process of its own, which sends its output back through a
+	pipe. Up to one child per CPU runs at a time, see fork_children.
+	"""
+
+	def __init__(self, value_sets):
+		self.value_sets = value_sets
+		# The time of the earliest override, None if there are none
+		self.time = min((t for values in value_sets for overrides in values.values() for t in overrides), default=None)
+		# In the parent, once forked, the output of each set ("" if its
+		# child sent none) and what it printed, as (stdout, stderr) files
+		self.outputs = None
+		self.printed = None
+		# In a child, the index of its set and the write end of its pipe
+		self.index = None
+		self.pipe = None
+
+	def forked(self):
+		return self.index == None and self.outputs != None
+
+	def fork(self, logger):
+		# Returns True in the children, which continue the run with
+		# their own values, and False in the parent, once they have
+		# all ended. Images still being encoded are waited for first,
+		# since the pool's threads don't survive the fork.
+		logger.resolve_images()
+		# Children print to files of their own, so their output
+		# doesn't interleave
+		self.printed = [(tempfile.TemporaryFile(), tempfile.TemporaryFile()) for _ in self.value_sets]
+		(i, rs) = fork_children(len(self.value_sets))
+		if i != None:
+			os.dup2(self.printed[i][0].fileno(), 1)
+			os.dup2(self.printed[i][1].fileno(), 2)
+			self.printed = None
+			(self.index, self.pipe) = (i, rs)
+			logger.values = self.value_sets[i]
+			return True
+		self.outputs = [data.decode() for (data, _, _) in rs]
+		return False
+
+	def send(self, output, exception):
+		# Only called in a child, which ends here, so the exception
+		# that ended its run is reported here too
+		with os.fdopen(self.pipe, "w") as f:
+			f.write(output)
+		if exception != None:
+			sys.stderr.write("".join(traceback.format_exception(type(exception), exception, exception.__traceback__)))
+		sys.stdout.flush()
+		sys.stderr.flush()
+		sys.__stdout__.flush()
+		sys.__stderr__.flush()
+		os._exit(0)
+
+	def collect(self, output, failed_output):
+		# The output of every set, in order. If the run never got to
+		# the fork, no override applied and output is the result of
+		# each set. What the children printed is passed on, set by set.
+		if not self.forked():
+			return [output] * len(self.value_sets)
+		for (out, err) in self.printed:
+			for (f, stream) in [(out, sys.stdout), (err, sys.stderr)]:
+				f.seek(0)
+				stream.write(f.read().decode("utf-8", "replace"))
+				stream.flush()
+				f.close()
+		return [child_output if child_output != "" else failed_output for child_output in self.outputs]
+
+
+def first_line(node):
+	# The line a statement starts on, decorators included
+	return min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+
+
+def send_message(conn, message, fds=[]):
+	# A message is its length in 8 bytes, with fds attached, then JSON.
+	# The fds go as SCM_RIGHTS by hand, socket.send_fds is new in 3.9.
+	import array
+	import socket
+	data = json.dumps(message).encode()
+	conn.sendmsg([len(data).to_bytes(8, "little")], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))])
+	conn.sendall(data)
+
+
+def receive_message(conn):
+	# (message, fds), message is None once the other end is gone. At
+	# most one fd comes with a message.
+	import array
+	import socket
+	fds = array.array("i")
+	(head, ancillary, _, _) = conn.recvmsg(8, socket.CMSG_LEN(fds.itemsize))
+	for (level, kind, data) in ancillary:
+		if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+			fds.frombytes(data[:len(data) - len(data) % fds.itemsize])
+	fds = list(fds)
+	if len(head) < 8:
+		return (None, fds)
+	n = int.from_bytes(head, "little")
+	chunks = []
+	while n > 0:
+		chunk = conn.recv(min(n, 1 << 20))
+		if not chunk:
+			return (None, fds)
+		chunks.append(chunk)
+		n -= len(chunk)
+	return (json.loads(b"".join(chunks)), fds)
+
+
+class Resume(BaseException):
+	# Ends the run of a checkpoint's program in a runner that goes on
+	# with a longer one, see Speculation
+	pass
+
+
+class Speculation:
+	"""
+	A run of a program that is still being written (see
+	serve_speculation), which leaves a checkpoint where it gets to the
+	statement at line: a child process, forked right there, that waits
+	for longer versions of the program. For each, it forks a runner
+	that goes on from there with the new program's statements from
+	line on, in the same Logger and namespace, so the statements
+	before line aren't run again.
+	"""
+
+	def __init__(self, conn, line):
+		# The socket to serve
+		self.conn = conn
+		# Where to leave the checkpoint, None once it's left
+		self.line = line
+		# The line this run resumed from, 0 if it started at the top
+		self.start = 0
+		# serve's end of the socket to the checkpoint this run left
+		self.checkpoint = None
+		# In a resumed runner, the program to go on with until
+		# compute_runtime_data switches to it, and the id of the
+		# checkpoint's module frame, which the new one takes over
+		self.program = None
+		self.frame_id = None
+
+	def line_event(self, logger, frame):
+		# At every line of the program's module frame
+		if self.frame_id != None:
+			logger.frame_ids[id(frame)] = self.frame_id
+			self.frame_id = None
+		if self.line != None and frame.f_lineno >= self.line and self.fork(logger, frame):
+			raise Resume()
+
+	def fork(self, logger, frame):
+		# Returns False in the run, which goes on, and True in a runner
+		# resuming from the checkpoint left here. Images still being
+		# encoded are waited for first, as in Batch.fork.
+		import socket
+		line = self.line
+		self.line = None
+		logger.resolve_images()
+		sys.__stdout__.flush()
+		sys.__stderr__.flush()
+		(ours, theirs) = socket.socketpair()
+		if os.fork() != 0:
+			ours.close()
+			self.checkpoint = theirs
+			return False
+
+		# The checkpoint, until serve closes its socket
+		theirs.close()
+		self.conn.close()
+		self.conn = ours
+		frame_id = logger.frame_id(frame)
+		while True:
+			(request, _) = receive_message(ours)
+			if request == None:
+				os._exit(0)
+			pid = os.fork()
+			if pid == 0:
+				break
+			os.waitpid(pid, 0)
+		self.start = line
+		self.line = request["checkpoint"]
+		self.program = request["program"]
+		self.frame_id = frame_id
+		return True
+
+	def resume(self, logger):
+		# Switches logger to self.program, in place since main holds on
+		# to its lines and writes, and returns the code of its
+		# statements from self.start on
+		(lines, _) = preprocess_code(self.program)
+		self.program = None
+		(writes, _) = compute_writes(lines)
+		logger.lines[:] = lines
+		logger.writes.clear()
+		logger.writes.update(writes)
+		tree = ast.parse("".join(lines))
+		if logger.selection != None:
+			logger.selection = VariableSelection(tree)
+		body = [s for s in tree.body if first_line(s) >= self.start]
+		return compile(ast.Module(body, []), "<string>", "exec")
 
 
 class Logger(bdb.Bdb):
-	def __init__(self, lines, writes, values=[]):
+	def __init__(self, lines, writes, values={}, *, profile=None, blobs=None, focus=None, selection=None, batch=None, modules=None, memory=None, speculation=None):
 		bdb.Bdb.__init__(self)
 		self.lines = lines
 		self.writes = writes
 		self.time = 0
 		self.prev_env = None
+		self.prev_frame_name = None
 		self.data = {}
 		self.active_loops = []
+		# The "#" and "$" strings for active_loops, shared by every
+		# event until the loops change. See loop_strs.
+		self.loop_info = None
+		# Integer ids of the frames we've recorded, by id(frame)
+		self.frame_ids = {}
+		self.frame_count = 0
+		self.generator_frames = []
 		self.preexisting_locals = None
 		self.exception = None
 		self.matplotlib_state_change = False
 
-		# Optional dict from (lineno, time) to a dict of varname: value
+		# Optional dict from lineno to a dict from time to a dict of
+		# varname: compiled value expression. See compile_values.
 		self.values = values
 
+		# Optional Profile, updated as we go
+		self.profile = profile
+
+		# Optional BlobStore for images and plots
+		self.blobs = blobs
+		self.encoder = ImageEncoder(blobs)
+
+		# Optional list of (first, last) line ranges, 1-based and
+		# inclusive. Only code in them is traced, see in_focus. Lines
+		# of traced frames outside them aren't recorded, but count
+		# toward RUNPY_LIMIT all the same.
+		self.focus = focus
+		self.focus_code = {}
+		self.skipped_lines = 0
+
+		# Optional VariableSelection. With one, values that can't have
+		# changed are copied from the frame's last event in frame_events.
+		self.selection = selection
+		self.frame_events = {}
+
+		# Optional Batch, forked at its time, see record_env
+		self.batch = batch
+
+		# Optional LocalModules, traced along with the program. The
+		# state in FILE_STATE is that of self.file, other files' is
+		# in self.files.
+		self.modules = modules
+		self.file = "<string>"
+		self.files = {}
+
+		# Optional MemoryProfile, updated at every event
+		self.memory = memory
+
+		# Optional Speculation, told about the program's module lines
+		self.speculation = speculation
+
 	def data_at(self, l):
 		if not (l in self.data):
 			self.data[l] = []
 		return self.data[l]
 
+	def in_focus(self, frame):
+		code = frame.f_code
+		if not is_program_code(code):
+			# The focus is on part of the program, not on local modules
+			return False
+		r = self.focus_code.get(code)
+		if r == None:
+			r = any(l != None and self.line_in_focus(l) for (_, l) in dis.findlinestarts(code))
+			self.focus_code[code] = r
+		return r
+
+	def line_in_focus(self, lineno):
+		for (first, last) in self.focus:
+			if first <= lineno <= last:
+				return True
+		return False
+
+	def traces(self, frame):
+		# Whether frame runs code of the program or of a local module,
+		# rather than library code
+		code = frame.f_code
+		if is_program_code(code):
+			return frame.f_globals.get("__name__") == "__main__"
+		return self.modules != None and code in self.modules.code
+
+	def switch_file(self, file_name):
+		if file_name == self.file:
+			return
+		self.files[self.file] = {k: getattr(self, k) for k in FILE_STATE}
+		state = self.files.get(file_name)
+		if state == None:
+			(_, lines) = self.modules.files[file_name]
+			(writes, _) = compute_writes(list(lines))
+			state = {
+				"lines": lines,
+				"writes": writes,
+				"data": {},
+				"active_loops": [],
+				"loop_info": None,
+				"prev_env": None,
+				"prev_frame_name": None,
+				"preexisting_locals": None,
+				"selection": VariableSelection(ast.parse("".join(lines))) if self.selection != None else None,
+			}
+		for (k, v) in state.items():
+			setattr(self, k, v)
+		self.file = file_name
+
+	def all_data(self):
+		# The data of every traced file
+		return [self.data] + [state["data"] for (f, state) in self.files.items() if f != self.file]
+
+	def trace_dispatch(self, frame, event, arg):
+		if event == "call" and not self.traces(frame):
+			# Nothing in library frames is recorded (see user_line), so
+			# they run without a local trace function, and their lines
+			# and returns cost nothing. This skips bdb's own dispatch
+			# too, since in library heavy programs most events are
+			# these calls. Program code they call is still traced.
+			self.user_call(frame, arg)
+			return None
+		return bdb.Bdb.trace_dispatch(self, frame, event, arg)
+
+	def dispatch_call(self, frame, arg):
+		if self.focus == None or self.in_focus(frame):
+			return bdb.Bdb.dispatch_call(self, frame, arg)
+		if self.botframe is None:
+			self.botframe = frame.f_back
+		# Run the frame without a local trace function, so none of
+		# its lines or returns are reported to us
+		return None
+
 	def user_call(self, frame, args):
 		if not ("__name__" in frame.f_globals):
 			return
@@ -106,6 +834,7 @@ class Logger(bdb.Bdb):
 		# print("locals")
 		# print(frame.f_locals)
 
+		self.switch_file(frame.f_code.co_filename)
 		if frame.f_code.co_name == "<module>" and self.preexisting_locals == None:
 			self.preexisting_locals = set(frame.f_locals.keys())
 
@@ -115,51 +844,68 @@ class Logger(bdb.Bdb):
 			return
 		if frame.f_code.co_name == "<lambda>":
 			return
-		if not ("__name__" in frame.f_globals):
-			return
-		if frame.f_globals["__name__"] != "__main__":
+		if not self.traces(frame):
 			return
+		if self.speculation != None and frame.f_code.co_name == "<module>" and is_program_code(frame.f_code):
+			self.speculation.line_event(self, frame)
 		# When __qualname__ exists as a local, it means we are executing
 		# the method/field definitions inside a class, so we should
 		# not process these.
 		if "__qualname__" in frame.f_locals:
 			return
+		if self.focus != None and not self.line_in_focus(frame.f_lineno):
+			# Or a loop outside the focus would never stop
+			self.skipped_lines += 1
+			# The line can change anything, so the frame's next event
+			# can't go by its last one, see record_env
+			if self.selection != None:
+				self.frame_events.pop(self.frame_ids.get(id(frame)), None)
+			if self.time + self.skipped_lines >= RUNPY_LIMIT:
+				self.stop_at_limit(self.prev_env)
+			return
 
 		self.exception = None
 		adjusted_lineno = frame.f_lineno-1
+		if self.memory != None:
+			self.memory.event(self.frame_id(frame), adjusted_lineno)
 		self.record_loop_end(frame, adjusted_lineno)
 		self.record_env(frame, adjusted_lineno)
 		self.record_loop_begin(frame, adjusted_lineno)
+		if self.memory != None:
+			self.memory.end_event()
 
 	def record_loop_end(self, frame, lineno):
 		curr_stmt = self.lines[lineno]
-		if self.prev_env != None and len(self.active_loops) > 0 and self.active_loops[-1].frame is frame:
-			prev_lineno = remove_R(self.prev_env[LINE_NO])
+		if self.prev_env != None and len(self.active_loops) > 0 and self.active_loops[-1].frame_id == self.frame_id(frame):
+			prev_lineno = remove_R(self.prev_env.lineno)
 			prev_stmt = self.lines[prev_lineno]
 
 			loop_indent = self.active_loops[-1].indent
 			curr_indent = indent(curr_stmt)
 			curr_frame_name = frame.f_code.co_name
-			prev_frame_name = self.prev_env["frame"].f_code.co_name
-			if is_return_str(prev_stmt) and curr_frame_name == prev_frame_name:
+			if is_return_str(prev_stmt) and curr_frame_name == self.prev_frame_name:
 				# we shouldn't record the end of a loop after
 				# a call to another function with a return statement,
 				# so we need to check whether prev stmt comes from the same frame
 				# as the current one
 				while len(self.active_loops) > 0:
 					self.active_loops[-1].iter += 1
+					self.loop_info = None
 					for l in self.stmts_in_loop(self.active_loops[-1].lineno):
 						self.data_at(l).append(
 							self.create_end_loop_dummy_env())
 					del self.active_loops[-1]
+					self.loop_info = None
 			elif (curr_indent <= loop_indent and lineno != self.active_loops[-1].lineno):
 				# break statements don't go through the loop header, so we miss
 				# the last increment in iter, which is why we have to adjust here
 				if is_break_str(prev_stmt):
 					self.active_loops[-1].iter += 1
+					self.loop_info = None
 				for l in self.stmts_in_loop(self.active_loops[-1].lineno):
 					self.data_at(l).append(self.create_end_loop_dummy_env())
 				del self.active_loops[-1]
+				self.loop_info = None
 
 	def record_loop_begin(self, frame, lineno):
 		# for l in self.active_loops:
@@ -168,9 +914,11 @@ class Logger(bdb.Bdb):
 		if is_loop_str(curr_stmt):
 			if len(self.active_loops) > 0 and self.active_loops[-1].lineno == lineno:
 				self.active_loops[-1].iter += 1
+				self.loop_info = None
 			else:
 				self.active_loops.append(
-					LoopInfo(frame, lineno, indent(curr_stmt)))
+					LoopInfo(self.frame_id(frame), lineno, indent(curr_stmt)))
+				self.loop_info = None
 				for l in self.stmts_in_loop(lineno):
 					self.data_at(l).append(self.create_begin_loop_dummy_env())
 
@@ -187,77 +935,167 @@ class Logger(bdb.Bdb):
 			result.append(l)
 		return result
 
-	def active_loops_iter_str(self):
-		return ",".join([str(l.iter) for l in self.active_loops])
-
-	def active_loops_id_str(self):
-		return ",".join([str(l.lineno) for l in self.active_loops])
-
-	def add_loop_info(self, env):
-		env["#"] = self.active_loops_iter_str()
-		env["$"] = self.active_loops_id_str()
+	def loop_strs(self):
+		# Anything changing active_loops resets loop_info to None
+		if self.loop_info == None:
+			self.loop_info = (
+				",".join([str(l.iter) for l in self.active_loops]),
+				",".join([str(l.lineno) for l in self.active_loops]))
+		return self.loop_info
 
 	def create_begin_loop_dummy_env(self):
-		env = {"begin_loop": self.active_loops_iter_str()}
-		self.add_loop_info(env)
-		return env
+		return LoopMarker("begin_loop", *self.loop_strs())
 
 	def create_end_loop_dummy_env(self):
-		env = {"end_loop": self.active_loops_iter_str()}
-		self.add_loop_info(env)
-		return env
+		return LoopMarker("end_loop", *self.loop_strs())
+
+	def frame_id(self, frame):
+		fid = self.frame_ids.get(id(frame))
+		if fid == None:
+			fid = self.frame_count
+			self.frame_count += 1
+			self.frame_ids[id(frame)] = fid
+			if frame.f_code.co_flags & GENERATOR_FLAGS:
+				self.generator_frames.append(frame)
+		return fid
+
+	def forget_frame(self, frame):
+		# Once a frame is gone, its id() can be reused by a new one.
+		# Generator frames come back after every yield, so we keep
+		# those alive (and their ids) until the end of the run.
+		if not (frame.f_code.co_flags & GENERATOR_FLAGS):
+			fid = self.frame_ids.pop(id(frame), None)
+			self.frame_events.pop(fid, None)
+			if self.memory != None:
+				self.memory.forget(fid)
 
 	def compute_repr(self, v):
+		if self.profile == None:
+			return self.repr_value(v)
+		r = self.profile.timed("compute_repr", self.repr_value, v)
+		if isinstance(r, str):
+			self.profile.count("reprs")
+			self.profile.count("repr_bytes", len(r))
+		return r
+
+	# Images and plots are encoded in the background. Until
+	# resolve_images runs, their envs hold Futures of the html.
+
+	def img_to_html(self, v):
+		if self.profile == None:
+			return self.encoder.submit_image(v)
+		start = time.perf_counter()
+		html = self.encoder.submit_image(v)
+		if html != None:
+			self.profile.add("image_encoding", time.perf_counter() - start)
+			self.profile.count("images")
+		return html
+
+	def plot_to_html(self):
+		if self.profile == None:
+			return self.encoder.submit_plot()
+		self.profile.count("images")
+		return self.profile.timed("image_encoding", self.encoder.submit_plot)
+
+	def resolve_images(self):
+		if len(self.encoder.futures) == 0:
+			return
+		for data in self.all_data():
+			for envs in data.values():
+				for e in envs:
+					if isinstance(e, Event):
+						resolve_futures(e.values)
+						if e.extras != None:
+							resolve_futures(e.extras)
+						if isinstance(e.plot, Future):
+							e.plot = future_to_html(e.plot)
+		self.encoder.shutdown()
+
+	def repr_value(self, v):
 		if isinstance(v, types.FunctionType):
 			return None
 		if isinstance(v, types.ModuleType):
 			return None
 		if isinstance(v, type):
 			return None
-		html = if_img_convert_to_html(v)
+		html = self.img_to_html(v)
 		if html == None:
+			renderer = find_renderer(v) if SUMMARIZE else None
 			try:
-				return repr(v)
+				return repr(v) if renderer == None else renderer(v)
 			except:
 				return "Repr exception " + str(type(v))
 		else:
-			return add_html_escape(html)
+			return html
+
+	def apply_overrides(self, frame, overrides):
+		# Replace the current values with the given ones
+		# Every access to frame.f_locals re-syncs it from the frame,
+		# so only read it once.
+		f_locals = frame.f_locals
+		changed = False
+		for (varname, code) in overrides.items():
+			if varname in f_locals:
+				f_locals[varname] = eval(code, frame.f_globals)
+				changed = True
+		if changed:
+			ctypes.pythonapi.PyFrame_LocalsToFast(
+				ctypes.py_object(frame), ctypes.c_int(0))
+
+	def changed_names(self, prev):
+		# The names whose values can differ from the event prev, or
+		# None if any can
+		if prev == None:
+			return None
+		names = self.selection.changed(remove_R(prev.lineno))
+		if names == None:
+			return None
+		for loop in self.active_loops:
+			if loop.frame_id == prev.frame_id and loop.lineno in self.writes:
+				names = names.union(self.writes[loop.lineno])
+		return names
 
 	def record_env(self, frame, lineno):
-		line_time = "(%s,%d)" % (lineno, self.time)
-		if line_time in self.values:
-			# Replace the current values with the given ones first
-			print('%s:' % line_time)
-			env = self.values[line_time]
-			print(frame.f_locals)
-
-			for varname in frame.f_locals:
-				if varname in env:
-					new_value = eval(env[varname])
-					print("\t'%s': '%s' -> '%s'" % (varname,
-													repr(frame.f_locals[varname]), repr(new_value)))
-					frame.f_locals.update({varname: new_value})
-					ctypes.pythonapi.PyFrame_LocalsToFast(
-						ctypes.py_object(frame), ctypes.c_int(0))
-
-		env = {}
-		env["frame"] = frame
-		env[TIME] = self.time
-		self.add_loop_info(env)
+		if self.batch != None and self.batch.index == None and self.time == self.batch.time:
+			if not self.batch.fork(self):
+				# The children run the rest of the program
+				self.set_quit()
+				return
+
+		overridden = False
+		if self.values and is_program_code(frame.f_code):
+			overrides = self.values.get(lineno)
+			if overrides != None and self.time in overrides:
+				self.apply_overrides(frame, overrides[self.time])
+				overridden = True
+
+		env = Event(self.frame_id(frame), self.time, *self.loop_strs())
 		self.time = self.time + 1
-		for k in frame.f_locals:
+		changed = None
+		if self.selection != None:
+			prev = self.frame_events.get(env.frame_id)
+			if not overridden:
+				changed = self.changed_names(prev)
+			self.frame_events[env.frame_id] = env
+		f_locals = frame.f_locals
+		for k in f_locals:
 			if k != magic_var_name and (frame.f_code.co_name != "<module>" or not k in self.preexisting_locals):
-				r = self.compute_repr(frame.f_locals[k])
+				if changed != None and not k in changed and k in prev.values:
+					env.values[k] = prev.values[k]
+					continue
+				r = self.compute_repr(f_locals[k])
 				if (r != None):
-					env[k] = r
-		env[LINE_NO] = lineno
+					env.values[k] = r
+		env.lineno = lineno
+		if self.memory != None and self.memory.usage != None:
+			env.add(MEMORY_USAGE, self.memory.usage)
 
 		if self.matplotlib_state_change:
-			env["Plot"] = add_html_escape(matplotlib_fig_as_html())
+			env.plot = self.plot_to_html()
 			self.matplotlib_state_change = False
 
 			if self.prev_env != None:
-				prev_lineno = remove_R(self.prev_env[LINE_NO])
+				prev_lineno = remove_R(self.prev_env.lineno)
 				if not is_clf_str(self.lines[prev_lineno]):
 					if not (prev_lineno in self.writes):
 						self.writes[prev_lineno] = []
@@ -266,17 +1104,23 @@ class Logger(bdb.Bdb):
 		self.data_at(lineno).append(env)
 
 		if (self.prev_env != None):
-			self.prev_env["next_lineno"] = lineno
-			env["prev_lineno"] = self.prev_env[LINE_NO]
+			self.prev_env.next_lineno = lineno
+			env.prev_lineno = self.prev_env.lineno
 
 		self.prev_env = env
+		self.prev_frame_name = frame.f_code.co_name
 
-		if self.time >= RUNPY_LIMIT:
-			# Special case for reaching the max limit
+		if self.time + self.skipped_lines >= RUNPY_LIMIT:
+			self.stop_at_limit(env)
+
+	def stop_at_limit(self, env):
+		# Special case for reaching the max limit, env is the last
+		# event recorded, if any
+		if env != None:
 			html = add_red_format('Projection Boxes Maximum Limit Reached')
 			r = add_html_escape(html)
-			env["Exception Thrown"] = r
-			self.set_quit()
+			env.add("Exception Thrown", r)
+		self.set_quit()
 
 	def user_exception(self, frame, e):
 		# Non-errors can accidentally overwrite actual errors we care about
@@ -300,14 +1144,19 @@ class Logger(bdb.Bdb):
 			return
 		if frame.f_code.co_name == "<lambda>":
 			return
-		if not ("__name__" in frame.f_globals):
-			return
-		if frame.f_globals["__name__"] != "__main__":
+		if not self.traces(frame):
 			return
 		if "__qualname__" in frame.f_locals:
 			return
+		if self.focus != None and not self.line_in_focus(frame.f_lineno):
+			# Not recorded, but the frame is gone all the same
+			self.forget_frame(frame)
+			return
 
+		self.switch_file(frame.f_code.co_filename)
 		adjusted_lineno = frame.f_lineno-1
+		if self.memory != None:
+			self.memory.event(self.frame_id(frame), "R" + str(adjusted_lineno))
 
 		self.record_env(frame, "R" + str(adjusted_lineno))
 		if self.exception == None:
@@ -319,14 +1168,55 @@ class Logger(bdb.Bdb):
 			r = add_html_escape(html)
 			rv_name = "Exception Thrown"
 		if r != None and (frame.f_code.co_name != "<module>" or self.exception != None):
-			self.data_at("R" + str(adjusted_lineno))[-1][rv_name] = r
+			self.data_at("R" + str(adjusted_lineno))[-1].add(rv_name, r)
 		self.record_loop_end(frame, adjusted_lineno)
+		self.forget_frame(frame)
+		if self.memory != None:
+			self.memory.end_event()
 
 	def pretty_print_data(self):
 		for k in self.data:
 			print("** Line " + str(k))
 			for env in self.data[k]:
-				print(env)
+				print(env.to_env())
+
+
+class LineProfilingLogger(Logger):
+	# A Logger that also keeps a LineProfile up to date. Its own work
+	# happens between the perf_counter calls, so it isn't charged.
+
+	def __init__(self, line_profile, *args, **kwargs):
+		Logger.__init__(self, *args, **kwargs)
+		self.line_profile = line_profile
+
+	def user_call(self, frame, args):
+		p = self.line_profile
+		p.charge(time.perf_counter())
+		if is_program_code(frame.f_code):
+			p.call(frame.f_code)
+		Logger.user_call(self, frame, args)
+		p.last = time.perf_counter()
+
+	def user_line(self, frame):
+		p = self.line_profile
+		p.charge(time.perf_counter())
+		if is_program_code(frame.f_code):
+			p.hit(frame.f_code, frame.f_lineno-1)
+		Logger.user_line(self, frame)
+		p.last = time.perf_counter()
+
+	def user_return(self, frame, rv):
+		p = self.line_profile
+		p.charge(time.perf_counter())
+		Logger.user_return(self, frame, rv)
+		if is_program_code(frame.f_code):
+			# Back to the line that called us, if it's ours
+			caller = frame.f_back
+			if caller != None and is_program_code(caller.f_code) and caller.f_code in p.functions:
+				(p.line, p.code) = (caller.f_lineno-1, caller.f_code)
+			else:
+				(p.line, p.code) = (None, None)
+		p.last = time.perf_counter()
 
 
 class WriteCollector(ast.NodeVisitor):
@@ -373,27 +1263,128 @@ class WriteCollector(ast.NodeVisitor):
 		return None
 
 
+class VariableSelection:
+	"""
+	Which variables a line can change, going by the names on it, for
+	RUNPY_SELECTIVE. Only lines that just bind names are narrowed down
+	like this. One that runs other code (a call, a loop header, a yield)
+	or changes an object in place (x[i] = ..., x.a = ..., x += ...) can
+	change any object, under any of its names, so every variable is
+	recorded again after it.
+	"""
+
+	def __init__(self, root):
+		self.names = {}
+		self.mutating_lines = set()
+		for node in ast.walk(root):
+			if isinstance(node, ast.Name):
+				self.names.setdefault(node.lineno-1, set()).add(node.id)
+			elif isinstance(node, MUTATING_NODES):
+				self.mutating_lines.add(node.lineno-1)
+			elif isinstance(node, (ast.Subscript, ast.Attribute)) and isinstance(node.ctx, (ast.Store, ast.Del)):
+				self.mutating_lines.add(node.lineno-1)
+			elif isinstance(node, ast.comprehension):
+				self.mutating_lines.add(node.iter.lineno-1)
+		# A simple statement can be reported on any of its lines
+		for node in ast.walk(root):
+			if isinstance(node, ast.stmt) and not hasattr(node, "body") and node.end_lineno > node.lineno:
+				span = range(node.lineno-1, node.end_lineno)
+				names = set()
+				for l in span:
+					names.update(self.names.get(l, ()))
+				for l in span:
+					self.names[l] = names
+					if l in self.mutating_lines:
+						self.mutating_lines.update(span)
+		self.empty = frozenset()
+
+	def changed(self, lineno):
+		# None if any variable can have changed
+		if lineno in self.mutating_lines:
+			return None
+		return self.names.get(lineno, self.empty)
+
+
+def remove_noops_above_error(lines, start, end, e):
+	# Blank out the noop placeholders in lines[start:end] that are at or
+	# above the error. Returns False if there was nothing left to blank out.
+	if e.lineno == None:
+		return False
+	lineno = min(start + e.lineno - 1, end - 1)
+	did_lines_change = False
+	while lineno >= start:
+		if lines[lineno].find(magic_var_name) != -1:
+			# (lisa) able to remove boxes at comment lines inside a function body,
+			# but not top level -- needs to handle the latter in RTVDisplay
+			lines[lineno] = "\n"
+			did_lines_change = True
+		lineno = lineno - 1
+	return did_lines_change
+
+
+def is_block_start(line, prev_line):
+	# Whether `line` starts a new top-level statement, judging only
+	# by its text. It's fine to be wrong here, see recover_syntax_errors.
+	if line == "" or line[0].isspace() or line[0] == "#":
+		return False
+	if line.startswith(magic_var_name):
+		return False
+	if re.match("(else|elif|except|finally)\\b|[)\\]}]", line):
+		return False
+	if prev_line != None and prev_line.startswith("@"):
+		return False
+	return True
+
+
+def top_level_blocks(lines):
+	blocks = []
+	start = 0
+	prev_line = None
+	for i in range(len(lines)):
+		line = lines[i]
+		if line.strip() == "":
+			continue
+		if i > start and is_block_start(line, prev_line):
+			blocks.append((start, i))
+			start = i
+		if not line[0].isspace():
+			prev_line = line
+	blocks.append((start, len(lines)))
+	return blocks
+
+
+def recover_syntax_errors(lines):
+	# Parse every top-level block on its own and remove the noop
+	# placeholders that break it, re-parsing only that block. This keeps
+	# the total work close to a single pass over the file, however many
+	# errors the placeholders cause.
+	for (start, end) in top_level_blocks(lines):
+		while True:
+			try:
+				ast.parse("".join(lines[start:end]))
+				break
+			except SyntaxError as e:
+				if not remove_noops_above_error(lines, start, end, e):
+					# Either a real syntax error, or we split the file
+					# in the wrong place. The full parse will tell.
+					break
+
+
 def compute_writes(lines):
 	exception = None
 	try:
-		done = False
-		while not done:
-			try:
-				code = "".join(lines)
-				root = ast.parse(code)
-				done = True
-			except Exception as e:
-				lineno = e.lineno-1
-				did_lines_change = False
-				while lineno >= 0:
-					if lines[lineno].find(magic_var_name) != -1:
-						# (lisa) able to remove boxes at comment lines inside a function body,
-						# but not top level -- needs to handle the latter in RTVDisplay
-						lines[lineno] = "\n"
-						did_lines_change = True
-					lineno = lineno - 1
-				if not did_lines_change:
-					raise
+		try:
+			root = ast.parse("".join(lines))
+		except SyntaxError:
+			recover_syntax_errors(lines)
+			done = False
+			while not done:
+				try:
+					root = ast.parse("".join(lines))
+					done = True
+				except SyntaxError as e:
+					if not remove_noops_above_error(lines, 0, len(lines), e):
+						raise
 	except Exception as e:
 		exception = e
 
@@ -406,46 +1397,185 @@ def compute_writes(lines):
 	return (writes, exception)
 
 
-def compute_runtime_data(lines, writes, values):
+def compile_values(values):
+	# The values file maps "(lineno,time)" strings to dicts of
+	# varname: expression. Index them by lineno, then time, and compile
+	# the expressions once, so lines without overrides cost one lookup.
+	index = {}
+	for (line_time, env) in values.items():
+		(lineno, time) = line_time.strip()[1:-1].rsplit(",", 1)
+		lineno = lineno.strip()
+		if not lineno.startswith("R"):
+			lineno = int(lineno)
+		overrides = index.setdefault(lineno, {}).setdefault(int(time), {})
+		for (varname, expr) in env.items():
+			# The envs also carry bookkeeping entries like "#" or "time"
+			if not (varname.isidentifier() and isinstance(expr, str)):
+				continue
+			try:
+				overrides[varname] = compile(expr, "<value>", "eval")
+			except SyntaxError:
+				# Let eval report it if the variable is ever overridden
+				overrides[varname] = expr
+	return index
+
+
+def focus_ranges(lines, focus):
+	# The focus is either a line range, "first-last" (1-based and
+	# inclusive), a single line, or the name of a function ("f", or
+	# "C.f" for a method). Functions are focused on their bodies, since
+	# their def line runs in the enclosing frame. Returns None, meaning
+	# trace everything, if there is no focus or no such function.
+	if focus.strip() == "":
+		return None
+	m = re.fullmatch("\\s*(\\d+)\\s*(-\\s*(\\d+))?\\s*", focus)
+	if m != None:
+		first = int(m.group(1))
+		last = int(m.group(3)) if m.group(3) != None else first
+		return [(first, last)]
+
+	ranges = []
+	def visit(node, prefix):
+		for child in ast.iter_child_nodes(node):
+			if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+				name = prefix + child.name
+				if not isinstance(child, ast.ClassDef) and focus in (child.name, name):
+					ranges.append((child.body[0].lineno, child.end_lineno))
+				visit(child, name + ".")
+			else:
+				visit(child, prefix)
+	try:
+		visit(ast.parse("".join(lines)), "")
+	except SyntaxError:
+		return None
+	return ranges if len(ranges) > 0 else None
+
+
+def compute_runtime_data(lines, writes, values, *, profile=None, blobs=None, focus=None, selection=None, line_profile=None, capture=None, batch=None, modules=None, memory=None, load_cache=None, speculation=None):
 	exception = None
 	if len(lines) == 0:
 		return ({}, exception)
 	code = "".join(lines)
-	l = Logger(lines, writes, values)
+	if "matplotlib" in code:
+		# Import pyplot before tracing starts, so its import isn't traced
+		import matplotlib.pyplot
+		# and don't draw on top of an earlier run's figures
+		matplotlib.pyplot.close("all")
+	if load_cache != None and "pandas" in code:
+		# Its loaders can only be wrapped once it's imported
+		import pandas
+	options = {
+		"profile": profile,
+		"blobs": blobs,
+		"focus": focus,
+		"selection": selection,
+		"batch": batch,
+		"modules": modules,
+		"memory": memory,
+		"speculation": speculation,
+	}
+	if line_profile != None:
+		l = LineProfilingLogger(line_profile, lines, writes, values, **options)
+	else:
+		l = Logger(lines, writes, values, **options)
+	# Run in a fresh namespace rather than run.py's own, so repeated
+	# runs in one process don't see each other's (or run.py's) globals
+	namespace = {"__name__": "__main__", "__builtins__": builtins}
+	if capture != None:
+		capture.logger = l
+		(stdout, stderr) = (sys.stdout, sys.stderr)
+		(sys.stdout, sys.stderr) = capture.streams()
+	if modules != None:
+		modules.install()
+	if memory != None:
+		memory.start()
+	if load_cache != None:
+		load_cache.install()
+	start = time.perf_counter()
 	try:
-		l.run(code)
+		while True:
+			try:
+				l.run(code, namespace)
+			except Resume:
+				pass
+			if speculation == None or speculation.program == None:
+				break
+			# A runner resumed from a checkpoint, see Speculation
+			code = speculation.resume(l)
 	except Exception as e:
 		exception = e
-	l.data = adjust_to_next_time_step(l.data, l.lines)
-	remove_frame_data(l.data)
-	return (l.data, exception)
+	finally:
+		if memory != None:
+			memory.stop()
+		if load_cache != None:
+			load_cache.uninstall()
+		if capture != None:
+			(sys.stdout, sys.stderr) = (stdout, stderr)
+		if modules != None:
+			modules.uninstall()
+	l.switch_file("<string>")
+	if batch != None and batch.forked():
+		# What the parent traced is also in every child's output
+		return ({}, None)
+	if line_profile != None:
+		line_profile.charge(time.perf_counter())
+	if profile != None:
+		profile.add("tracing", time.perf_counter() - start)
+		profile.timed("image_wait", l.resolve_images)
+		profile.count("events", l.time)
+		l.data = profile.timed("adjust_to_next_time_step", adjust_to_next_time_step, l.data, l.lines)
+	else:
+		l.resolve_images()
+		l.data = adjust_to_next_time_step(l.data, l.lines)
+	compact = selection != None and not TRACE_STORE
+	for (file_name, state) in l.files.items():
+		if file_name != l.file:
+			(name, _) = modules.files[file_name]
+			data = adjust_to_next_time_step(state["data"], state["lines"])
+			modules.traces[name] = {"writes": state["writes"], "data": events_to_envs(data, compact)}
+	return (events_to_envs(l.data, compact), exception)
+
+
+def future_to_html(future):
+	try:
+		return add_html_escape(future.result())
+	except Exception as e:
+		return "Repr exception " + str(e)
+
+
+def resolve_futures(values):
+	for (k, v) in values.items():
+		if isinstance(v, Future):
+			values[k] = future_to_html(v)
 
 
 def adjust_to_next_time_step(data, lines):
 	envs_by_time = {}
 	for lineno in data:
 		for env in data[lineno]:
-			if TIME in env:
-				envs_by_time[env[TIME]] = env
+			if isinstance(env, Event):
+				envs_by_time[env.time] = env
+	# With local modules traced too, the times of one file's events
+	# have gaps, so step through the times this file has
+	times = sorted(envs_by_time)
+	next_index = {t: i + 1 for (i, t) in enumerate(times)}
 	new_data = {}
 	for lineno in data:
 		next_envs = []
 		for env in data[lineno]:
-			if "begin_loop" in env:
-				next_envs.append(env)
-			elif "end_loop" in env:
+			if isinstance(env, LoopMarker):
 				next_envs.append(env)
-			elif TIME in env:
-				next_time = env[TIME]+1
-				while next_time in envs_by_time:
-					next_env = envs_by_time[next_time]
-					if "frame" in env and "frame" in next_env and env["frame"] is next_env["frame"]:
-						curr_stmt = lines[env[LINE_NO]]
-						next_stmt = lines[remove_R(next_env[LINE_NO])]
-						if "Exception Thrown" in next_env or not is_loop_str(curr_stmt) or indent(next_stmt) > indent(curr_stmt):
+			else:
+				i = next_index[env.time]
+				while i < len(times):
+					next_env = envs_by_time[times[i]]
+					if env.frame_id == next_env.frame_id:
+						curr_stmt = lines[env.lineno]
+						next_stmt = lines[remove_R(next_env.lineno)]
+						if next_env.has("Exception Thrown") or not is_loop_str(curr_stmt) or indent(next_stmt) > indent(curr_stmt):
 							next_envs.append(next_env)
 						break
-					next_time = next_time + 1
+					i = i + 1
 				# next_time = env[TIME]+1
 				# if next_time in envs_by_time:
 				# 	next_envs.append(envs_by_time[next_time])
@@ -453,18 +1583,64 @@ def adjust_to_next_time_step(data, lines):
 	return new_data
 
 
-def remove_frame_data(data):
+def events_to_envs(data, compact=False):
+	# An event can show up on more than one line, convert it once
+	envs = {}
+	if compact:
+		# Each event takes unchanged values from the last event of
+		# its frame that is also in the output
+		events = {}
+		for lineno in data:
+			for e in data[lineno]:
+				if isinstance(e, Event):
+					events[id(e)] = e
+		last = {}
+		for e in sorted(events.values(), key=lambda e: e.time):
+			envs[id(e)] = e.to_env(last.get(e.frame_id))
+			last[e.frame_id] = e
+	new_data = {}
 	for lineno in data:
-		for env in data[lineno]:
-			if "frame" in env:
-				del env["frame"]
+		new_data[lineno] = []
+		for e in data[lineno]:
+			env = envs.get(id(e))
+			if env == None:
+				env = envs[id(e)] = e.to_env()
+			new_data[lineno].append(env)
+	return new_data
+
+
+# Kept for as long as the process, so runs in run.py --serve share it
+load_cache = LoadCache(LOAD_CACHE_MAX_BYTES) if LOAD_CACHE else None
+
+
+def replay_cached_run(file, entry):
+	with open(file + ".out", "w") as out:
+		out.write(entry["output"])
+	sys.stdout.write(entry["stdout"])
+	sys.stderr.write(entry["stderr"])
+	if entry["failed"]:
+		sys.exit(1)
 
 
-def main(file, values_file=None):
+def main(file, values_file=None, speculation=None):
 	# Setup
-	values = []
+	profile = Profile() if PROFILE else None
+	line_profile = LineProfile() if LINE_PROFILE else None
+	capture = OutputCapture(OUTPUT_MAX_BYTES) if CAPTURE_OUTPUT else None
+	modules = LocalModules([p for p in MODULES.split(os.pathsep) if p != ""]) if MODULES != "" else None
+	memory = MemoryProfile() if MEMORY else None
+	blobs = BlobStore(file + ".blobs") if BLOBS else None
+	values = {}
+	batch = None
 	if values_file:
-		values = json.load(open(values_file))
+		with open(values_file) as f:
+			values = json.load(f)
+		# A list of value sets gets a list of outputs, see Batch
+		if isinstance(values, list):
+			batch = Batch([compile_values(v) for v in values])
+			values = {}
+		else:
+			values = compile_values(values)
 
 	# Return values
 	run_time_data = {}
@@ -475,33 +1651,560 @@ def main(file, values_file=None):
 	exception = None
 
 	# First, cleanup the input. This may fail.
-	(lines, exception) = load_code_lines(file)
+	if profile != None:
+		(lines, exception) = profile.timed("load_code_lines", load_code_lines, file)
+	else:
+		(lines, exception) = load_code_lines(file)
 	if exception is not None:
 		return_code = 1
 
-	if return_code == 0:
-		(writes, exception) = compute_writes(lines)
-		if exception != None:
-			return_code = 1
-
-	if return_code == 0:
-		(run_time_data, exception) = compute_runtime_data(lines, writes, values)
-		if (exception != None):
-			return_code = 2
+	# Then, check if we've already run this exact program.
+	# Profiled runs always execute, since that's what they measure, and
+	# so do runs timing lines, tracking memory or counting load cache
+	# hits. Neither do batches, most of their work is in processes the
+	# recorder doesn't see, nor speculative runs, whose program can
+	# change as they go.
+	measures = profile != None or line_profile != None or memory != None or load_cache != None
+	key = None
+	if return_code == 0 and cache.enabled() and not measures and batch == None and speculation == None:
+		# Outputs with blob references are only valid next to their blobs
+		options = blobs.directory if blobs != None else ""
+		if TRACE_STORE:
+			options += ";trace"
+		if FOCUS != "":
+			options += ";focus=" + FOCUS
+		if SELECTIVE:
+			options += ";selective"
+		if CAPTURE_OUTPUT:
+			options += ";output=%d" % OUTPUT_MAX_BYTES
+		if MODULES != "":
+			options += ";modules=" + MODULES
+		if not SUMMARIZE:
+			options += ";full"
+		key = cache.cache_key(lines, values_file, os.getcwd(), options)
+		entry = cache.lookup(key)
+		if entry != None:
+			replay_cached_run(file, entry)
+			return
 
+	recorder = cache.RunRecorder([blobs.directory] if blobs != None else [])
+	if load_cache != None:
+		load_cache.recorder = recorder
+	with recorder:
+		if return_code == 0:
+			if profile != None:
+				(writes, exception) = profile.timed("compute_writes", compute_writes, lines)
+			else:
+				(writes, exception) = compute_writes(lines)
+			if exception != None:
+				return_code = 1
+
+		if return_code == 0:
+			focus = focus_ranges(lines, FOCUS)
+			selection = VariableSelection(ast.parse("".join(lines))) if SELECTIVE else None
+			(run_time_data, exception) = compute_runtime_data(
+				lines, writes, values,
+				profile=profile,
+				blobs=blobs,
+				focus=focus,
+				selection=selection,
+				line_profile=line_profile,
+				capture=capture,
+				batch=batch,
+				modules=modules,
+				memory=memory,
+				load_cache=load_cache,
+				speculation=speculation)
+			if (exception != None):
+				return_code = 2
+
+	if TRACE_STORE:
+		trace_file = file + ".trace"
+		if batch != None and batch.index != None:
+			trace_file = "%s.%d.trace" % (file, batch.index)
+		if profile != None:
+			profile.timed("trace_store", tracestore.write, trace_file, run_time_data)
+		else:
+			tracestore.write(trace_file, run_time_data)
+		run_time_data = {}
+
+	extras = {}
+	if capture != None:
+		extras.update(capture.to_json())
+	if modules != None:
+		extras.update(modules.to_json())
+	if line_profile != None:
+		extras.update(line_profile.to_json())
+	if memory != None:
+		extras.update(memory.to_json())
+	if load_cache != None:
+		extras.update(load_cache.to_json())
+	if profile != None:
+		output = profile.timed("json_dumps", json.dumps, (return_code, writes, run_time_data))
+		profile.count("bytes_written", len(output))
+		extras.update(profile.to_json())
+	else:
+		output = json.dumps((return_code, writes, run_time_data))
+	if len(extras) > 0:
+		# Extras go last, so readers of the first three entries are unaffected
+		output = output[:-1] + ", " + json.dumps(extras) + "]"
+	if batch != None:
+		if batch.index != None:
+			batch.send(output, exception)
+		outputs = batch.collect(output, json.dumps((2, writes, {})))
+		output = "[" + ", ".join(outputs) + "]"
 	with open(file + ".out", "w") as out:
-		out.write(json.dumps((return_code, writes, run_time_data)))
+		out.write(output)
+
+	if blobs != None:
+		blobs.collect_garbage()
+
+	if key != None and not recorder.writes_files and cache.is_cacheable("".join(lines)):
+		stderr = recorder.stderr.copy.getvalue()
+		if exception != None:
+			stderr += "".join(traceback.format_exception(type(exception), exception, exception.__traceback__))
+		entry = {
+			"output": output,
+			"stdout": recorder.stdout.copy.getvalue(),
+			"stderr": stderr,
+			"failed": exception != None,
+		}
+		deps = recorder.deps()
+		if blobs != None:
+			# Replaying this entry needs its blobs to still be there
+			deps += blobs.paths()
+		if TRACE_STORE:
+			deps.append(os.path.abspath(file + ".trace"))
+		cache.store(key, entry, deps)
 
 	if exception != None:
 		raise exception
 
 
+class CheckedAssertionError(AssertionError):
+	# Raised by the asserts of a checked program, see AssertRecorder
+	pass
+
+
+class AssertRecorder(ast.NodeTransformer):
+	"""
+	Turns every `assert test, msg` of a checked program into a call
+	that records whether test held, raising CheckedAssertionError(msg)
+	if it didn't. Each assert that runs gets an outcome, and a failed
+	one still ends the run (unless the program catches it), since what
+	comes after it may only fail because of it.
+	"""
+
+	def visit_Assert(self, node):
+		call = ast.Call(ast.Name(CHECK_ASSERT, ast.Load()), [ast.Constant(node.lineno), node.test], [])
+		error = ast.Call(ast.Name(CHECK_FAILED, ast.Load()), [node.msg] if node.msg != None else [], [])
+		return ast.copy_location(ast.If(ast.UnaryOp(ast.Not(), call), [ast.Raise(error, None)], []), node)
+
+
+def exception_line(e):
+	# The line of the program the exception was raised on
+	if isinstance(e, SyntaxError):
+		return e.lineno
+	lineno = None
+	tb = e.__traceback__
+	while tb != None:
+		if tb.tb_frame.f_code.co_filename == "<string>":
+			lineno = tb.tb_lineno
+		tb = tb.tb_next
+	return lineno
+
+
+def check_program(code):
+	# Runs code as is: no tracing, no repr and no images. Only whether
+	# it got to the end, the exception it didn't and the outcome of its
+	# asserts, as {lineno: [passed, failed]}. A failed assert that ends
+	# the run only counts as that, not as an exception.
+	asserts = {}
+
+	def record(lineno, test):
+		held = bool(test)
+		(passed, failed) = asserts.get(lineno, [0, 0])
+		asserts[lineno] = [passed + 1, failed] if held else [passed, failed + 1]
+		return held
+
+	namespace = {"__name__": "__main__", "__builtins__": builtins, CHECK_ASSERT: record, CHECK_FAILED: CheckedAssertionError}
+	exception = None
+	start = time.perf_counter()
+	try:
+		tree = ast.fix_missing_locations(AssertRecorder().visit(ast.parse(code, "<string>")))
+		exec(compile(tree, "<string>", "exec"), namespace)
+	except SystemExit as e:
+		if e.code != None and e.code != 0:
+			exception = e
+	except CheckedAssertionError:
+		pass
+	except BaseException as e:
+		exception = e
+	rs = {
+		"ok": exception == None and all(failed == 0 for (_, failed) in asserts.values()),
+		"exception": None,
+		"asserts": asserts,
+		"seconds": time.perf_counter() - start,
+		"timeout": False,
+	}
+	if exception != None:
+		rs["exception"] = {"type": type(exception).__name__, "message": str(exception), "lineno": exception_line(exception)}
+	return rs
+
+
+def failed_check(seconds, timeout):
+	return {"ok": False, "exception": None, "asserts": {}, "seconds": seconds, "timeout": timeout}
+
+
+def import_libraries(programs):
+	# Imported once here instead of in every child of check_programs.
+	# Only library modules (see cache.library_dirs), importing the
+	# program's own would run them.
+	names = set()
+	for code in programs:
+		try:
+			tree = ast.parse(code)
+		except SyntaxError:
+			continue
+		for node in tree.body:
+			if isinstance(node, ast.Import):
+				names.update(alias.name for alias in node.names)
+			elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module != None:
+				names.add(node.module)
+	for name in names:
+		try:
+			spec = importlib.util.find_spec(name.split(".")[0])
+			if spec == None or spec.origin == None:
+				continue
+			if spec.has_location and not cache.is_library_file(spec.origin):
+				continue
+			importlib.import_module(name)
+		except Exception:
+			pass
+
+
+def check_programs(programs, timeout=CHECK_TIMEOUT):
+	# check_program for every program, each in a child process of its
+	# own, so they all start from the same state and the ones still
+	# running after timeout seconds can be killed. Up to one child per
+	# CPU runs at a time.
+	import_libraries(programs)
+	(i, rs) = fork_children(len(programs), timeout)
+	if i != None:
+		devnull = os.open(os.devnull, os.O_WRONLY)
+		os.dup2(devnull, 1)
+		os.dup2(devnull, 2)
+		sys.stdout = sys.stderr = open(os.devnull, "w")
+		with os.fdopen(rs, "w") as f:
+			f.write(json.dumps(check_program(programs[i])))
+		os._exit(0)
+	# A child with no result ended the process itself
+	return [json.loads(data) if data else failed_check(seconds, killed) for (data, seconds, killed) in rs]
+
+
+def check(file):
+	# `run.py --check file`: file holds a JSON list of programs, file.out
+	# gets the list of their check_program results.
+	with open(file) as f:
+		programs = json.load(f)
+	with open(file + ".out", "w") as out:
+		out.write(json.dumps(check_programs(programs)))
+
+
+def result_diff(old, new):
+	# What changed from result old to result new, both as written to
+	# <file>.out: the return code, writes and extras if they changed,
+	# and for each line of run_time_data that changed, either null (the
+	# line has no envs anymore) or its new list of envs, in which the
+	# time of an env the line had in old, unchanged, stands for it.
+	# Envs are matched by their line and time, not their place in the
+	# list, so the ones after an added or removed one still match.
+	diff = {"return_code": new[0]}
+	if new[1] != old[1]:
+		diff["writes"] = new[1]
+	(old_data, new_data) = (old[2], new[2])
+	lines = {}
+	for key in old_data:
+		if not key in new_data:
+			lines[key] = None
+	for (key, envs) in new_data.items():
+		old_envs = old_data.get(key)
+		if old_envs == None:
+			lines[key] = envs
+		elif envs != old_envs:
+			# Times that show up twice don't name one env
+			by_time = {}
+			for env in old_envs:
+				t = env.get(TIME)
+				if t != None:
+					by_time[t] = None if t in by_time else env
+			lines[key] = [env[TIME] if by_time.get(env.get(TIME)) == env else env for env in envs]
+	diff["lines"] = lines
+	old_extras = old[3] if len(old) > 3 else {}
+	new_extras = new[3] if len(new) > 3 else {}
+	if new_extras != old_extras:
+		diff["extras"] = new_extras
+	return diff
+
+
+def forget_local_modules(before):
+	# Modules the program imported from outside the library dirs (see
+	# cache.library_dirs) are its own, import them again next time in
+	# case they changed. Library modules stay loaded, that's what makes
+	# serve fast, and some can't be loaded twice in one process.
+	for name in set(sys.modules.keys()) - before:
+		file_name = getattr(sys.modules[name], "__file__", None)
+		if file_name and not cache.is_library_file(file_name):
+			del sys.modules[name]
+
+
+def serve_request(request, previous, speculations):
+	cwd = request.get("cwd")
+	if cwd:
+		os.chdir(cwd)
+		if not cwd in sys.path:
+			sys.path.append(cwd)
+	if "check" in request:
+		return {"checks": check_programs(request["check"], request.get("timeout", CHECK_TIMEOUT))}
+	if "code" in request:
+		return serve_speculation(request, previous, speculations)
+
+	file = request["file"]
+	# A run that ends before writing its output mustn't be answered
+	# with the previous one's
+	if os.path.exists(file + ".out"):
+		os.remove(file + ".out")
+
+	modules = set(sys.modules.keys())
+	# The program gets no input and can't write to the client's end of
+	# the pipe (fds 0 and 1), only to the streams sent back with the result
+	(stdin, stdout, stderr) = (sys.stdin, sys.stdout, sys.stderr)
+	sys.__stdout__.flush()
+	saved_fds = (os.dup(0), os.dup(1))
+	devnull = os.open(os.devnull, os.O_RDWR)
+	os.dup2(devnull, 0)
+	os.dup2(devnull, 1)
+	os.close(devnull)
+	(sys.stdin, sys.stdout, sys.stderr) = (io.StringIO(), io.StringIO(), io.StringIO())
+	try:
+		main(file, request.get("values"))
+	except SystemExit:
+		# A failed run replayed from the cache, or a program that
+		# exited, see below
+		pass
+	except BaseException as e:
+		sys.stderr.write("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+	finally:
+		(out, err) = (sys.stdout.getvalue(), sys.stderr.getvalue())
+		(sys.stdin, sys.stdout, sys.stderr) = (stdin, stdout, stderr)
+		for (fd, saved) in enumerate(saved_fds):
+			os.dup2(saved, fd)
+			os.close(saved)
+		forget_local_modules(modules)
+
+	if not os.path.exists(file + ".out"):
+		doc = request.get("doc")
+		previous.pop(doc, None)
+		return {"doc": doc, "error": "the run ended without a result", "stdout": out, "stderr": err}
+	with open(file + ".out") as f:
+		output = f.read()
+	return serve_response(request, output, out, err, previous)
+
+
+def serve_response(request, output, out, err, previous):
+	result = json.loads(output)
+	doc = request.get("doc")
+	(version, old) = previous.get(doc, (0, None))
+	version += 1
+	response = {"doc": doc, "version": version, "stdout": out, "stderr": err}
+	# Batches have one result per set, those are always sent in full
+	if old != None and request.get("base") == version - 1 and isinstance(result[0], int) and isinstance(old[0], int):
+		diff = result_diff(old, result)
+		encoded = json.dumps(diff)
+		if len(encoded) < len(output):
+			response["base"] = version - 1
+			response["diff"] = diff
+	if not "diff" in response:
+		response["full"] = result
+	previous[doc] = (version, result)
+	return response
+
+
+def complete_prefix(prefix, code, suffix, known=0):
+	# The longest code[:cut] that makes prefix + code[:cut] + suffix
+	# parse, cut being 0 or right after a newline of code, and the
+	# module it parses to, None if no cut does. known is a cut already
+	# known to parse with the same prefix and suffix, only the lines of
+	# code after it are tried.
+	cuts = [known] + [i + 1 for (i, c) in enumerate(code) if c == "\n" and i + 1 > known]
+	for cut in reversed(cuts):
+		try:
+			return (cut, ast.parse(prefix + code[:cut] + suffix))
+		except SyntaxError:
+			pass
+	return (0, None)
+
+
+def speculate(file, conn, line):
+	# A runner forked by serve_speculation. It runs file, leaving a
+	# checkpoint at line, and sends serve what it printed and its
+	# output. Runners resumed from its checkpoints end here too.
+	speculation = Speculation(conn, line)
+	devnull = os.open(os.devnull, os.O_RDWR)
+	os.dup2(devnull, 0)
+	os.dup2(devnull, 1)
+	(sys.stdout, sys.stderr) = (io.StringIO(), io.StringIO())
+	try:
+		try:
+			main(file, None, speculation)
+		except BaseException as e:
+			sys.stderr.write("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+		with open(file + ".out") as f:
+			output = f.read()
+		fds = [speculation.checkpoint.fileno()] if speculation.checkpoint != None else []
+		send_message(speculation.conn, {"stdout": sys.stdout.getvalue(), "stderr": sys.stderr.getvalue(), "output": output}, fds)
+	finally:
+		os._exit(0)
+
+
+def serve_speculation(request, previous, speculations):
+	# {"doc": id, "file": path, "prefix": text, "code": text, "suffix":
+	# text}, code being what there is so far of a completion that's
+	# still streaming in. Runs prefix + code + suffix with code cut
+	# after its last line that makes it parse (see complete_prefix),
+	# answered like any other run, along with the "cut" and the line the
+	# run "resumed" from (0 for the top). If there's nothing new to run,
+	# only the "cut" and the doc's current version come back.
+	#
+	# Runs leave a checkpoint before the statement code ends in, the one
+	# that may still grow, and later versions of the program resume
+	# from the deepest checkpoint with the same text before it, see
+	# Speculation. So only the statements from the first one that
+	# changed on are run again.
+	import socket
+	doc = request.get("doc")
+	file = request["file"]
+	(prefix, code, suffix) = (request["prefix"], request["code"], request["suffix"])
+	state = speculations.get(doc)
+	known = 0
+	if state != None and (state["file"], state["prefix"], state["suffix"]) == (file, prefix, suffix) and code.startswith(state["code"]):
+		known = state["cut"]
+	(cut, tree) = complete_prefix(prefix, code, suffix, known)
+	program = prefix + code[:cut] + suffix if tree != None else None
+	checkpoints = state["checkpoints"] if state != None else []
+	if state != None and state["file"] != file:
+		# A checkpoint's runs write next to the file it started with
+		for (_, _, conn) in checkpoints:
+			conn.close()
+		checkpoints = []
+	speculations[doc] = {"file": file, "prefix": prefix, "suffix": suffix, "code": code, "cut": cut, "program": program, "checkpoints": checkpoints}
+	if program == None or (state != None and state["program"] == program):
+		(version, _) = previous.get(doc, (0, None))
+		return {"doc": doc, "version": version, "cut": cut}
+
+	starts = [first_line(s) for s in tree.body]
+	text = prefix + code[:cut]
+	end = text.count("\n") + (0 if text.endswith("\n") else 1)
+	target = max((l for l in starts if l <= end), default=None)
+
+	# (line, text before line, socket) per checkpoint, by line. They
+	# can only be resumed if the text before them is still the same.
+	valid = []
+	for (line, head, conn) in checkpoints:
+		if program.startswith(head) and line in starts:
+			valid.append((line, head, conn))
+		else:
+			conn.close()
+	valid.sort(key=lambda c: c[0])
+	speculations[doc]["checkpoints"] = valid
+
+	with open(file, "w") as f:
+		f.write(program)
+	result = None
+	resumed = 0
+	while result == None and len(valid) > 0:
+		(line, _, conn) = valid[-1]
+		checkpoint = target if target != None and target > line else None
+		try:
+			send_message(conn, {"program": program, "checkpoint": checkpoint})
+			(result, fds) = receive_message(conn)
+		except OSError:
+			result = None
+		if result == None:
+			# The checkpoint is gone
+			conn.close()
+			valid.pop()
+		else:
+			resumed = line
+	if result == None:
+		checkpoint = target
+		(conn, theirs) = socket.socketpair()
+		sys.__stdout__.flush()
+		sys.__stderr__.flush()
+		pid = os.fork()
+		if pid == 0:
+			conn.close()
+			for other in speculations.values():
+				for (_, _, c) in other["checkpoints"]:
+					c.close()
+			speculate(file, theirs, checkpoint)
+		theirs.close()
+		(result, fds) = receive_message(conn)
+		os.waitpid(pid, 0)
+		conn.close()
+		if result == None:
+			raise RuntimeError("Speculative run of %s failed" % file)
+
+	if len(fds) > 0:
+		lines = program.splitlines(True)
+		valid.append((checkpoint, "".join(lines[:checkpoint - 1]), socket.socket(fileno=fds[0])))
+		if len(valid) > SPECULATION_CHECKPOINTS:
+			# The first is the one most versions can resume from
+			valid.pop(1)[2].close()
+
+	response = serve_response(request, result["output"], result["stdout"], result["stderr"], previous)
+	response["cut"] = cut
+	response["resumed"] = resumed
+	return response
+
+
+def serve(inp=sys.stdin, out=sys.stdout):
+	# One request per line, {"doc": id, "file": path, "values": path,
+	# "cwd": path, "base": version}, all but "file" optional, runs
+	# `run.py file values` in cwd. Each gets one JSON line back with the
+	# program's stdout and stderr and the result, either in full or, if
+	# the client has the previous result of the same doc (its version is
+	# "base") and it's smaller, as a result_diff from it, or an "error"
+	# if the run ended without a result (the program exited, say).
+	# Libraries the programs import stay loaded between runs.
+	# {"check": [program, ...], "cwd": path, "timeout": seconds} gets
+	# {"checks": check_programs(...)} back instead. Requests with a
+	# "code" are speculative runs, see serve_speculation.
+	# doc: (version, result) of its last run
+	previous = {}
+	# doc: state of its speculative runs
+	speculations = {}
+	for line in inp:
+		if line.strip() == "":
+			continue
+		try:
+			response = serve_request(json.loads(line), previous, speculations)
+		except Exception as e:
+			response = {"error": str(e)}
+		out.write(json.dumps(response) + "\n")
+		out.flush()
+
+
 if __name__ == '__main__':
 	# The following adds the current working directory to the path
 	# so that imports look at the current working directory.
 	# (by default they look at the directory of the script)
 	sys.path.append(os.getcwd())
-	if len(sys.argv) > 2:
+	if sys.argv[1] == "--serve":
+		serve()
+	elif sys.argv[1] == "--check":
+		check(sys.argv[2])
+	elif len(sys.argv) > 2:
 		main(sys.argv[1], sys.argv[2])
 	else:
 		main(sys.argv[1])
@@ -1,61 +1,109 @@
 #!/usr/bin/env python3
+import ast
+import json
 import sys
+from typing import List, Optional
 
-def validate(expr) -> str:
+# Inputs longer than this are rejected before we try to parse them,
+# so a stray paste can't stall the editor.
+MAX_EXPR_LEN: int = 10000
+
+ELEMENT_TYPES = (int, str, bool)
+KEY_TYPES = (int, str)
+VALUE_TYPES = (int, str)
+
+def parse_value(expr: str):
+	if len(expr) > MAX_EXPR_LEN:
+		raise ValueError('Value is too long (more than %d characters)' % MAX_EXPR_LEN)
+	tree = ast.parse(expr.strip(), mode='eval')
+	try:
+		return ast.literal_eval(tree.body)
+	except ValueError:
+		if isinstance(tree.body, ast.Name):
+			raise NameError('name \'%s\' is not defined' % tree.body.id)
+		raise ValueError('Only literal values are supported.')
+
+def same_type(xs, typ) -> bool:
+	# `all` stops at the first element with a different type
+	return all(type(x) is typ for x in xs)
+
+def validate(expr) -> Optional[str]:
 	try:
 		if expr == 'true':
 			return 'Did you mean \'True\'?'
 		if expr == 'false':
 			return 'Did you mean \'False\'?'
-		x = eval(expr)
+		x = parse_value(expr)
 		typ = type(x)
-		if typ == str or typ == int or typ == bool:
+		if typ in ELEMENT_TYPES:
 			return
 		if typ == list:
 			if len(x) == 0:
 				return
 			elmtType = type(x[0])
-			if not (elmtType == int or elmtType == str or elmtType == bool):
+			if not elmtType in ELEMENT_TYPES:
 				return 'Only int, string and boolean lists are supported.'
-			for e in x[1:]:
-				if type(e) != elmtType:
-					return 'All elements of a list should have the same type'
+			if not same_type(x, elmtType):
+				return 'All elements of a list should have the same type'
 		elif typ == dict:
 			if len(x) == 0:
 				return
-			keyType = type(next(iter(x)))
-			valType = type(next(iter(x.values())))
-			if not (keyType == int or keyType == str):
+			(k, v) = next(iter(x.items()))
+			keyType = type(k)
+			valType = type(v)
+			if not keyType in KEY_TYPES:
 				return 'Only int and string keys are supported.'
-			if not (valType == int or valType == str):
+			if not valType in VALUE_TYPES:
 				return 'Only int and string values are supported.'
-			for k in x:
-				if type(k) != keyType:
-					return 'All keys of a dict should have the same type'
-				if type(x[k]) != valType:
-					return 'All values of a dict should have the same type'
+			if not same_type(x.keys(), keyType):
+				return 'All keys of a dict should have the same type'
+			if not same_type(x.values(), valType):
+				return 'All values of a dict should have the same type'
 		elif typ == set:
 			if len(x) == 0:
 				return
 			elmtType = type(next(iter(x)))
-			if not (elmtType == int or elmtType == str):
+			if not elmtType in KEY_TYPES:
 				return 'Only int and string sets are supported.'
-			for k in x:
-				if type(k) != elmtType:
-					return 'All elements of a set should have the same type'
+			if not same_type(x, elmtType):
+				return 'All elements of a set should have the same type'
 		else:
 			return 'Type \'%s\' not supported' % str(typ.__name__)
 	except Exception as e:
 		return str(e)
 
-def main(action, arg):
+def validate_all(exprs: List[str]) -> List[Optional[str]]:
+	return [validate(expr) for expr in exprs]
+
+def serve(inp=sys.stdin, out=sys.stdout):
+	# One request per line: either a JSON string or a JSON list of strings.
+	# Each request gets exactly one JSON line back, in the same shape.
+	for line in inp:
+		if line.strip() == '':
+			continue
+		try:
+			request = json.loads(line)
+			if isinstance(request, list):
+				response = validate_all(request)
+			else:
+				response = validate(request)
+		except Exception as e:
+			response = str(e)
+		out.write(json.dumps(response) + '\n')
+		out.flush()
+
+def main(action, args):
 	# We do many things!
 	if action == 'validate':
-		msg = validate(arg)
+		msg = validate(args[0])
 		if msg:
 			print(msg)
+	elif action == 'validate-all':
+		print(json.dumps(validate_all(args)))
+	elif action == 'serve':
+		serve()
 	else:
 		print('Action not recognized: %s' % action)
 
 if __name__ == '__main__':
-	main(sys.argv[1], sys.argv[2])
+	main(sys.argv[1], sys.argv[2:])
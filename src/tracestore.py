@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import Dict, List, Optional
+
+# A trace store holds the run_time_data of a run (see run.py) in one
+# file that can be read a few lines or a time window at a time:
+#
+#   MAGIC
+#   records        one JSON env per record, each written once even if
+#                  it shows up on several lines
+#   line index     ENTRY per env, grouped by line, in the order of the
+#                  envs in run_time_data
+#   time index     ENTRY per env with a time, sorted by time
+#   footer         JSON: {"lines": {key: [offset, count]}, "times": [offset, count]}
+#   footer offset  8 bytes
+#
+# An ENTRY is (time, record offset, record length). Loop start and end
+# markers have no time, their ENTRY time is -1.
+
+MAGIC = b"RTVTRC01"
+ENTRY = struct.Struct("<qQI")
+OFFSET = struct.Struct("<Q")
+
+TIME = '_projection_boxes_time'
+
+
+def write(path: str, data: Dict[object, List[dict]]):
+	directory = os.path.dirname(os.path.abspath(path))
+	with tempfile.NamedTemporaryFile("wb", dir=directory, delete=False, suffix=".tmp") as f:
+		f.write(MAGIC)
+		pos = len(MAGIC)
+		# Records, by id of the env dict
+		records = {}
+		for envs in data.values():
+			for env in envs:
+				if not id(env) in records:
+					record = json.dumps(env).encode()
+					records[id(env)] = (env.get(TIME, -1), pos, len(record))
+					f.write(record)
+					pos += len(record)
+
+		lines = {}
+		for (lineno, envs) in data.items():
+			lines[str(lineno)] = [pos, len(envs)]
+			for env in envs:
+				f.write(ENTRY.pack(*records[id(env)]))
+				pos += ENTRY.size
+
+		times = sorted(set(e for e in records.values() if e[0] >= 0))
+		footer = {"lines": lines, "times": [pos, len(times)]}
+		for e in times:
+			f.write(ENTRY.pack(*e))
+			pos += ENTRY.size
+
+		f.write(json.dumps(footer).encode())
+		f.write(OFFSET.pack(pos))
+	os.replace(f.name, path)
+
+
+def line_number(key: str) -> int:
+	# Return envs are stored under "R<lineno>"
+	return int(key[1:]) if key.startswith("R") else int(key)
+
+
+class TraceStore:
+	"""
+	Read-only view of a trace store. Only the index and the records
+	that are asked for are read, through an mmap of the file.
+	"""
+
+	def __init__(self, path: str):
+		self.file = open(path, "rb")
+		self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		if self.buf[:len(MAGIC)] != MAGIC:
+			self.close()
+			raise ValueError("Not a trace store: " + path)
+		(footer_offset,) = OFFSET.unpack_from(self.buf, len(self.buf) - OFFSET.size)
+		footer = json.loads(self.buf[footer_offset:len(self.buf) - OFFSET.size])
+		self.lines: Dict[str, List[int]] = footer["lines"]
+		self.times: List[int] = footer["times"]
+
+	def close(self):
+		if not self.buf.closed:
+			self.buf.close()
+		self.file.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+		return False
+
+	def entries(self, offset: int, count: int):
+		return ENTRY.iter_unpack(self.buf[offset:offset + count * ENTRY.size])
+
+	def record(self, offset: int, length: int) -> dict:
+		return json.loads(self.buf[offset:offset + length])
+
+	def line_keys(self) -> List[str]:
+		return list(self.lines.keys())
+
+	def time_range(self) -> Optional[List[int]]:
+		(offset, count) = self.times
+		if count == 0:
+			return None
+		first = ENTRY.unpack_from(self.buf, offset)[0]
+		last = ENTRY.unpack_from(self.buf, offset + (count - 1) * ENTRY.size)[0]
+		return [first, last]
+
+	def envs_at(self, key: str, start_time: Optional[int] = None, end_time: Optional[int] = None) -> List[dict]:
+		# Loop markers have no time, so they are always part of a line's
+		# envs, whatever the time window. The editor needs them to lay
+		# out the loop iterations.
+		if not key in self.lines:
+			return []
+		envs = []
+		for (time, offset, length) in self.entries(*self.lines[key]):
+			if time >= 0:
+				if start_time != None and time < start_time:
+					continue
+				if end_time != None and time > end_time:
+					continue
+			envs.append(self.record(offset, length))
+		return envs
+
+	def query(self, first_line: Optional[int] = None, last_line: Optional[int] = None,
+			start_time: Optional[int] = None, end_time: Optional[int] = None) -> Dict[str, List[dict]]:
+		# The envs of lines first_line..last_line (inclusive), in the
+		# same shape as run_time_data
+		data = {}
+		for key in self.lines:
+			lineno = line_number(key)
+			if first_line != None and lineno < first_line:
+				continue
+			if last_line != None and lineno > last_line:
+				continue
+			data[key] = self.envs_at(key, start_time, end_time)
+		return data
+
+	def env_at_time(self, time: int) -> Optional[dict]:
+		(offset, count) = self.times
+		(lo, hi) = (0, count)
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if ENTRY.unpack_from(self.buf, offset + mid * ENTRY.size)[0] < time:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo == count:
+			return None
+		(t, record_offset, length) = ENTRY.unpack_from(self.buf, offset + lo * ENTRY.size)
+		return self.record(record_offset, length) if t == time else None
+
+
+def handle(store: TraceStore, request: dict):
+	if "time" in request:
+		return store.env_at_time(request["time"])
+	if request.get("range"):
+		return store.time_range()
+	(first_line, last_line) = request.get("lines", [None, None])
+	(start_time, end_time) = request.get("times", [None, None])
+	return store.query(first_line, last_line, start_time, end_time)
+
+
+def serve(path: str, inp=sys.stdin, out=sys.stdout):
+	# One JSON request per line, each answered by one JSON line:
+	#   {"lines": [first, last], "times": [start, end]}   envs by line, either part optional
+	#   {"time": t}                                       the env recorded at time t
+	#   {"range": true}                                   [first time, last time]
+	with TraceStore(path) as store:
+		for line in inp:
+			if line.strip() == "":
+				continue
+			try:
+				response = handle(store, json.loads(line))
+			except Exception as e:
+				response = {"error": str(e)}
+			out.write(json.dumps(response) + "\n")
+			out.flush()
+
+
+def main(action, args):
+	if action == "query":
+		bounds = [int(a) for a in args[1:]] + [None] * 4
+		with TraceStore(args[0]) as store:
+			print(json.dumps(store.query(*bounds[:4])))
+	elif action == "serve":
+		serve(args[0])
+	else:
+		print("Action not recognized: %s" % action)
+
+
+if __name__ == "__main__":
+	main(sys.argv[1], sys.argv[2:])
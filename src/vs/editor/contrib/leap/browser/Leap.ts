@@ -16,7 +16,8 @@ import { editorBackground, editorErrorBackground, editorErrorForeground, editorF
 import { ProgressBar } from 'vs/base/browser/ui/progressbar/progressbar';
 import { LeapConfig, ILeapUtils, StudyGroup, PythonCode, ErrorMessage, Completion, LeapState, ILeapLogger } from 'vs/editor/contrib/leap/browser/LeapInterfaces';
 import { getUtils } from 'vs/editor/contrib/leap/browser/LeapUtils';
-import { IRTVController, ViewMode } from '../../rtv/browser/RTVInterfaces';
+import { CheckResult, IRTVController, ViewMode } from '../../rtv/browser/RTVInterfaces';
+import { getUtils as getRTVUtils } from 'vs/editor/contrib/rtv/browser/RTVUtils';
 import { RTVController } from '../../rtv/browser/RTVDisplay';
 import { ITextModel } from 'vs/editor/common/model';
 
@@ -260,6 +261,8 @@ class Leap implements IEditorContribution {
 			this._lastCursorPos = pos;
 		}
 
+		// The program around the completions, if they're to be ranked
+		let context: [string, string] | undefined;
 		if (!this._lastCompletions) {
 			// First, get the text from the editor
 			const model = this._editor.getModel();
@@ -284,6 +287,7 @@ class Leap implements IEditorContribution {
 
 			// then, get the completions
 			this._lastCompletions = await this.getCompletions(prefix, suffix, signal);
+			context = [prefix, suffix];
 		}
 
 		if (signal.aborted) {
@@ -298,6 +302,12 @@ class Leap implements IEditorContribution {
 
 		// Finally, update the state.
 		this.state = LeapState.Shown;
+
+		// Checking the completions can take up to RUNPY_CHECK_TIMEOUT,
+		// so they're shown in the model's order until it's done
+		if (context) {
+			this.showRanked(context[0], context[1], signal);
+		}
 	}
 
 	public hideCompletions(commentOnly: boolean = true): void {
@@ -346,13 +356,15 @@ class Leap implements IEditorContribution {
 
 			// Remove empty or repeated completions.
 			const set = new Set();
+			const completions: PythonCode[] = [];
 			for (const code of codes) {
 				if (code === '' || set.has(code)) {
 					continue;
 				}
 				set.add(code);
-				rs.push(new PythonCode(code));
+				completions.push(new PythonCode(code));
 			}
+			rs.push(...completions);
 
 			if (set.size === 0) {
 				rs.push(new ErrorMessage('All suggestions were empty. Please try again.'));
@@ -525,6 +537,80 @@ class Leap implements IEditorContribution {
 		return block;
 	}
 
+	/**
+	 * Orders the completions by how far the program gets with each one
+	 * in place, run untraced (see check_programs in run.py): the ones
+	 * that run without an exception or a failed assert first, then the
+	 * ones with the fewest failed asserts, then the ones that passed the
+	 * most. Equal ones keep the order the model gave them in.
+	 */
+	private async rankCompletions(prefix: string, suffix: string, completions: PythonCode[]): Promise<PythonCode[]> {
+		const utils = getRTVUtils();
+		if (!utils.checkPrograms || completions.length < 2) {
+			return completions;
+		}
+
+		let checks: CheckResult[];
+		try {
+			checks = await utils.checkPrograms(
+				completions.map(c => prefix + this.completionText(c.code) + suffix),
+				this.getCWD());
+		} catch (error) {
+			console.error('Could not check the completions:\n', error);
+			return completions;
+		}
+
+		const passed = (check: CheckResult) => Object.values(check.asserts).reduce((n, [p]) => n + p, 0);
+		const failed = (check: CheckResult) => Object.values(check.asserts).reduce((n, [, f]) => n + f, 0);
+		const crashed = (check: CheckResult) => check.exception !== null || check.timeout ? 1 : 0;
+		const order = completions.map((_, i) => i);
+		order.sort((a, b) =>
+			crashed(checks[a]) - crashed(checks[b]) ||
+			failed(checks[a]) - failed(checks[b]) ||
+			passed(checks[b]) - passed(checks[a]));
+		return order.map(i => completions[i]);
+	}
+
+	/**
+	 * Redraws the panel with the completions shown in it ranked, see
+	 * rankCompletions, unless they've been replaced or hidden since.
+	 */
+	private async showRanked(prefix: string, suffix: string, signal: AbortSignal): Promise<void> {
+		const shown = this._lastCompletions;
+		if (!shown) {
+			return;
+		}
+		const completions = shown.filter((c): c is PythonCode => c instanceof PythonCode);
+		const ranked = await this.rankCompletions(prefix, suffix, completions);
+		if (signal.aborted || this._lastCompletions !== shown || this.state !== LeapState.Shown ||
+			ranked.every((c, i) => c === completions[i])) {
+			return;
+		}
+
+		this._lastCompletions = [...ranked, ...shown.filter(c => !(c instanceof PythonCode))];
+		const panel = this.createPanel();
+		panel.appendChild(this.renderPanelContent(this._lastCompletions));
+	}
+
+	private getCWD(): string | undefined {
+		const uri = this._editor.getModel()?.uri;
+		if (!uri || uri.scheme !== 'file') {
+			return undefined;
+		}
+		const p = uri.fsPath;
+		return p.substring(0, Math.max(p.lastIndexOf('/'), p.lastIndexOf('\\')));
+	}
+
+	/**
+	 * The text previewCompletion puts in place of the cursor.
+	 */
+	private completionText(code: string): string {
+		// TODO (kas) for now, we're assuming that we are indenting with spaces.
+		return Leap.completionComment + '\n' +
+			' '.repeat(this._lastCursorPos!.column - 1) + code + '\n' +
+			' '.repeat(this._lastCursorPos!.column - 1) + Leap.completionComment;
+	}
+
 	// (lisa) why is it async?
 	private async previewCompletion(index: number): Promise<void> {
 		// TODO (kas) error handling.
@@ -542,11 +628,7 @@ class Leap implements IEditorContribution {
 
 		this._logger.preview(index, completion.code);
 
-		// TODO (kas) for now, we're assuming that we are indenting with spaces.
-		const code =
-			Leap.completionComment + '\n' +
-			' '.repeat(this._lastCursorPos!.column - 1) + completion.code + '\n' +
-			' '.repeat(this._lastCursorPos!.column - 1) + Leap.completionComment;
+		const code = this.completionText(completion.code);
 
 		// Get the model for the buffer content
 		const model = this._editor.getModel();
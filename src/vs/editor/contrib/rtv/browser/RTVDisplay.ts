@@ -36,8 +36,8 @@ import {
 	widgetShadow
 } from 'vs/platform/theme/common/colorRegistry';
 import { IIdentifiedSingleEditOperation, IModelDecorationOptions, ITextModel } from 'vs/editor/common/model';
-import { DelayedRunAtMostOne, RunProcess, RunResult, IRTVController, IRTVLogger, ViewMode, RowColMode, IRTVDisplayBox, BoxUpdateEvent, Utils, StudyGroup } from 'vs/editor/contrib/rtv/browser/RTVInterfaces';
-import { getUtils, isHtmlEscape, removeHtmlEscape, TableElement } from 'vs/editor/contrib/rtv/browser/RTVUtils';
+import { DelayedRunAtMostOne, RunProcess, RunResult, IRTVController, IRTVLogger, ViewMode, RowColMode, IRTVDisplayBox, BoxUpdateEvent, Utils, StudyGroup, RunOptions } from 'vs/editor/contrib/rtv/browser/RTVInterfaces';
+import { capturedOutput, getUtils, isHtmlEscape, parseRunResult, removeHtmlEscape, TableElement } from 'vs/editor/contrib/rtv/browser/RTVUtils';
 import { Button } from 'vs/base/browser/ui/button/button';
 import { attachButtonStyler } from 'vs/platform/theme/common/styler';
 // import { RTVSynth } from './RTVSynth';
@@ -57,6 +57,7 @@ const WORD_WRAP_COLUMN = 60;
 // otherwise Projection Boxes won't work
 const TIME = '_projection_boxes_time';
 const LINE_NO = '_projection_boxes_lineno';
+const MEMORY_USAGE = '_projection_boxes_memory';
 
 function setInner(elem: HTMLElement, inner: string): void {
 	if (htmlPolicy) {
@@ -1211,6 +1212,7 @@ export class RTVDisplayBox implements IRTVDisplayBox {
 					key !== 'next_lineno' &&
 					key !== LINE_NO &&
 					key !== TIME &&
+					key !== MEMORY_USAGE &&
 					key !== '$' &&
 					key !== '#') {
 					this._allVars.add(key);
@@ -2035,6 +2037,20 @@ export class RTVController implements IRTVController {
 		this._config.updateValue(supportSynthesisKey, v);
 	}
 
+	get runBlobs(): boolean {
+		return this._config.getValue(runBlobsKey);
+	}
+	set runBlobs(v: boolean) {
+		this._config.updateValue(runBlobsKey, v);
+	}
+
+	get runCaptureOutput(): boolean {
+		return this._config.getValue(runCaptureOutputKey);
+	}
+	set runCaptureOutput(v: boolean) {
+		this._config.updateValue(runCaptureOutputKey, v);
+	}
+
 	// End of configurable properties
 
 	get maxPixelCol() {
@@ -2902,6 +2918,10 @@ export class RTVController implements IRTVController {
 		}
 	}
 
+	public getRunOptions(): RunOptions {
+		return { blobs: this.runBlobs, captureOutput: this.runCaptureOutput };
+	}
+
 	public getProgram(): string {
 		const lines = this.getModelForce().getLinesContent();
 		this.removeSeeds(lines);
@@ -2923,7 +2943,7 @@ export class RTVController implements IRTVController {
 		}
 
 		this.logger.projectionBoxUpdateStart(program);
-		this.pythonProcess = this.utils.runProgram(program, this.getCWD());
+		this.pythonProcess = this.utils.runProgram(program, this.getCWD(), undefined, this.getRunOptions());
 
 		const runResults: RunResult = await this.pythonProcess;
 		const outputMsg = runResults.stdout;
@@ -2946,7 +2966,9 @@ export class RTVController implements IRTVController {
 
 		this.pythonProcess = undefined;
 
-		return [outputMsg, errorMsg, JSON.parse(result!)];
+		const rs = parseRunResult(result!);
+		const [out, err] = capturedOutput(rs, outputMsg, errorMsg);
+		return [out, err, rs];
 	}
 
 	public async updateBoxes(e?: IModelContentChangedEvent, outputVars?: string[], prevEnvs?: Map<number, any>): Promise<any> {
@@ -3686,6 +3708,8 @@ const viewModeKey = 'rtv.viewMode';
 const mouseShortcutsKey = 'rtv.box.mouseShortcuts';
 const supportSynthesisKey = 'rtv.box.supportSynthesis';
 const boxUpdateDelayKey = 'rtv.box.updateDelay';
+const runBlobsKey = 'rtv.run.blobs';
+const runCaptureOutputKey = 'rtv.run.captureOutput';
 
 const configurations: IConfigurationNode = {
 	'id': 'rtv',
@@ -3784,6 +3808,16 @@ const configurations: IConfigurationNode = {
 			type: 'number',
 			default: 250,
 			description: localize('rtv.boxupdatedelay', 'Controls the delay (in ms) between a change in the code and the projection boxes updating.')
+		},
+		[runBlobsKey]: {
+			type: 'boolean',
+			default: true,
+			description: localize('rtv.runblobs', 'Controls whether images and plots are saved to files next to the program (RUNPY_BLOBS) instead of sent with every run')
+		},
+		[runCaptureOutputKey]: {
+			type: 'boolean',
+			default: true,
+			description: localize('rtv.runcaptureoutput', 'Controls whether what the program prints is captured along with the line that printed it (RUNPY_CAPTURE_OUTPUT)')
 		}
 	}
 };
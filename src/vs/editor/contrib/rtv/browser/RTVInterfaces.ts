@@ -66,6 +66,7 @@ export interface IRTVController extends IEditorContribution {
 	getBox(lineno: number): IRTVDisplayBox;
 	getLineContent(lineno: number): string;
 	getProgram(): string;
+	getRunOptions(): RunOptions;
 	getModelForce(): ITextModel;
 	envs: { [k: string]: any[]; };
 	pythonProcess?: RunProcess;
@@ -244,12 +245,47 @@ export interface Utils {
 	readonly EOL: string;
 	readonly pathSep: string;
 	logger(editor: ICodeEditor): IRTVLogger;
-	runProgram(program: string, cwd?: string, values?: any): RunProcess;
+	// With a list of value sets as `values`, run.py runs the program once
+	// up to the first override and forks per set (see Batch in run.py).
+	// Its output is then a list with one result per set.
+	runProgram(program: string, cwd?: string, values?: any, options?: RunOptions): RunProcess;
 	runImgSummary(program: string, line: number, varname: string): RunProcess;
+	// Runs every program untraced and reports how far each got, see
+	// check_programs in run.py. Only where run.py can fork.
+	checkPrograms?(programs: string[], cwd?: string): Promise<CheckResult[]>;
 	validate(input: string): Promise<string | undefined>;
+	// The errors validate would give for each input, with one request.
+	validateAll(inputs: string[]): Promise<(string | undefined)[]>;
 	synthesizer(): SynthProcess;
 }
 
+/**
+ * What `run.py --check` reports for one program, see
+ * check_program in run.py. `asserts` maps the line of each
+ * assert that ran to how many times it [passed, failed].
+ */
+export interface CheckResult {
+	ok: boolean;
+	exception: { type: string; message: string; lineno: number | null } | null;
+	asserts: { [lineno: string]: [number, number] };
+	seconds: number;
+	timeout: boolean;
+}
+
+/**
+ * The run.py modes that are off unless asked for, set from the
+ * rtv.run.* settings.
+ */
+export interface RunOptions {
+	// RUNPY_BLOBS: images and plots go to files next to the program
+	blobs: boolean;
+	// RUNPY_CAPTURE_OUTPUT: what the program prints is in the result
+	captureOutput: boolean;
+	// RUNPY_SUMMARIZE=0: big values are in full, so they can be edited
+	// and sent back as values (synthesis asks for it, it's no setting)
+	fullValues?: boolean;
+}
+
 /**
  * This class is used to return the result of running
  * a run.py or img-summary.py file.
@@ -1,7 +1,7 @@
 import { Range as RangeClass } from 'vs/editor/common/core/range';
 import { Selection } from 'vs/editor/common/core/selection';
 import { ICodeEditor } from 'vs/editor/browser/editorBrowser';
-import { getUtils, TableElement } from 'vs/editor/contrib/rtv/browser/RTVUtils';
+import { capturedOutput, getUtils, parseRunResult, TableElement } from 'vs/editor/contrib/rtv/browser/RTVUtils';
 import { Utils, RunResult, SynthResult, SynthProblem, IRTVLogger, IRTVController, ViewMode, SynthProcess } from './RTVInterfaces';
 import { IThemeService } from 'vs/platform/theme/common/themeService';
 import { RTVDisplayBox } from 'vs/editor/contrib/rtv/browser/RTVDisplay';
@@ -496,18 +496,27 @@ export class RTVSynthController {
 		const on = this._synthModel!.toggleOn(idx, force);
 
 		if (on) {
-			let error = await this.utils.validate(cell.textContent!);
-			if (error) {
-				this._synthView!.addError(error, cell, 500);
+			// The whole row becomes an example, so the other cells edited
+			// in it are checked too, all with one request
+			const cells: [string, HTMLElement][] = [
+				[varname, cell],
+				...this._synthModel!.changedCells(idx).filter(([, c]) => c !== cell)
+			];
+			const errors = await this.utils.validateAll(cells.map(([, c]) => c.textContent!));
+			const invalid = errors.findIndex(e => e);
+			if (invalid !== -1) {
+				this._synthView!.addError(errors[invalid]!, cells[invalid][1], 500);
 				return false;
 			}
 
-			this._synthModel!.updateBoxState(idx, varname, cell.innerText.trim());
+			for (const [v, c] of cells) {
+				this._synthModel!.updateBoxState(idx, v, c.innerText.trim());
+			}
 			this._synthModel!.updateIncludedTimes(idx, true);
 
 			// if error, then controller / service won't know the most recent `_includedTimes`;
 			// however, the newest info will be delivered again when another request is made
-			error = await this.updateBoxContent(updateSynthBox);
+			const error = await this.updateBoxContent(updateSynthBox);
 			if (error) {
 				this._synthView!.addError(error, cell);
 				return false;
@@ -609,10 +618,13 @@ export class RTVSynthController {
 	private async runProgram(): Promise<[string, string, any?]> {
 		const values = this._synthModel!.getValues();
 
+		// The cells' values go back to run.py and the synthesizer as
+		// literals, a summary of a big list wouldn't evaluate
 		const runResults: RunResult = await this.utils.runProgram(
 			this.RTVController.getProgram(),
 			undefined,
-			values);
+			values,
+			{ ...this.RTVController.getRunOptions(), fullValues: true });
 
 		const outputMsg = runResults.stdout;
 		const errorMsg = runResults.stderr;
@@ -623,7 +635,9 @@ export class RTVSynthController {
 			return [outputMsg, errorMsg, undefined];
 		}
 
-		return [outputMsg, errorMsg, JSON.parse(result)];
+		const rs = parseRunResult(result);
+		const [out, err] = capturedOutput(rs, outputMsg, errorMsg);
+		return [out, err, rs];
 	}
 
 
@@ -389,6 +389,18 @@ export class RTVSynthModel {
 		return env[varname] !== content;
 	}
 
+	// the cells of row idx whose content differs from its env value, by variable
+	public changedCells(idx: number): [string, HTMLTableCellElement][] {
+		const cells: [string, HTMLTableCellElement][] = [];
+		for (const varname of this._outputVars) {
+			const cell = this._cellElements?.get(varname)?.[idx];
+			if (cell && cell.contentEditable === 'true' && this.cellContentChanged(idx, varname, cell.textContent!)) {
+				cells.push([varname, cell]);
+			}
+		}
+		return cells;
+	}
+
 	// record cursor position and the current row (also stored in CursorPos)
 	public updateCursorPos(range: Range, node: HTMLElement) {
 		const row = node.id!.split('-')[2];
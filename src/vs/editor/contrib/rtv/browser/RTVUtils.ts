@@ -3,7 +3,7 @@ import * as fs from 'fs';
 import * as os from 'os';
 import { spawn, ChildProcessWithoutNullStreams } from 'child_process';
 // import { kill } from 'process';
-import { Utils, RunResult, IRTVLogger, SynthProblem, SynthResult, SynthProcess, RunProcess } from 'vs/editor/contrib/rtv/browser/RTVInterfaces';
+import { Utils, RunResult, IRTVLogger, SynthProblem, SynthResult, SynthProcess, RunProcess, CheckResult, RunOptions } from 'vs/editor/contrib/rtv/browser/RTVInterfaces';
 import { RTVLogger } from 'vs/editor/contrib/rtv/browser/RTVLogger';
 import { ICodeEditor } from 'vs/editor/browser/editorBrowser';
 // import { runAtThisOrScheduleAtNextAnimationFrame } from 'vs/base/browser/dom';
@@ -31,6 +31,74 @@ export function removeHtmlEscape(s: string): string {
 	return s.substring(x, s.length - y);
 }
 
+// With RUNPY_SELECTIVE=1, run.py leaves out values that are the same as
+// in the env at time env['^']: their value is null. Fill them back in.
+export function parseRunResult(result: string): any {
+	const rs = JSON.parse(result);
+	const data = rs[2];
+	if (!data || !result.includes('"^"')) {
+		return rs;
+	}
+
+	// The same env can be on several lines, as separate objects. Fill in
+	// one of them per time, oldest first, so the env each one refers to
+	// is already complete.
+	const envsByTime = new Map<number, any>();
+	for (const lineno in data) {
+		for (const env of data[lineno]) {
+			const time = env['_projection_boxes_time'];
+			if (time !== undefined && !envsByTime.has(time)) {
+				envsByTime.set(time, env);
+			}
+		}
+	}
+	const times = Array.from(envsByTime.keys()).sort((a, b) => a - b);
+	for (const time of times) {
+		fillCarriedValues(envsByTime.get(time), envsByTime);
+	}
+	for (const lineno in data) {
+		for (const env of data[lineno]) {
+			fillCarriedValues(env, envsByTime);
+		}
+	}
+	return rs;
+}
+
+function fillCarriedValues(env: any, envsByTime: Map<number, any>) {
+	if (env['^'] === undefined) {
+		return;
+	}
+	const base = envsByTime.get(env['^']);
+	for (const key in env) {
+		if (env[key] === null) {
+			env[key] = base[key];
+		}
+	}
+	delete env['^'];
+}
+
+// With RUNPY_CAPTURE_OUTPUT=1, what the program printed is in the result
+// (see OutputCapture in core.py) instead of in stdout and stderr.
+export function capturedOutput(rs: any, stdout: string, stderr: string): [string, string] {
+	const output = rs[3]?.output;
+	if (!output) {
+		return [stdout, stderr];
+	}
+
+	let out = '';
+	let err = '';
+	for (const chunk of output) {
+		if (chunk.elided !== undefined) {
+			out += `[${chunk.elided} bytes of earlier output not shown]\n`;
+		} else if (chunk.stream === 'stderr') {
+			err += chunk.text;
+		} else {
+			out += chunk.text;
+		}
+	}
+	return [out + stdout, err + stderr];
+}
+
 export class TableElement {
 	constructor(
 		public content: string,
@@ -53,6 +121,36 @@ const JAVA = ''; //getOSEnvVariable('JAVA');
 const HEAP = process.env['HEAP'];
 const SNIPPY_UTILS = ''; // getOSEnvVariable('SNIPPY_UTILS');
 
+// run.py writes images to <file>.blobs/ and refers to them by name
+const BLOB_REF = /runpy-blob:([0-9a-f]+\.png)/g;
+const MAX_BLOB_URLS = 500;
+const blobURLs: Map<string, string> = new Map();
+
+function resolveBlobRefs(result: string, blobDir: string): string {
+	return result.replace(BLOB_REF, (ref: string, name: string) => {
+		let url = blobURLs.get(name);
+		if (!url) {
+			try {
+				const data = fs.readFileSync(blobDir + path.sep + name);
+				url = URL.createObjectURL(new Blob([data], { type: 'image/png' }));
+			} catch (e) {
+				console.error('Failed to read blob ' + name, e);
+				return ref;
+			}
+
+			// Blobs are content-addressed, so their URLs never go stale.
+			// We just don't want to keep all of them forever.
+			blobURLs.set(name, url);
+			if (blobURLs.size > MAX_BLOB_URLS) {
+				const [oldest, oldestURL] = blobURLs.entries().next().value;
+				URL.revokeObjectURL(oldestURL);
+				blobURLs.delete(oldest);
+			}
+		}
+		return url;
+	});
+}
+
 class LocalRunProcess implements RunProcess {
 	protected _reject?: () => void;
 	protected _promise: Promise<RunResult> = new Promise(() => { });
@@ -74,7 +172,7 @@ class LocalRunProcess implements RunProcess {
 			this._process.on('exit', (exitCode) => {
 				let result = undefined;
 				if (exitCode !== null) {
-					result = fs.readFileSync(this._file + '.out').toString();
+					result = resolveBlobRefs(fs.readFileSync(this._file + '.out').toString(), this._file + '.blobs');
 				}
 				resolve(new RunResult(this.stdout, this.stderr, exitCode, result));
 			});
@@ -221,12 +319,82 @@ class LocalSynthProcess implements SynthProcess {
 	}
 }
 
+/**
+ * A long-running `snippy.py serve` process. Each request is written
+ * as one JSON line and answered by exactly one JSON line, in order,
+ * so we don't pay for a new Python process per validated value.
+ */
+class LocalSnippyProcess {
+	private _process: ChildProcessWithoutNullStreams;
+	private _pending: [(value: any) => void, (reason: any) => void][] = [];
+	private _buffer: string = '';
+
+	constructor() {
+		this._process = spawn(SNIPPY_UTILS, ['serve']);
+
+		process.on('exit', () => this.dispose());
+
+		this._process.stdout.on('data', (data) => {
+			this._buffer += data;
+			let newline = this._buffer.indexOf('\n');
+			while (newline !== -1) {
+				const line = this._buffer.substring(0, newline);
+				this._buffer = this._buffer.substring(newline + 1);
+				const next = this._pending.shift();
+				if (next) {
+					try {
+						next[0](JSON.parse(line));
+					} catch (e) {
+						next[1](e);
+					}
+				} else {
+					console.error('Snippy output when not waiting on promise: ' + line);
+				}
+				newline = this._buffer.indexOf('\n');
+			}
+		});
+		this._process.stderr.on('data', (data) => console.error(data.toString()));
+		this._process.on('exit', () => {
+			for (const [, reject] of this._pending) {
+				reject('Snippy process exited');
+			}
+			this._pending = [];
+		});
+	}
+
+	private request(input: string | string[]): Promise<any> {
+		return new Promise((resolve, reject) => {
+			this._pending.push([resolve, reject]);
+			this._process.stdin.write(JSON.stringify(input) + '\n');
+		});
+	}
+
+	public async validate(input: string): Promise<string | undefined> {
+		const rs: string | null = await this.request(input);
+		return rs ?? undefined;
+	}
+
+	public async validateAll(inputs: string[]): Promise<(string | undefined)[]> {
+		const rs: (string | null)[] = await this.request(inputs);
+		return rs.map(r => r ?? undefined);
+	}
+
+	public dispose() {
+		this._process?.kill('SIGKILL');
+	}
+
+	public connected(): boolean {
+		return this._process && !this._process.stdin.destroyed;
+	}
+}
+
 
 class LocalUtils implements Utils {
 	readonly EOL: string = os.EOL;
 	readonly pathSep: string = path.sep;
 	_logger?: IRTVLogger;
 	_synth?: SynthProcess;
+	_snippy?: LocalSnippyProcess;
 
 	logger(editor: ICodeEditor): IRTVLogger {
 		if (!this._logger) {
@@ -235,27 +403,52 @@ class LocalUtils implements Utils {
 		return this._logger;
 	}
 
-	runProgram(program: string, cwd?: string, values?: any): RunProcess {
+	runProgram(program: string, cwd?: string, values?: any, options?: RunOptions): RunProcess {
 		const file: string = os.tmpdir() + path.sep + 'tmp.py';
 		fs.writeFileSync(file, program);
 
 		let local_process;
 
-		let options = undefined;
-		if (cwd) {
-			options = { cwd: cwd };
+		// test/rtv-bench/replay.py replays sessions with the same env,
+		// as set by the default rtv.run.* settings
+		const env: NodeJS.ProcessEnv = { ...process.env };
+		if (options?.blobs) {
+			env.RUNPY_BLOBS = '1';
 		}
+		if (options?.captureOutput) {
+			env.RUNPY_CAPTURE_OUTPUT = '1';
+		}
+		if (options?.fullValues) {
+			env.RUNPY_SUMMARIZE = '0';
+		}
+		const spawnOptions = { cwd: cwd, env: env };
 		if (values) {
 			const values_file: string = os.tmpdir() + path.sep + 'tmp_values.json';
 			fs.writeFileSync(values_file, JSON.stringify(values));
-			local_process = spawn(PY3, [RUNPY, file, values_file], options);
+			local_process = spawn(PY3, [RUNPY, file, values_file], spawnOptions);
 		} else {
-			local_process = spawn(PY3, [RUNPY, file], options);
+			local_process = spawn(PY3, [RUNPY, file], spawnOptions);
 		}
 
 		return new LocalRunProcess(file, local_process);
 	}
 
+	checkPrograms(programs: string[], cwd?: string): Promise<CheckResult[]> {
+		const file: string = os.tmpdir() + path.sep + 'tmp_check.json';
+		fs.writeFileSync(file, JSON.stringify(programs));
+
+		return new Promise((resolve, reject) => {
+			const local_process = spawn(PY3, [RUNPY, '--check', file], { cwd: cwd, stdio: 'ignore' });
+			local_process.on('exit', (exitCode) => {
+				if (exitCode === 0) {
+					resolve(JSON.parse(fs.readFileSync(file + '.out').toString()));
+				} else {
+					reject(`run.py --check exited with ${exitCode}`);
+				}
+			});
+		});
+	}
+
 	runImgSummary(program: string, line: number, varname: string): RunProcess {
 		const file: string = os.tmpdir() + path.sep + 'tmp.py';
 		fs.writeFileSync(file, program);
@@ -264,21 +457,17 @@ class LocalUtils implements Utils {
 	}
 
 	async validate(input: string): Promise<string | undefined> {
-		return new Promise((resolve, reject) => {
-			const process = spawn(SNIPPY_UTILS, ['validate', input]);
-			let output: string = '';
-			let error: string = '';
-			process.stdout.on('data', (data: string) => output += data);
-			process.stderr.on('data', (data: string) => error += data);
-
-			process.on('exit', (exitCode: number) => {
-				if (exitCode !== 0) {
-					reject(error);
-				} else {
-					resolve(output);
-				}
-			});
-		});
+		if (!this._snippy || !this._snippy.connected()) {
+			this._snippy = new LocalSnippyProcess();
+		}
+		return this._snippy.validate(input);
+	}
+
+	async validateAll(inputs: string[]): Promise<(string | undefined)[]> {
+		if (!this._snippy || !this._snippy.connected()) {
+			this._snippy = new LocalSnippyProcess();
+		}
+		return this._snippy.validateAll(inputs);
 	}
 
 	synthesizer(): SynthProcess {
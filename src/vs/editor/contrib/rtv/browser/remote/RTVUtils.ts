@@ -318,6 +318,12 @@ class RemoteUtils implements Utils {
 		return rs.stdout;
 	}
 
+	async validateAll(inputs: string[]): Promise<(string | undefined)[]> {
+		// The worker takes one value per request, but there's no process
+		// to start for each
+		return Promise.all(inputs.map(input => this.validate(input)));
+	}
+
 	synthesizer(): SynthProcess {
 		if (!this._synthProcess) {
 			this._synthProcess = new RemoteSynthProcess(this._logger);
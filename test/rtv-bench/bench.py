@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Benchmarks run.py over the programs in test/rtv, and over synthetic
+programs that scale loop counts, recursion depth and data size.
+
+Every program runs in two modes:
+  cold: a fresh `python run.py <file>` process per run, like the editor does
+  warm: one process that imports run once and calls run.main repeatedly
+
+For each program and mode we record the median wall time, trace events
+per second, the peak RSS and the size of the .out file. The result
+cache is disabled, so every run does the full work.
+
+Usage:
+  bench.py                         run the corpus, compare to baseline.json if it exists
+  bench.py --save-baseline         run the corpus and store the results as the baseline
+  bench.py --scaling --csv out.csv run the synthetic programs and write a csv to plot
+"""
+import argparse
+import glob
+import json
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', '..', 'src')
+RUNPY = os.path.join(SRC, 'run.py')
+CORPUS = os.path.join(HERE, '..', 'rtv')
+BASELINE = os.path.join(HERE, 'baseline.json')
+
+TIME = '_projection_boxes_time'
+
+
+def count_events(out_file):
+	# Logical time is bumped once per recorded event, so the largest
+	# time in the output is (close to) the number of events.
+	# Extras (see RUNPY_PROFILE and the like) may follow the data
+	with open(out_file) as f:
+		data = json.load(f)[2]
+	last = 0
+	for envs in data.values():
+		for env in envs:
+			last = max(last, env.get(TIME, 0))
+	return last
+
+
+def summarize(file, times, peak_rss_kb):
+	out_file = file + '.out'
+	wall = statistics.median(times)
+	events = count_events(out_file)
+	return {
+		'wall': wall,
+		'events': events,
+		'events_per_sec': events / wall if wall > 0 else 0,
+		'peak_rss_kb': peak_rss_kb,
+		'out_bytes': os.path.getsize(out_file),
+	}
+
+
+def bench_env():
+	env = dict(os.environ)
+	env['RUNPY_CACHE'] = '0'
+	return env
+
+
+def run_cold(file, repeat):
+	times = []
+	peak = 0
+	for _ in range(repeat):
+		start = time.perf_counter()
+		p = subprocess.Popen(
+			[sys.executable, RUNPY, file],
+			cwd=os.path.dirname(file),
+			env=bench_env(),
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL)
+		(_, _, usage) = os.wait4(p.pid, 0)
+		times.append(time.perf_counter() - start)
+		peak = max(peak, usage.ru_maxrss)
+	return summarize(file, times, peak)
+
+
+def run_warm(file, repeat):
+	# Each program gets its own worker, so peak RSS isn't shared
+	rs = subprocess.run(
+		[sys.executable, __file__, '--warm-worker', file, '--repeat', str(repeat)],
+		cwd=os.path.dirname(file),
+		env=bench_env(),
+		stdout=subprocess.PIPE,
+		stderr=subprocess.DEVNULL,
+		check=True)
+	return json.loads(rs.stdout.decode().splitlines()[-1])
+
+
+def warm_worker(file, repeat):
+	sys.path.insert(0, SRC)
+	sys.path.append(os.getcwd())
+	import run
+
+	times = []
+	devnull = open(os.devnull, 'w')
+	for _ in range(repeat):
+		(stdout, sys.stdout) = (sys.stdout, devnull)
+		start = time.perf_counter()
+		try:
+			run.main(file)
+		except BaseException:
+			pass
+		finally:
+			times.append(time.perf_counter() - start)
+			sys.stdout = stdout
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	print(json.dumps(summarize(file, times, peak)))
+
+
+def copy_corpus(tmp):
+	# run.py writes <file>.out next to the program, so work on copies
+	files = []
+	for src in sorted(glob.glob(os.path.join(CORPUS, '*', '*.py'))):
+		name = os.path.relpath(src, CORPUS)
+		dst = os.path.join(tmp, name)
+		os.makedirs(os.path.dirname(dst), exist_ok=True)
+		shutil.copy(src, dst)
+		files.append((name, dst))
+	return files
+
+
+def scaling_programs(tmp):
+	programs = []
+	for n in (10, 100, 500, 1000, 2000):
+		programs.append((f'scaling/loop_{n}.py', (
+			f"total = 0\n"
+			f"for i in range({n}):\n"
+			f"\ttotal = total + i\n")))
+	for depth in (10, 50, 100, 200, 400):
+		programs.append((f'scaling/recursion_{depth}.py', (
+			f"def down(n):\n"
+			f"\tif n == 0:\n"
+			f"\t\treturn 0\n"
+			f"\treturn 1 + down(n - 1)\n"
+			f"\n"
+			f"down({depth})\n")))
+	for size in (10, 100, 1000, 10000, 100000):
+		programs.append((f'scaling/data_{size}.py', (
+			f"data = list(range({size}))\n"
+			f"for i in range(20):\n"
+			f"\tdata[i] = data[i] * 2\n")))
+
+	files = []
+	for (name, program) in programs:
+		dst = os.path.join(tmp, name)
+		os.makedirs(os.path.dirname(dst), exist_ok=True)
+		with open(dst, 'w') as f:
+			f.write(program)
+		files.append((name, dst))
+	return files
+
+
+def compare(results, baseline, threshold):
+	regressions = []
+	for (key, rs) in results.items():
+		if not key in baseline:
+			continue
+		base = baseline[key]
+		for metric in ('wall', 'peak_rss_kb', 'out_bytes'):
+			if base[metric] > 0 and rs[metric] > base[metric] * (1 + threshold):
+				regressions.append('%s %s: %.4g -> %.4g (+%.0f%%)' % (
+					key, metric, base[metric], rs[metric],
+					100 * (rs[metric] / base[metric] - 1)))
+	return regressions
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('--repeat', type=int, default=5)
+	parser.add_argument('--mode', choices=['cold', 'warm', 'both'], default='both')
+	parser.add_argument('--scaling', action='store_true', help='run the synthetic scaling programs instead of the corpus')
+	parser.add_argument('--baseline', default=BASELINE)
+	parser.add_argument('--save-baseline', action='store_true')
+	parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative slowdown before reporting a regression')
+	parser.add_argument('--csv', help='also write the results to this csv file')
+	parser.add_argument('--warm-worker', help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.warm_worker:
+		warm_worker(args.warm_worker, args.repeat)
+		return 0
+
+	modes = ['cold', 'warm'] if args.mode == 'both' else [args.mode]
+	results = {}
+	with tempfile.TemporaryDirectory() as tmp:
+		files = scaling_programs(tmp) if args.scaling else copy_corpus(tmp)
+		print('%-55s %5s %9s %12s %10s %10s' % ('program', 'mode', 'wall (s)', 'events/s', 'rss (MB)', 'out (KB)'))
+		for (name, file) in files:
+			for mode in modes:
+				rs = run_cold(file, args.repeat) if mode == 'cold' else run_warm(file, args.repeat)
+				results['%s [%s]' % (name, mode)] = rs
+				print('%-55s %5s %9.3f %12.0f %10.1f %10.1f' % (
+					name, mode, rs['wall'], rs['events_per_sec'],
+					rs['peak_rss_kb'] / 1024, rs['out_bytes'] / 1024))
+
+	if args.csv:
+		with open(args.csv, 'w') as f:
+			f.write('program,mode,wall,events,events_per_sec,peak_rss_kb,out_bytes\n')
+			for (key, rs) in results.items():
+				(name, mode) = key[:-1].split(' [')
+				f.write('%s,%s,%f,%d,%f,%d,%d\n' % (
+					name, mode, rs['wall'], rs['events'], rs['events_per_sec'],
+					rs['peak_rss_kb'], rs['out_bytes']))
+
+	if args.save_baseline:
+		with open(args.baseline, 'w') as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+		print('Saved baseline to ' + args.baseline)
+		return 0
+
+	if os.path.exists(args.baseline):
+		with open(args.baseline) as f:
+			regressions = compare(results, json.load(f), args.threshold)
+		if regressions:
+			print('\nRegressions against ' + args.baseline + ':')
+			for r in regressions:
+				print('  ' + r)
+			return 1
+		print('\nNo regressions against ' + args.baseline)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Compares run.compute_writes against the old recovery loop (blank every
+noop above the error and re-parse the whole file) on long generated
+programs whose empty lines turn into misplaced noops.
+
+Usage: compute_writes_bench.py [number of functions ...]
+"""
+import ast
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'src'))
+
+import run
+from core import preprocess_code, magic_var_name
+
+
+def generate_program(functions):
+	# Every function has an empty line inside a list literal, which
+	# preprocessing turns into a noop that breaks the parse.
+	parts = []
+	for i in range(functions):
+		parts.append(
+			f"def f{i}(a):\n"
+			f"\tb = [a,\n"
+			f"\n"
+			f"\t     a + {i}]\n"
+			f"\n"
+			f"\tfor x in b:\n"
+			f"\t\ta = a + x\n"
+			f"\n"
+			f"\treturn a\n"
+			f"\n")
+	parts.append(f"f{functions - 1}(1)\n")
+	return "".join(parts)
+
+
+def old_compute_writes(lines):
+	parses = 0
+	while True:
+		try:
+			parses += 1
+			root = ast.parse("".join(lines))
+			break
+		except SyntaxError as e:
+			lineno = e.lineno - 1
+			while lineno >= 0:
+				if lines[lineno].find(magic_var_name) != -1:
+					lines[lineno] = "\n"
+				lineno = lineno - 1
+	write_collector = run.WriteCollector()
+	write_collector.visit(root)
+	return (write_collector.data, parses)
+
+
+def measure(f, *args):
+	start = time.perf_counter()
+	rs = f(*args)
+	return (rs, time.perf_counter() - start)
+
+
+def main(sizes):
+	print("%10s %10s %12s %12s %8s" % ("functions", "lines", "old (s)", "new (s)", "speedup"))
+	for functions in sizes:
+		(lines, exception) = preprocess_code(generate_program(functions))
+		assert exception == None
+		((old_writes, parses), old_time) = measure(old_compute_writes, list(lines))
+		((new_writes, new_exception), new_time) = measure(run.compute_writes, list(lines))
+		assert new_exception == None, new_exception
+		assert old_writes == new_writes, "writes tables differ"
+		print("%10d %10d %12.4f %12.4f %7.1fx   (old: %d full parses)" %
+			(functions, len(lines), old_time, new_time, old_time / new_time, parses))
+
+
+if __name__ == '__main__':
+	main([int(arg) for arg in sys.argv[1:]] or [10, 50, 100, 200])
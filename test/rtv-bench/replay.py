@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Replays editing sessions recorded by RTVLogger and LeapLogger (the
+snippy_log_* directories they write under LOG_DIR) against run.py.
+
+Every projectionBox.update.start event in a log saved the program the
+editor ran at that moment. We run those programs in order, the way the
+editor does: each one is written to the same tmp.py, and starting a run
+kills the one still in flight. Completion previews are replayed as part
+of this, since previewing a completion puts it in the buffer and runs
+the program with it.
+
+Pacing follows the recorded timestamps, sped up by --speed. With
+--speed 0 every run is waited for, so nothing is cancelled.
+
+For each log we report run latency percentiles, the share of runs that
+were cancelled (in the recorded session and in the replay) and the
+result cache hit rate.
+
+Usage:
+  replay.py LOG_DIR...                    replay at recorded pace
+  replay.py --speed 10 LOG_DIR...         ten times faster
+  replay.py --speed 0 --json out.json LOG_DIR...
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+RUNPY = os.path.join(HERE, '..', '..', 'src', 'run.py')
+LOG_FILE = 'snippy_plus.log'
+
+
+class LogEvent:
+	def __init__(self, id, stamp, file_name, code, msg):
+		self.id = id
+		self.stamp = stamp
+		self.file_name = file_name
+		self.code = code
+		self.msg = msg
+
+
+class Version:
+	def __init__(self, stamp, program):
+		self.stamp = stamp
+		self.program = program
+
+
+def read_events(log_dir):
+	# Lines are "id,time,file,code" or "id,time,file,code,msg", and msg
+	# can contain commas
+	events = []
+	with open(os.path.join(log_dir, LOG_FILE)) as f:
+		for line in f:
+			parts = line.rstrip('\n').split(',', 4)
+			if len(parts) < 4:
+				continue
+			msg = parts[4] if len(parts) > 4 else None
+			events.append(LogEvent(parts[0], int(parts[1]), parts[2], parts[3], msg))
+	return events
+
+
+def logged_file(log_dir, id, name, seen):
+	# The loggers never overwrite a file: the second file written for
+	# the same id is <id>_0_<name>, the third <id>_1_<name>, ...
+	n = seen.get((id, name), 0)
+	seen[(id, name)] = n + 1
+	if n == 0:
+		return os.path.join(log_dir, '%s_%s' % (id, name))
+	return os.path.join(log_dir, '%s_%d_%s' % (id, n - 1, name))
+
+
+def read_session(log_dir):
+	events = read_events(log_dir)
+	seen = {}
+	versions = []
+	session = {'versions': 0, 'recorded_cancelled': 0, 'previews': 0, 'model_requests': 0}
+	in_flight = False
+	for e in events:
+		if e.code == 'projectionBox.update.start':
+			try:
+				with open(logged_file(log_dir, e.id, 'program.py', seen)) as f:
+					versions.append(Version(e.stamp, f.read()))
+			except OSError:
+				continue
+			# The editor only logs the end of runs it didn't kill
+			if in_flight:
+				session['recorded_cancelled'] += 1
+			in_flight = True
+		elif e.code == 'projectionBox.update.end':
+			in_flight = False
+		elif e.code == 'leap.preview':
+			session['previews'] += 1
+		elif e.code == 'leap.modelRequest':
+			session['model_requests'] += 1
+	session['versions'] = len(versions)
+	return (versions, session)
+
+
+def percentile(xs, p):
+	if len(xs) == 0:
+		return 0
+	xs = sorted(xs)
+	return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))]
+
+
+def replay(versions, speed, cwd, env, work):
+	file = os.path.join(work, 'tmp.py')
+	stats = {'started': 0, 'completed': 0, 'cancelled': 0, 'errors': 0, 'latencies': []}
+	running = None
+	started = 0
+	t0 = time.perf_counter()
+	for v in versions:
+		due = None
+		if speed > 0:
+			due = t0 + (v.stamp - versions[0].stamp) / 1000 / speed
+		if running != None:
+			try:
+				timeout = None if due == None else max(0, due - time.perf_counter())
+				rc = running.wait(timeout=timeout)
+				stats['latencies'].append(time.perf_counter() - started)
+				stats['completed'] += 1
+				if rc != 0:
+					stats['errors'] += 1
+			except subprocess.TimeoutExpired:
+				running.terminate()
+				running.wait()
+				stats['cancelled'] += 1
+			running = None
+		if due != None:
+			time.sleep(max(0, due - time.perf_counter()))
+
+		with open(file, 'w') as f:
+			f.write(v.program)
+		started = time.perf_counter()
+		running = subprocess.Popen(
+			[sys.executable, RUNPY, file],
+			cwd=cwd or work,
+			env=env,
+			stdout=subprocess.DEVNULL,
+			stderr=subprocess.DEVNULL)
+		stats['started'] += 1
+
+	if running != None:
+		rc = running.wait()
+		stats['latencies'].append(time.perf_counter() - started)
+		stats['completed'] += 1
+		if rc != 0:
+			stats['errors'] += 1
+	return stats
+
+
+def replay_env(cache_dir, cache_log):
+	env = dict(os.environ)
+	# Same as RTVUtils.runProgram with the default rtv.run.* settings,
+	# keep the two in sync
+	env['RUNPY_BLOBS'] = '1'
+	env['RUNPY_CAPTURE_OUTPUT'] = '1'
+	# The editor doesn't turn the result cache on, set RUNPY_CACHE=1
+	# to measure it
+	env['RUNPY_CACHE_DIR'] = cache_dir
+	env['RUNPY_CACHE_LOG'] = cache_log
+	return env
+
+
+def summarize(session, stats, cache_log):
+	hits = misses = 0
+	if os.path.exists(cache_log):
+		with open(cache_log) as f:
+			for line in f:
+				if line.strip() == 'hit':
+					hits += 1
+				elif line.strip() == 'miss':
+					misses += 1
+	latencies = stats['latencies']
+	rs = dict(session)
+	rs.update({
+		'started': stats['started'],
+		'completed': stats['completed'],
+		'errors': stats['errors'],
+		'cancelled_ratio': stats['cancelled'] / stats['started'] if stats['started'] > 0 else 0,
+		'recorded_cancelled_ratio': session['recorded_cancelled'] / session['versions'] if session['versions'] > 0 else 0,
+		'p50': percentile(latencies, 50),
+		'p90': percentile(latencies, 90),
+		'p99': percentile(latencies, 99),
+		'max': max(latencies) if latencies else 0,
+		'cache_hits': hits,
+		'cache_hit_rate': hits / (hits + misses) if hits + misses > 0 else 0,
+	})
+	return rs
+
+
+def main():
+	parser = argparse.ArgumentParser()
+	parser.add_argument('logs', nargs='+', help='snippy_log_* directories')
+	parser.add_argument('--speed', type=float, default=1, help='pacing relative to the recording, 0 to never cancel')
+	parser.add_argument('--cwd', help='directory to run the programs in, for programs that read files')
+	parser.add_argument('--cache-dir', help='result cache to use, by default a fresh one per log')
+	parser.add_argument('--json', help='also write the results to this json file')
+	args = parser.parse_args()
+
+	results = {}
+	print('%-40s %5s %5s %7s %7s %8s %8s %8s %6s' % (
+		'log', 'runs', 'prev', 'cancel', 'rec.cnc', 'p50 (s)', 'p90 (s)', 'p99 (s)', 'hits'))
+	for log_dir in args.logs:
+		(versions, session) = read_session(log_dir)
+		if len(versions) == 0:
+			print('%-40s no program versions' % os.path.basename(os.path.normpath(log_dir)))
+			continue
+		with tempfile.TemporaryDirectory() as tmp:
+			cache_log = os.path.join(tmp, 'cache.log')
+			env = replay_env(args.cache_dir or os.path.join(tmp, 'cache'), cache_log)
+			stats = replay(versions, args.speed, args.cwd, env, tmp)
+			rs = summarize(session, stats, cache_log)
+		name = os.path.basename(os.path.normpath(log_dir))
+		results[name] = rs
+		print('%-40s %5d %5d %6.0f%% %6.0f%% %8.3f %8.3f %8.3f %5.0f%%' % (
+			name, rs['started'], rs['previews'], 100 * rs['cancelled_ratio'],
+			100 * rs['recorded_cancelled_ratio'], rs['p50'], rs['p90'], rs['p99'],
+			100 * rs['cache_hit_rate']))
+
+	if args.json:
+		with open(args.json, 'w') as f:
+			json.dump(results, f, indent=1, sort_keys=True)
+	return 0
+
+
+if __name__ == '__main__':
+	sys.exit(main())
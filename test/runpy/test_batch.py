@@ -0,0 +1,87 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class BatchTest(unittest.TestCase):
+	# A values file holding a list runs the program once per set of
+	# overrides, each set in a child process from the earliest override
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		self.env.pop('RUNPY_CACHE', None)
+		self.env.pop('RUNPY_CAPTURE_OUTPUT', None)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def path(self, name):
+		return os.path.join(self.dir, name)
+
+	def run_batch(self, program, value_sets):
+		with open(self.path('prog.py'), 'w') as f:
+			f.write(program)
+		with open(self.path('values.json'), 'w') as f:
+			json.dump(value_sets, f)
+		rs = subprocess.run(
+			[sys.executable, RUNPY, 'prog.py', 'values.json'],
+			cwd=self.dir,
+			env=self.env,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.PIPE,
+			text=True)
+		with open(self.path('prog.py.out')) as f:
+			return (rs.stdout, rs.stderr, json.load(f))
+
+	def test_children_run_one_per_cpu_and_print_in_order(self):
+		program = (
+			'import sys, time\n'
+			'x = 0\n'
+			'with open("log", "a") as f: f.write("+")\n'
+			'print("out", x)\n'
+			'time.sleep(0.1)\n'
+			'print("err", x, file=sys.stderr)\n'
+			'with open("log", "a") as f: f.write("-")\n')
+		n = (os.cpu_count() or 1) * 2 + 1
+		(stdout, stderr, outputs) = self.run_batch(program, [{'(2,2)': {'x': str(i)}} for i in range(n)])
+		self.assertEqual(len(outputs), n)
+		self.assertEqual([o[0] for o in outputs], [0] * n)
+		self.assertEqual([o[2]['3'][0]['x'] for o in outputs], [str(i) for i in range(n)])
+		self.assertEqual(stdout, ''.join('out %d\n' % i for i in range(n)))
+		self.assertEqual(stderr, ''.join('err %d\n' % i for i in range(n)))
+		with open(self.path('log')) as f:
+			log = f.read()
+		(running, most) = (0, 0)
+		for c in log:
+			running += 1 if c == '+' else -1
+			most = max(most, running)
+		self.assertEqual(len(log), 2 * n)
+		self.assertLessEqual(most, os.cpu_count() or 1)
+
+	def test_child_that_exits(self):
+		program = (
+			'import os\n'
+			'x = 0\n'
+			'if x == 1: os._exit(3)\n')
+		(_, _, outputs) = self.run_batch(program, [{'(2,2)': {'x': str(i)}} for i in range(3)])
+		self.assertEqual([o[0] for o in outputs], [0, 2, 0])
+
+	def test_child_that_fails(self):
+		program = (
+			'x = 0\n'
+			'y = 1 // x\n')
+		(_, stderr, outputs) = self.run_batch(program, [{'(1,1)': {'x': str(i)}} for i in range(3)])
+		self.assertEqual([o[0] for o in outputs], [2, 0, 0])
+		self.assertEqual(stderr.count('ZeroDivisionError'), 1)
+		self.assertIn('Traceback', stderr)
+
+
+if __name__ == '__main__':
+	unittest.main()
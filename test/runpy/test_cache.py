@@ -0,0 +1,128 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class ResultCacheTest(unittest.TestCase):
+	# Each test runs a program twice with the result cache on, changing
+	# something the program depends on in between. The second run must
+	# not be replayed from the first.
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.log = os.path.join(self.dir, 'cache.log')
+		self.env = dict(os.environ)
+		self.env['RUNPY_CACHE'] = '1'
+		self.env['RUNPY_CACHE_DIR'] = os.path.join(self.dir, 'cache')
+		self.env['RUNPY_CACHE_LOG'] = self.log
+		self.env.pop('RUNPY_CAPTURE_OUTPUT', None)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def path(self, name):
+		return os.path.join(self.dir, name)
+
+	def write(self, name, text):
+		with open(self.path(name), 'w') as f:
+			f.write(text)
+
+	def run_program(self, program):
+		self.write('prog.py', program)
+		rs = subprocess.run(
+			[sys.executable, RUNPY, 'prog.py'],
+			cwd=self.dir,
+			env=self.env,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.PIPE,
+			text=True)
+		return rs.stdout
+
+	def lookups(self):
+		with open(self.log) as f:
+			return [l.strip() for l in f]
+
+	def test_cache_is_opt_in(self):
+		del self.env['RUNPY_CACHE']
+		self.run_program('x = 1\n')
+		self.assertFalse(os.path.exists(self.log))
+
+	def test_unchanged_program_is_replayed(self):
+		self.assertEqual(self.run_program('print(1)\n'), '1\n')
+		self.assertEqual(self.run_program('print(1)\n'), '1\n')
+		self.assertEqual(self.lookups(), ['miss', 'hit'])
+
+	def test_measuring_runs_always_execute(self):
+		for mode in ['RUNPY_PROFILE', 'RUNPY_LINE_PROFILE', 'RUNPY_MEMORY', 'RUNPY_LOAD_CACHE']:
+			env = dict(self.env)
+			self.env[mode] = '1'
+			self.assertEqual(self.run_program('print(1)\n'), '1\n')
+			self.assertEqual(self.run_program('print(1)\n'), '1\n')
+			self.env = env
+		self.assertFalse(os.path.exists(self.log))
+
+	def test_missing_file_created_later(self):
+		program = (
+			'try:\n'
+			'\tprint(open("data.txt").read())\n'
+			'except FileNotFoundError:\n'
+			'\tprint("missing")\n')
+		self.assertEqual(self.run_program(program), 'missing\n')
+		self.write('data.txt', 'found')
+		self.assertEqual(self.run_program(program), 'found\n')
+
+	def test_pathlib_read(self):
+		program = 'import pathlib\nprint(pathlib.Path("d2.txt").read_text())\n'
+		self.write('d2.txt', 'one')
+		self.assertEqual(self.run_program(program), 'one\n')
+		self.write('d2.txt', 'three')
+		self.assertEqual(self.run_program(program), 'three\n')
+
+	def test_io_open(self):
+		program = 'import io\nprint(io.open("d3.txt").read())\n'
+		self.write('d3.txt', 'one')
+		self.assertEqual(self.run_program(program), 'one\n')
+		self.write('d3.txt', 'three')
+		self.assertEqual(self.run_program(program), 'three\n')
+
+	def test_numpy_loadtxt(self):
+		try:
+			import numpy
+		except ImportError:
+			self.skipTest('numpy is not installed')
+		program = 'import numpy as np\nprint(int(np.loadtxt("n.txt").sum()))\n'
+		self.write('n.txt', '1 2\n')
+		self.assertEqual(self.run_program(program), '3\n')
+		self.write('n.txt', '1 2 30\n')
+		self.assertEqual(self.run_program(program), '33\n')
+
+	def test_pathlib_write_is_not_cached(self):
+		program = 'import pathlib\npathlib.Path("out.txt").write_text("x")\n'
+		self.run_program(program)
+		os.remove(self.path('out.txt'))
+		self.run_program(program)
+		self.assertTrue(os.path.exists(self.path('out.txt')))
+
+	def test_listdir(self):
+		os.mkdir(self.path('files'))
+		program = 'import os\nprint(sorted(os.listdir("files")))\n'
+		self.assertEqual(self.run_program(program), '[]\n')
+		self.write('files/a.txt', '')
+		self.assertEqual(self.run_program(program), "['a.txt']\n")
+
+	def test_glob(self):
+		os.mkdir(self.path('files'))
+		program = 'import glob\nprint(sorted(glob.glob("files/*.txt")))\n'
+		self.assertEqual(self.run_program(program), '[]\n')
+		self.write('files/a.txt', '')
+		self.assertEqual(self.run_program(program), "['files/a.txt']\n")
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,84 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class OutputCaptureTest(unittest.TestCase):
+	# Programs run with RUNPY_CAPTURE_OUTPUT=1, as the editor runs them
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		self.env['RUNPY_CAPTURE_OUTPUT'] = '1'
+		self.env.pop('RUNPY_CACHE', None)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, program):
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(program)
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			data = json.load(f)
+		output = data[3]['output'] if len(data) > 3 else []
+		text = {'stdout': '', 'stderr': ''}
+		for chunk in output:
+			text[chunk['stream']] += chunk['text']
+		return (data[0], text)
+
+	def test_stream_attributes(self):
+		(rc, text) = self.run_program(
+			'import sys\n'
+			'print(sys.stdout.encoding, sys.stdout.errors, sys.stderr.errors)\n'
+			'print(sys.stdout.isatty(), sys.stdout.writable())\n')
+		self.assertEqual(rc, 0)
+		self.assertEqual(text['stdout'], 'utf-8 strict backslashreplace\nFalse True\n')
+
+	def test_buffer_write(self):
+		(rc, text) = self.run_program(
+			'import sys\n'
+			'sys.stdout.buffer.write(b"caf\\xc3")\n'
+			'sys.stdout.buffer.write(b"\\xa9\\n")\n'
+			'sys.stderr.buffer.write("é\\n".encode())\n')
+		self.assertEqual(rc, 0)
+		self.assertEqual(text, {'stdout': 'café\n', 'stderr': 'é\n'})
+
+	def test_text_and_buffer_writes_keep_their_order(self):
+		(rc, text) = self.run_program(
+			'import sys\n'
+			'print("a", end="")\n'
+			'sys.stdout.buffer.write(b"b")\n'
+			'print("c")\n')
+		self.assertEqual(rc, 0)
+		self.assertEqual(text['stdout'], 'abc\n')
+
+	def test_fileno_is_unsupported(self):
+		(rc, text) = self.run_program(
+			'import io, sys\n'
+			'try:\n'
+			'\tsys.stdout.fileno()\n'
+			'except io.UnsupportedOperation:\n'
+			'\tprint("unsupported")\n')
+		self.assertEqual(rc, 0)
+		self.assertEqual(text['stdout'], 'unsupported\n')
+
+	def test_write_bytes_to_text_stream(self):
+		(rc, text) = self.run_program(
+			'import sys\n'
+			'try:\n'
+			'\tsys.stdout.write(b"x")\n'
+			'except TypeError:\n'
+			'\tprint("type error")\n')
+		self.assertEqual(rc, 0)
+		self.assertEqual(text['stdout'], 'type error\n')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,100 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class CheckTest(unittest.TestCase):
+	# `run.py --check file` runs each program of file untraced and
+	# reports how far it got
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		self.env['RUNPY_CHECK_TIMEOUT'] = '0.5'
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def check(self, *programs):
+		file = os.path.join(self.dir, 'check.json')
+		with open(file, 'w') as f:
+			json.dump(programs, f)
+		rs = subprocess.run([sys.executable, RUNPY, '--check', file], cwd=self.dir, env=self.env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		self.assertEqual(rs.returncode, 0)
+		with open(file + '.out') as f:
+			return json.load(f)
+
+	def test_asserts_are_counted(self):
+		(check,) = self.check(
+			'def f(x):\n'
+			'\treturn x * 2\n'
+			'for i in range(3):\n'
+			'\tassert f(i) == i * 2\n'
+			'assert f(1) == 2, "f(1)"\n')
+		self.assertTrue(check['ok'])
+		self.assertEqual(check['exception'], None)
+		self.assertEqual(check['asserts'], {'4': [3, 0], '5': [1, 0]})
+
+	def test_failed_assert_ends_the_run(self):
+		# Without the assert, xs[0] would fail too
+		(check,) = self.check(
+			'xs = []\n'
+			'assert len(xs) > 0\n'
+			'y = xs[0]\n'
+			'assert y == 1\n')
+		self.assertFalse(check['ok'])
+		self.assertEqual(check['exception'], None)
+		self.assertEqual(check['asserts'], {'2': [0, 1]})
+
+	def test_failed_assert_can_be_caught(self):
+		(check,) = self.check(
+			'try:\n'
+			'\tassert 1 == 2, "no"\n'
+			'except AssertionError as e:\n'
+			'\tmessage = str(e)\n'
+			'assert message == "no"\n')
+		self.assertFalse(check['ok'])
+		self.assertEqual(check['exception'], None)
+		self.assertEqual(check['asserts'], {'2': [0, 1], '5': [1, 0]})
+
+	def test_exceptions(self):
+		checks = self.check(
+			'x = 1\n'
+			'y = x / 0\n',
+			'import sys\n'
+			'sys.exit(0)\n',
+			'import sys\n'
+			'sys.exit(3)\n')
+		self.assertEqual(checks[0]['exception'], {'type': 'ZeroDivisionError', 'message': 'division by zero', 'lineno': 2})
+		self.assertTrue(checks[1]['ok'])
+		self.assertFalse(checks[2]['ok'])
+		self.assertEqual(checks[2]['exception']['type'], 'SystemExit')
+
+	def test_timeout(self):
+		(slow, fast) = self.check(
+			'while True:\n'
+			'\tpass\n',
+			'assert True\n')
+		self.assertFalse(slow['ok'])
+		self.assertTrue(slow['timeout'])
+		self.assertGreaterEqual(slow['seconds'], 0.5)
+		self.assertTrue(fast['ok'])
+		self.assertFalse(fast['timeout'])
+
+	def test_programs_start_from_the_same_state(self):
+		checks = self.check(*[
+			'import os\n'
+			'os.environ["SEEN"] = os.environ.get("SEEN", "") + "x"\n'
+			'assert os.environ["SEEN"] == "x"\n'
+		] * 3)
+		self.assertEqual([check['ok'] for check in checks], [True] * 3)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+LIMIT = 'Projection Boxes Maximum Limit Reached'
+
+# Loops forever on lines 4-5, with only line 2 and 3 in focus
+PROGRAM = (
+	'def f():\n'
+	'\tx = 0\n'
+	'\ty = 1\n'
+	'\twhile True:\n'
+	'\t\tx += 1\n'
+	'\n'
+	'f()\n')
+
+
+class FocusTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		for k in ['RUNPY_CACHE', 'RUNPY_CAPTURE_OUTPUT', 'RUNPY_FOCUS']:
+			self.env.pop(k, None)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, program):
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(program)
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=60)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def limit_reached(self, data):
+		return any(LIMIT in env.get('Exception Thrown', '') for envs in data.values() for env in envs)
+
+	def test_limit_without_focus(self):
+		(rc, _, data) = self.run_program(PROGRAM)
+		self.assertEqual(rc, 0)
+		self.assertTrue(self.limit_reached(data))
+
+	def test_lines_out_of_focus_count_toward_limit(self):
+		self.env['RUNPY_FOCUS'] = '2-3'
+		(rc, _, data) = self.run_program(PROGRAM)
+		self.assertEqual(rc, 0)
+		self.assertTrue(self.limit_reached(data))
+		# Only lines in focus (0-based here) are recorded
+		self.assertLessEqual({env['_projection_boxes_lineno'] for envs in data.values() for env in envs}, {1, 2})
+
+	def test_function_focus(self):
+		self.env['RUNPY_FOCUS'] = 'g'
+		(rc, _, data) = self.run_program(
+			'def g(n):\n'
+			'\treturn n + 1\n'
+			'\n'
+			'a = g(1)\n'
+			'b = g(2)\n')
+		self.assertEqual(rc, 0)
+		self.assertEqual([(env['n'], env['rv']) for env in data['1']], [('1', '2'), ('2', '3')])
+		self.assertFalse('3' in data or '4' in data)
+
+	def test_calls_returning_out_of_focus(self):
+		# Each call's frame may reuse the id() of the last one, which
+		# returned on a line out of focus. Its events mustn't follow on
+		# from the last call's.
+		self.env['RUNPY_FOCUS'] = '2-3'
+		program = (
+			'def f(x):\n'
+			'\ty = x * 2\n'
+			'\tz = y + 1\n'
+			'\treturn z\n'
+			'\n'
+			'for i in range(3):\n'
+			'\tf(i)\n')
+		for selective in ['0', '1']:
+			self.env['RUNPY_SELECTIVE'] = selective
+			(rc, _, data) = self.run_program(program)
+			self.assertEqual(rc, 0)
+			self.assertEqual([(env['x'], env['y']) for env in data['1']], [('0', '0'), ('1', '2'), ('2', '4')])
+			self.assertEqual(data.get('2', []), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,58 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class LibraryFramesTest(unittest.TestCase):
+	# Library frames run without a local trace function, see
+	# Logger.trace_dispatch, but program code they call is traced
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		for k in ['RUNPY_CACHE', 'RUNPY_FOCUS', 'RUNPY_MODULES']:
+			self.env.pop(k, None)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, program):
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(program)
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def test_callback_from_library(self):
+		# With indent, json encodes in Python and calls default from there
+		(rc, _, data) = self.run_program(
+			'import json, sys\n'
+			'def default(o):\n'
+			'\ttraced = sys._getframe(1).f_trace != None\n'
+			'\treturn sorted(o)\n'
+			's = json.dumps({"a": {3, 1}}, default=default, indent=1)\n')
+		self.assertEqual(rc, 0)
+		self.assertEqual(data['2'][0]['traced'], 'False')
+		self.assertEqual(data['3'][0]['rv'], '[1, 3]')
+		self.assertEqual(data['4'][0]['s'], repr('{\n "a": [\n  1,\n  3\n ]\n}'))
+
+	def test_generated_code(self):
+		# namedtuple execs its __new__ from "<string>" like the program,
+		# but in globals of its own. Its line 1 isn't the program's.
+		(rc, _, data) = self.run_program(
+			'from collections import namedtuple\n'
+			'P = namedtuple("P", "x y")\n'
+			'p = P(1, 2)\n')
+		self.assertEqual(rc, 0)
+		self.assertEqual(len(data['0']), 1)
+		self.assertEqual(data['2'][0]['p'], 'P(x=1, y=2)')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+PROGRAM = (
+	'import json\n'
+	'import numpy as np\n'
+	'with open("data.json") as f:\n'
+	'\td = json.load(f)\n'
+	'd["xs"].append(0)\n'
+	'a = np.load("a.npy")\n'
+	'a[0] += 1\n'
+	'print(len(d["xs"]), a[0])\n')
+
+
+class LoadCacheTest(unittest.TestCase):
+	# With RUNPY_LOAD_CACHE=1, --serve keeps what data loaders returned
+	# across runs, and hands each run a copy of its own
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		env = dict(os.environ)
+		env.pop('RUNPY_CACHE', None)
+		env.pop('RUNPY_CAPTURE_OUTPUT', None)
+		env['RUNPY_LOAD_CACHE'] = '1'
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(PROGRAM)
+		self.write_data([1, 2, 3])
+		np.save(os.path.join(self.dir, 'a.npy'), np.zeros(3, dtype=int))
+		self.server = subprocess.Popen(
+			[sys.executable, RUNPY, '--serve'],
+			cwd=self.dir,
+			env=env,
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			text=True)
+
+	def tearDown(self):
+		self.server.stdin.close()
+		self.server.wait()
+		self.server.stdout.close()
+		self.tmp.cleanup()
+
+	def write_data(self, xs):
+		with open(os.path.join(self.dir, 'data.json'), 'w') as f:
+			json.dump({'xs': xs}, f)
+
+	def run_program(self):
+		self.server.stdin.write(json.dumps({'file': 'prog.py', 'cwd': self.dir}) + '\n')
+		self.server.stdin.flush()
+		response = json.loads(self.server.stdout.readline())
+		return (response['stdout'], response['full'][3]['load_cache'])
+
+	def test_hits_are_copies(self):
+		(out, stats) = self.run_program()
+		self.assertEqual(out, '4 1\n')
+		self.assertEqual((stats['hits'], stats['misses']), (0, 2))
+		# What a run does to its values isn't in the next one's
+		for _ in range(2):
+			(out, stats) = self.run_program()
+			self.assertEqual(out, '4 1\n')
+			self.assertEqual((stats['hits'], stats['misses']), (2, 0))
+
+	def test_changed_file_is_loaded_again(self):
+		self.run_program()
+		self.write_data([1, 2, 3, 4, 5])
+		(out, stats) = self.run_program()
+		self.assertEqual(out, '6 1\n')
+		self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,91 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src')
+RUNPY = os.path.join(SRC, 'run.py')
+
+MB = 8000000
+
+
+class MemoryProfileTest(unittest.TestCase):
+	# RUNPY_MEMORY=1 adds [net bytes, peak] to events and "memory" to
+	# the extras, by 0-based line
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		self.env.pop('RUNPY_CACHE', None)
+		self.env['RUNPY_MEMORY'] = '1'
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, program):
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(program)
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def assertAbout(self, n, expected):
+		self.assertLess(abs(n - expected), 100000)
+
+	def test_lines(self):
+		(rc, _, data, extras) = self.run_program(
+			'a = [0] * 1000000\n'
+			'del a\n'
+			'n = len([0] * 1000000)\n')
+		self.assertEqual(rc, 0)
+		lines = extras['memory']['lines']
+		# [runs, net bytes, largest peak]
+		self.assertEqual(lines['0'][0], 1)
+		self.assertAbout(lines['0'][1], MB)
+		self.assertAbout(lines['1'][1], -MB)
+		# A list that's gone by the end of its line only shows in the peak
+		self.assertAbout(lines['2'][1], 0)
+		self.assertAbout(lines['2'][2], MB)
+		self.assertAbout(extras['memory']['peak'], MB)
+		self.assertEqual(data['0'][0]['_projection_boxes_memory'], lines['0'][1:])
+
+	def test_calls_count_toward_their_line(self):
+		(rc, _, _, extras) = self.run_program(
+			'def f():\n'
+			'\treturn [0] * 1000000\n'
+			'a = f()\n')
+		self.assertEqual(rc, 0)
+		self.assertAbout(extras['memory']['lines']['2'][1], MB)
+
+	def test_without_reset_peak(self):
+		# Before Python 3.9, tracemalloc has no reset_peak
+		sys.path.insert(0, SRC)
+		try:
+			import run
+		finally:
+			sys.path.remove(SRC)
+		profile = run.MemoryProfile()
+		profile.reset_peak = None
+		profile.start()
+		try:
+			profile.event(1, 0)
+			profile.end_event()
+			a = [0] * 1000000
+			profile.event(1, 1)
+			profile.end_event()
+			n = len([0] * 1000000)
+			profile.event(1, 2)
+			profile.end_event()
+		finally:
+			profile.stop()
+		self.assertAbout(profile.lines[0][1], MB)
+		# Peaks are only what there was at the events
+		self.assertAbout(profile.lines[1][1], 0)
+		self.assertAbout(profile.lines[1][2], 0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,83 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class LocalModulesTest(unittest.TestCase):
+	# RUNPY_MODULES lists local modules traced along with the program,
+	# their writes and data go in the "modules" extras
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		for k in ['RUNPY_CACHE', 'RUNPY_FOCUS', 'RUNPY_MODULES']:
+			self.env.pop(k, None)
+		self.write('helper.py',
+			'def double(x):\n'
+			'\ty = x * 2\n'
+			'\treturn y\n')
+		self.write('other.py',
+			'def inc(x):\n'
+			'\treturn x + 1\n')
+		self.write('prog.py',
+			'import helper, other\n'
+			'a = helper.double(3)\n'
+			'b = other.inc(a)\n')
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def write(self, name, text):
+		with open(os.path.join(self.dir, name), 'w') as f:
+			f.write(text)
+
+	def run_program(self):
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def test_listed_modules_are_traced(self):
+		self.env['RUNPY_MODULES'] = 'helper.py'
+		(rc, _, data, extras) = self.run_program()
+		self.assertEqual(rc, 0)
+		self.assertEqual(list(extras['modules'].keys()), ['helper.py'])
+		helper = extras['modules']['helper.py']
+		self.assertEqual(helper['writes'], {'1': ['y']})
+		self.assertEqual(helper['data']['1'][0]['y'], '6')
+		self.assertEqual(helper['data']['2'][0]['rv'], '6')
+		# The module's lines don't end up on the program's
+		self.assertEqual(len(data['1']), 1)
+		self.assertEqual(data['1'][0]['a'], '6')
+		self.assertEqual(data['2'][0]['b'], '7')
+
+	def test_modules_are_traced_again_in_serve(self):
+		# The modules are imported anew in each run, changes and all
+		self.env['RUNPY_MODULES'] = 'helper.py'
+		server = subprocess.Popen([sys.executable, RUNPY, '--serve'], cwd=self.dir, env=self.env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+		try:
+			rs = []
+			for factor in ['2', '5']:
+				self.write('helper.py', 'def double(x):\n\ty = x * %s\n\treturn y\n' % factor)
+				server.stdin.write(json.dumps({'file': 'prog.py', 'cwd': self.dir}) + '\n')
+				server.stdin.flush()
+				rs.append(json.loads(server.stdout.readline())['full'])
+		finally:
+			server.stdin.close()
+			server.wait()
+			server.stdout.close()
+		self.assertEqual([r[3]['modules']['helper.py']['data']['1'][0]['y'] for r in rs], ['6', '15'])
+
+	def test_modules_are_not_traced_by_default(self):
+		(rc, _, data) = self.run_program()
+		self.assertEqual(rc, 0)
+		self.assertEqual(data['2'][0]['b'], '7')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,87 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src')
+RUNPY = os.path.join(SRC, 'run.py')
+
+PROGRAM = (
+	'def f(n):\n'
+	'\ts = 0\n'
+	'\tfor i in range(n):\n'
+	'\t\ts += i\n'
+	'\treturn s\n'
+	'\n'
+	'class C:\n'
+	'\tdef m(self):\n'
+	'\t\treturn f(3)\n'
+	'\n'
+	'a = f(4)\n'
+	'b = C().m()\n')
+
+
+class LineProfileTest(unittest.TestCase):
+	# RUNPY_LINE_PROFILE=1 adds "lines" and "functions" to the extras
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		self.env.pop('RUNPY_CACHE', None)
+		self.env['RUNPY_LINE_PROFILE'] = '1'
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, program):
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(program)
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def test_line_hits(self):
+		(rc, _, _, extras) = self.run_program(PROGRAM)
+		self.assertEqual(rc, 0)
+		hits = {int(lineno): stats[0] for (lineno, stats) in extras['lines'].items()}
+		# 0-based: s = 0, the loop header, its body and the return
+		self.assertEqual([hits[1], hits[2], hits[3], hits[4]], [2, 9, 7, 2])
+		self.assertEqual([hits[10], hits[11]], [1, 1])
+		self.assertTrue(all(stats[1] >= 0 for stats in extras['lines'].values()))
+
+	def test_functions(self):
+		(rc, _, _, extras) = self.run_program(PROGRAM)
+		self.assertEqual(rc, 0)
+		functions = {f['name']: f for f in extras['functions']}
+		self.assertEqual((functions['f']['lineno'], functions['f']['calls']), (0, 2))
+		self.assertEqual((functions['C.m']['lineno'], functions['C.m']['calls']), (7, 1))
+		self.assertEqual(functions['<module>']['calls'], 1)
+		# f's time includes both its calls, so it's at least the sum of
+		# its lines'
+		lines = extras['lines']
+		self.assertGreaterEqual(functions['f']['time'] + 1e-5, sum(lines[str(l)][1] for l in range(1, 5)))
+
+	def test_code_without_qualname(self):
+		# Before Python 3.11, code objects have no co_qualname
+		sys.path.insert(0, SRC)
+		try:
+			import run
+		finally:
+			sys.path.remove(SRC)
+		profile = run.LineProfile()
+
+		class Code:
+			co_name = 'f'
+			co_firstlineno = 3
+
+		code = Code()
+		profile.call(code)
+		profile.hit(code, 3)
+		self.assertEqual(profile.to_json()['functions'], [{'name': 'f', 'lineno': 2, 'calls': 1, 'time': 0.0}])
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,92 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class SelectiveTest(unittest.TestCase):
+	# RUNPY_SELECTIVE=1 copies values that can't have changed from the
+	# frame's last event. The result must be the same as without it.
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		for k in ['RUNPY_CACHE', 'RUNPY_CAPTURE_OUTPUT', 'RUNPY_FOCUS', 'RUNPY_SELECTIVE']:
+			self.env.pop(k, None)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, program, selective):
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(program)
+		env = dict(self.env)
+		env['RUNPY_SELECTIVE'] = selective
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def resolve(self, data):
+		# Fills in the values an event refers to with "^"
+		events = {env['_projection_boxes_time']: env for envs in data.values() for env in envs if '_projection_boxes_time' in env}
+		for t in sorted(events):
+			env = events[t]
+			base = env.pop('^', None)
+			for (k, r) in env.items():
+				if r == None:
+					env[k] = events[base][k]
+		return data
+
+	def assertSameAsFull(self, program):
+		(rc, writes, data) = self.run_program(program, '1')
+		self.assertEqual((rc, writes, self.resolve(data)), tuple(self.run_program(program, '0')))
+		return data
+
+	def test_rebinding(self):
+		data = self.assertSameAsFull(
+			'x = 1\n'
+			'y = x + 1\n'
+			'x = y * 2\n')
+		self.assertEqual(data['2'][0]['x'], '4')
+
+	def test_mutating_call_on_alias(self):
+		data = self.assertSameAsFull(
+			'a = []\n'
+			'b = a\n'
+			'for i in range(3):\n'
+			'\tb.append(i)\n'
+			'c = 0\n')
+		self.assertEqual(data['4'][0]['a'], '[0, 1, 2]')
+
+	def test_item_assignment_on_alias(self):
+		data = self.assertSameAsFull(
+			'a = [0]\n'
+			'b = a\n'
+			'b[0] = 5\n'
+			'c = 0\n')
+		self.assertEqual(data['3'][0]['a'], '[5]')
+
+	def test_augmented_assignment_on_alias(self):
+		self.assertSameAsFull(
+			'a = [0]\n'
+			'b = a\n'
+			'b += [1]\n'
+			'c = 0\n')
+
+	def test_lines_out_of_focus(self):
+		# x changes on a line that isn't recorded between two that are
+		self.env['RUNPY_FOCUS'] = '2-3'
+		self.assertSameAsFull(
+			'x = 0\n'
+			'for i in range(3):\n'
+			'\ty = i\n'
+			'\tx = x + 1\n')
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,134 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class ServeTest(unittest.TestCase):
+	# run.py --serve runs the programs in its own process, one JSON
+	# request and response per line on stdin and stdout
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.lib = os.path.join(self.dir, 'lib')
+		self.work = os.path.join(self.dir, 'work')
+		os.mkdir(self.lib)
+		os.mkdir(self.work)
+		self.env = dict(os.environ)
+		self.env.pop('RUNPY_CACHE', None)
+		self.env.pop('RUNPY_CAPTURE_OUTPUT', None)
+		self.env['PYTHONPATH'] = self.lib
+		self.start()
+
+	def tearDown(self):
+		self.stop()
+		self.tmp.cleanup()
+
+	def start(self):
+		self.server = subprocess.Popen(
+			[sys.executable, RUNPY, '--serve'],
+			cwd=self.work,
+			env=self.env,
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			text=True)
+
+	def stop(self):
+		self.server.stdin.close()
+		self.server.wait()
+		self.server.stdout.close()
+
+	def write(self, path, text):
+		with open(path, 'w') as f:
+			f.write(text)
+
+	def run_program(self, program, base=None):
+		self.write(os.path.join(self.work, 'prog.py'), program)
+		request = {'doc': 'prog', 'file': 'prog.py', 'cwd': self.work}
+		if base != None:
+			request['base'] = base
+		self.server.stdin.write(json.dumps(request) + '\n')
+		self.server.stdin.flush()
+		return json.loads(self.server.stdout.readline())
+
+	def test_program_gets_no_input(self):
+		response = self.run_program('x = input()\n')
+		self.assertEqual(response['full'][0], 2)
+		self.assertIn('EOFError', response['full'][2]['0'][0]['Exception Thrown'])
+
+	def test_program_cannot_write_to_the_client(self):
+		response = self.run_program('import os\nos.write(1, b"junk\\n")\nprint("printed")\n')
+		self.assertEqual(response['stdout'], 'printed\n')
+		self.assertEqual(self.run_program('x = 1\n')['full'][0], 0)
+
+	def test_program_that_exits(self):
+		first = self.run_program('print(1)\n')
+		response = self.run_program('import sys\nprint(2)\nsys.exit(0)\n', first['version'])
+		self.assertIn('error', response)
+		self.assertEqual(response['stdout'], '2\n')
+		response = self.run_program('print(1)\n', first['version'])
+		self.assertIn('full', response)
+
+	def apply_diff(self, old, diff):
+		# What a client does with a response's "diff", see result_diff
+		data = dict(old[2])
+		for (key, envs) in diff['lines'].items():
+			if envs == None:
+				del data[key]
+				continue
+			by_time = {env.get('_projection_boxes_time'): env for env in data.get(key, [])}
+			data[key] = [by_time[env] if isinstance(env, int) else env for env in envs]
+		result = [diff['return_code'], diff.get('writes', old[1]), data]
+		extras = diff.get('extras', old[3] if len(old) > 3 else None)
+		if extras != None:
+			result.append(extras)
+		return result
+
+	def test_diff_matches_envs_by_time(self):
+		program = (
+			'for i in range(3):\n'
+			'\tif i == %d:\n'
+			'\t\tprint("a")\n'
+			'\telse:\n'
+			'\t\tprint("b")\n')
+		first = self.run_program(program % 0)
+		second = self.run_program(program % 1, first['version'])
+		full = self.run_program(program % 1)['full']
+		self.assertIn('diff', second)
+		self.assertEqual(self.apply_diff(first['full'], second['diff']), full)
+		# The last print("b") happens at the same time in both runs, but
+		# it's the first env of its line in one and the second in the other
+		envs = second['diff']['lines']['4']
+		self.assertEqual([env['i'] for env in envs if isinstance(env, dict) and 'i' in env], ['0'])
+		self.assertEqual([env for env in envs if isinstance(env, int)], [full[2]['4'][2]['_projection_boxes_time']])
+
+	def test_startup_is_profiled_once(self):
+		self.stop()
+		self.env['RUNPY_PROFILE'] = '1'
+		self.start()
+		(first, second) = [self.run_program('x = 1\n')['full'][3]['phases'] for _ in range(2)]
+		self.assertIn('imports', first)
+		self.assertIn('startup_cpu', first)
+		self.assertNotIn('imports', second)
+		self.assertNotIn('startup_cpu', second)
+		self.assertIn('tracing', second)
+
+	def test_libraries_stay_loaded(self):
+		for d in [self.lib, self.work]:
+			self.write(os.path.join(d, os.path.basename(d) + 'mod.py'), 'runs = []\n')
+		program = (
+			'import libmod, workmod\n'
+			'libmod.runs.append(1)\n'
+			'workmod.runs.append(1)\n'
+			'print(len(libmod.runs), len(workmod.runs))\n')
+		self.assertEqual(self.run_program(program)['stdout'], '1 1\n')
+		self.assertEqual(self.run_program(program)['stdout'], '2 1\n')
+
+
+if __name__ == '__main__':
+	unittest.main()
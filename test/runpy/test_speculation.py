@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+PREFIX = 'import math\nxs = [1, 2, 3]\n'
+CODE = (
+	'total = 0\n'
+	'for x in xs:\n'
+	'\ttotal += math.sqrt(x)\n'
+	'print(round(total, 3))\n'
+	'ys = [x * total for x in xs]\n'
+	'print(len(ys))\n')
+SUFFIX = 'done = True\n'
+
+
+class SpeculationTest(unittest.TestCase):
+	# Requests with a "code" run a completion that's still streaming in,
+	# resuming from checkpoints left by earlier versions of it
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		env = dict(os.environ)
+		env.pop('RUNPY_CACHE', None)
+		env.pop('RUNPY_CAPTURE_OUTPUT', None)
+		self.server = subprocess.Popen(
+			[sys.executable, RUNPY, '--serve'],
+			cwd=self.dir,
+			env=env,
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			text=True)
+
+	def tearDown(self):
+		self.server.stdin.close()
+		self.server.wait()
+		self.server.stdout.close()
+		self.tmp.cleanup()
+
+	def request(self, request):
+		request['cwd'] = self.dir
+		self.server.stdin.write(json.dumps(request) + '\n')
+		self.server.stdin.flush()
+		return json.loads(self.server.stdout.readline())
+
+	def test_speculated_result_is_a_plain_run(self):
+		# The completion streams in a line at a time
+		lines = CODE.splitlines(True)
+		responses = []
+		for n in range(1, len(lines) + 1):
+			responses.append(self.request({
+				'doc': 'spec',
+				'file': 'spec.py',
+				'prefix': PREFIX,
+				'code': ''.join(lines[:n]),
+				'suffix': SUFFIX,
+			}))
+		last = responses[-1]
+		self.assertEqual(last['cut'], len(CODE))
+		self.assertTrue(any(r.get('resumed', 0) > 0 for r in responses))
+
+		with open(os.path.join(self.dir, 'plain.py'), 'w') as f:
+			f.write(PREFIX + CODE + SUFFIX)
+		plain = self.request({'doc': 'plain', 'file': 'plain.py'})
+		self.assertEqual(last['full'], plain['full'])
+		self.assertEqual(last['stdout'], plain['stdout'])
+		self.assertEqual(plain['stdout'], '4.146\n3\n')
+
+
+if __name__ == '__main__':
+	unittest.main()
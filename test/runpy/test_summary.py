@@ -0,0 +1,57 @@
+import ast
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class SummaryTest(unittest.TestCase):
+	# Big lists and tuples are shown as a summary, unless RUNPY_SUMMARIZE=0
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		self.env.pop('RUNPY_CACHE', None)
+		self.env.pop('RUNPY_SUMMARIZE', None)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, program):
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(program)
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def test_big_sequences_are_summarized(self):
+		(_, _, data) = self.run_program('xs = list(range(200))\nys = tuple(range(100))\n')
+		self.assertEqual(data['0'][0]['xs'], '[0, 1, 2, 3, 4, 5, 6, 7, 8, 9, ...] (len 200)')
+		self.assertEqual(ast.literal_eval(data['1'][0]['ys']), tuple(range(100)))
+
+	def test_full_values_evaluate_back(self):
+		self.env['RUNPY_SUMMARIZE'] = '0'
+		(_, _, data) = self.run_program('xs = list(range(200))\n')
+		self.assertEqual(ast.literal_eval(data['0'][0]['xs']), list(range(200)))
+
+	def test_full_values_are_overrides(self):
+		# What the synth boxes do: a value from one run overrides the
+		# variable in the next
+		self.env['RUNPY_SUMMARIZE'] = '0'
+		(_, _, data) = self.run_program('xs = list(range(200))\nn = len(xs)\n')
+		with open(os.path.join(self.dir, 'values.json'), 'w') as f:
+			json.dump({'(1,%d)' % data['0'][0]['_projection_boxes_time']: {'xs': data['0'][0]['xs']}}, f)
+		subprocess.run([sys.executable, RUNPY, 'prog.py', 'values.json'], cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			(rc, _, data) = json.load(f)
+		self.assertEqual(rc, 0)
+		self.assertEqual(data['1'][0]['n'], '200')
+
+
+if __name__ == '__main__':
+	unittest.main()
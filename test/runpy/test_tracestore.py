@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src')
+RUNPY = os.path.join(SRC, 'run.py')
+
+sys.path.insert(0, SRC)
+try:
+	import tracestore
+finally:
+	sys.path.remove(SRC)
+
+PROGRAM = (
+	'def f(x):\n'
+	'\treturn x * 2\n'
+	'total = 0\n'
+	'for i in range(4):\n'
+	'\ttotal += f(i)\n'
+	'done = True\n')
+
+
+class TraceStoreTest(unittest.TestCase):
+	# RUNPY_TRACE_STORE=1 writes the envs to <file>.trace instead of
+	# <file>.out, to be read a few lines or a time window at a time
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		self.env.pop('RUNPY_CACHE', None)
+		self.env.pop('RUNPY_TRACE_STORE', None)
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(PROGRAM)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, trace_store):
+		env = dict(self.env)
+		env['RUNPY_TRACE_STORE'] = trace_store
+		subprocess.run([sys.executable, RUNPY, 'prog.py'], cwd=self.dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def test_round_trip(self):
+		(rc, writes, data) = self.run_program('0')
+		(stored_rc, stored_writes, stored_data) = self.run_program('1')
+		self.assertEqual((stored_rc, stored_writes, stored_data), (rc, writes, {}))
+		with tracestore.TraceStore(os.path.join(self.dir, 'prog.py.trace')) as store:
+			self.assertEqual(store.query(), data)
+			self.assertEqual(sorted(store.line_keys()), sorted(data.keys()))
+			self.assertEqual(store.query(4, 5), {k: v for (k, v) in data.items() if k in ['4', '5']})
+
+			times = sorted(env['_projection_boxes_time'] for envs in data.values() for env in envs if '_projection_boxes_time' in env)
+			self.assertEqual(store.time_range(), [times[0], times[-1]])
+			for t in times:
+				env = store.env_at_time(t)
+				self.assertEqual(env['_projection_boxes_time'], t)
+			self.assertEqual(store.env_at_time(times[-1] + 1), None)
+
+	def test_time_window_keeps_loop_markers(self):
+		(_, _, data) = self.run_program('0')
+		self.run_program('1')
+		loop = data['4']
+		inside = [env['_projection_boxes_time'] for env in loop if '_projection_boxes_time' in env]
+		(start, end) = (inside[1], inside[2])
+		with tracestore.TraceStore(os.path.join(self.dir, 'prog.py.trace')) as store:
+			envs = store.envs_at('4', start, end)
+		self.assertEqual(envs, [env for env in loop if not '_projection_boxes_time' in env or start <= env['_projection_boxes_time'] <= end])
+		self.assertEqual(len([env for env in envs if '_projection_boxes_time' in env]), 2)
+
+	def test_serve(self):
+		self.run_program('1')
+		requests = [{'range': True}, {'time': 1}, {'lines': [5, 5]}, {'lines': 'nope'}]
+		rs = subprocess.run(
+			[sys.executable, os.path.join(SRC, 'tracestore.py'), 'serve', 'prog.py.trace'],
+			cwd=self.dir,
+			input=''.join(json.dumps(r) + '\n' for r in requests),
+			stdout=subprocess.PIPE,
+			text=True)
+		responses = [json.loads(line) for line in rs.stdout.splitlines()]
+		self.assertEqual(len(responses), len(requests))
+		self.assertEqual(responses[1]['_projection_boxes_time'], 1)
+		self.assertEqual(responses[2]['5'][0]['done'], 'True')
+		self.assertIn('error', responses[3])
+
+
+if __name__ == '__main__':
+	unittest.main()
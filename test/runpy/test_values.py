@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+RUNPY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'src', 'run.py')
+
+
+class ValuesTest(unittest.TestCase):
+	# A values file maps "(lineno,time)" to the values the variables get
+	# at that event, see compile_values
+
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.dir = self.tmp.name
+		self.env = dict(os.environ)
+		self.env.pop('RUNPY_CACHE', None)
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+	def run_program(self, program, values=None):
+		with open(os.path.join(self.dir, 'prog.py'), 'w') as f:
+			f.write(program)
+		args = [sys.executable, RUNPY, 'prog.py']
+		if values != None:
+			with open(os.path.join(self.dir, 'values.json'), 'w') as f:
+				json.dump(values, f)
+			args.append('values.json')
+		subprocess.run(args, cwd=self.dir, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		with open(os.path.join(self.dir, 'prog.py.out')) as f:
+			return json.load(f)
+
+	def test_override_one_call(self):
+		program = (
+			'def f(a):\n'
+			'\tb = a + 1\n'
+			'\treturn b\n'
+			'x = f(1)\n'
+			'y = f(2)\n')
+		(_, _, data) = self.run_program(program)
+		(first, second) = data['1']
+		# Envs sent back as they were shown, bookkeeping entries and all
+		env = dict(second)
+		env['b'] = '10'
+		# Not a variable of the line, so never evaluated
+		env['c'] = '1 +'
+		(rc, _, data) = self.run_program(program, {'(2,%d)' % second['_projection_boxes_time']: env})
+		self.assertEqual(rc, 0)
+		self.assertEqual([env['b'] for env in data['1']], ['2', '10'])
+		self.assertEqual(data['3'][0]['x'], '2')
+		self.assertEqual(data['4'][0]['y'], '10')
+
+	def test_override_at_a_time_that_never_comes(self):
+		program = 'x = 1\ny = x\n'
+		(rc, _, data) = self.run_program(program, {'(1,100)': {'x': '5'}})
+		self.assertEqual(rc, 0)
+		self.assertEqual(data['1'][0]['y'], '1')
+
+
+if __name__ == '__main__':
+	unittest.main()